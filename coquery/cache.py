@@ -13,9 +13,10 @@ from __future__ import unicode_literals
 
 import os
 import cachetools
+import hashlib
 import logging
-import sys
 import shutil
+import time
 
 
 try:
@@ -25,90 +26,330 @@ except ImportError:
 
 from . import options, NAME
 
+# default sizes of the disk tier and of the memory tier:
+DEFAULT_CACHE_SIZE = 500 * 1024 * 1024
+DEFAULT_MEMORY_SIZE = 100 * 1024 * 1024
+
+
+def replace_file(src, dst):
+    """
+    Rename the file src to dst, replacing dst if it exists.
+
+    os.replace() is not available in Python 2.7. There, os.rename() also
+    replaces an existing file on POSIX systems, but not on Windows, so the
+    existing file is removed first.
+    """
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        if os.name == "nt" and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def get_size(df):
+    """
+    Return the number of bytes used by the data frame, including the
+    contents of object columns.
+    """
+    try:
+        return int(df.memory_usage(index=True, deep=True).sum())
+    except AttributeError:
+        return 0
+
 
 class CoqQueryCache(object):
-    def __init__(self, read_cache=False):
-        self._cache = None
+    """
+    A two-tier cache for query results.
+
+    Each cached data frame is stored in a separate pickle file in the cache
+    directory. An index file keeps track of the cached entries, their sizes
+    and the number of times they have been used, so only the index needs to
+    be read when the cache is initialized. Data frames are loaded from disk
+    when they are requested, and are then kept in memory for subsequent
+    requests.
+
+    The memory tier and the disk tier have separate maximum sizes. Entries
+    are evicted from the memory tier if it is full, but remain on disk. The
+    least frequently used entries are removed from disk if the disk tier is
+    full.
+    """
+    INDEX_NAME = "coq_cache_index.pkl"
+    FOLDER_NAME = "coq_cache"
+    LEGACY_NAME = "coq_cache.db"
+
+    def __init__(self, read_cache=False, path=None,
+                 maxsize=None, memory_size=None):
+        """
+        Parameters
+        ----------
+        read_cache : bool
+            True if the index of an existing cache is read from the cache
+            path, or False if the cache starts empty.
+        path : str
+            The cache path. If None, the cache path from the configuration
+            is used.
+        maxsize : int
+            The maximum number of bytes used by the disk tier. If None, the
+            query cache size from the configuration is used.
+        memory_size : int
+            The maximum number of bytes used by the memory tier. If None,
+            the query cache memory size from the configuration is used.
+        """
+        self._path = path or options.cfg.cache_path
+        self.maxsize = (maxsize or
+                        getattr(options.cfg, "query_cache_size", None) or
+                        DEFAULT_CACHE_SIZE)
+        memory_size = (memory_size or
+                       getattr(options.cfg, "query_cache_memory_size", None) or
+                       DEFAULT_MEMORY_SIZE)
+        self._memory = self._new_memory_cache(min(memory_size, self.maxsize))
+        self._index = {}
         self._backup = None
+
         if read_cache:
-            path = os.path.join(options.cfg.cache_path, "coq_cache.db")
-            if os.path.exists(path):
-                try:
-                    self._cache = pickle.load(open(path, "rb"))
-                    s = "Using query cache (current size: {}, max size: {})."
-                    if options.cfg.verbose:
-                        s = s.format(self._cache.currsize, self._cache.maxsize)
-                        logger.info(s)
-                        print(s)
-                except (IOError, ValueError, EOFError):
-                    S = "Cannot read query cache, creating a new one (size: {})."
-                    S = S.format(options.cfg.query_cache_size)
-                    logger.warning(S)
-
-        if self._cache is None:
-            self._cache = cachetools.LFUCache(
-                maxsize=options.cfg.query_cache_size,
-                getsizeof=sys.getsizeof)
+            self._read_index()
+            if options.cfg.verbose:
+                s = "Using query cache (current size: {}, max size: {})."
+                s = s.format(self.size(), self.maxsize)
+                logger.info(s)
+                print(s)
+
+    @staticmethod
+    def _new_memory_cache(maxsize):
+        return cachetools.LFUCache(maxsize=maxsize, getsizeof=get_size)
+
+    def _folder(self, path=None):
+        return os.path.join(path or self._path, self.FOLDER_NAME)
+
+    def _entry_path(self, entry, path=None):
+        return os.path.join(self._folder(path), entry["file"])
+
+    def _read_index(self):
+        # remove the cache file that was used by previous versions:
+        legacy = os.path.join(self._path, self.LEGACY_NAME)
+        if os.path.exists(legacy):
+            try:
+                os.remove(legacy)
+            except OSError as e:
+                logger.warning(str(e))
+
+        path = os.path.join(self._path, self.INDEX_NAME)
+        if not os.path.exists(path):
+            return
+
+        try:
+            with open(path, "rb") as index_file:
+                index = pickle.load(index_file)
+        except Exception:
+            S = "Cannot read query cache, creating a new one (size: {})."
+            S = S.format(self.maxsize)
+            logger.warning(S)
+            index = {}
+
+        # only keep entries that still have a data file:
+        self._index = {key: entry for key, entry in index.items()
+                       if os.path.exists(self._entry_path(entry))}
+
+        # remove data files that are not listed in the index:
+        known = {entry["file"] for entry in self._index.values()}
+        if os.path.exists(self._folder()):
+            for file_name in os.listdir(self._folder()):
+                if file_name.endswith(".pkl") and file_name not in known:
+                    self._remove_file(file_name)
+
+        self._evict_disk(0)
+
+    def _write_index(self):
+        if not os.path.exists(self._path):
+            os.makedirs(self._path)
+        path = os.path.join(self._path, self.INDEX_NAME)
+        temp_path = "{}.tmp".format(path)
+        with open(temp_path, "wb") as index_file:
+            pickle.dump(self._index, index_file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        replace_file(temp_path, path)
+
+    def _remove_file(self, file_name):
+        try:
+            os.remove(os.path.join(self._folder(), file_name))
+        except OSError:
+            pass
+
+    def _remove_entry(self, key):
+        entry = self._index.pop(key)
+        self._remove_file(entry["file"])
+        try:
+            del self._memory[key]
+        except KeyError:
+            pass
+
+    def _evict_disk(self, size):
+        """
+        Remove the least frequently used entries from the disk tier until
+        there is room for an entry of the given size.
+        """
+        order = sorted(self._index,
+                       key=lambda x: (self._index[x]["hits"],
+                                      self._index[x]["time"]))
+        while order and self.size() + size > self.maxsize:
+            self._remove_entry(order.pop(0))
+
+    def _purge_backup(self):
+        """
+        Remove the data files of the entries that were removed by clear().
+        """
+        if self._backup is None:
+            return
+        index, _ = self._backup
+        known = {entry["file"] for entry in self._index.values()}
+        for entry in index.values():
+            if entry["file"] not in known:
+                self._remove_file(entry["file"])
+        self._backup = None
 
     def add(self, key, x):
         # if enabled, cache data frame
-        if options.cfg.use_cache:
-            size = sys.getsizeof(x)
+        if not options.cfg.use_cache:
+            return
+
+        self._purge_backup()
+
+        if key in self._index:
+            self._remove_entry(key)
 
-            # do not attempt to cache overly large data frames:
-            if size > self._cache.maxsize:
-                S = ("Query result too large for the query cache ({} MBytes"
-                     "missing).")
-                S = S.format((size - self._cache.maxsize) // (1024*1024))
-                logger.warning(S)
+        memory = get_size(x)
+        file_name = "{}.pkl".format(
+            hashlib.md5(repr(key).encode("utf-8")).hexdigest())
+        folder = self._folder()
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        path = os.path.join(folder, file_name)
 
-            # remove items from cache if necessary:
-            while self._cache.currsize + size > self._cache.maxsize:
-                self._cache.popitem()
+        temp_path = "{}.tmp".format(path)
+        try:
+            with open(temp_path, "wb") as data_file:
+                pickle.dump(x, data_file, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.warning("Cannot write to query cache: {}".format(e))
+            self._remove_file(os.path.basename(temp_path))
+            return
+        size = os.path.getsize(temp_path)
 
-            # add data frame to cache
-            self._cache[key] = x
+        # do not attempt to cache overly large data frames:
+        if size > self.maxsize:
+            S = ("Query result too large for the query cache ({} MBytes "
+                 "missing).")
+            S = S.format((size - self.maxsize) // (1024*1024))
+            logger.warning(S)
+            self._remove_file(os.path.basename(temp_path))
+            return
 
-            self._backup = None
+        # remove items from cache if necessary:
+        self._evict_disk(size)
+        replace_file(temp_path, path)
+
+        self._index[key] = {"file": file_name,
+                            "size": size,
+                            "memory": memory,
+                            "hits": 0,
+                            "time": time.time()}
+        if memory <= self._memory.maxsize:
+            self._memory[key] = x
+        self._write_index()
 
     def get(self, key):
-        return self._cache[key]
+        try:
+            entry = self._index[key]
+        except KeyError:
+            raise KeyError(key)
+
+        entry["hits"] += 1
+        entry["time"] = time.time()
+
+        try:
+            return self._memory[key]
+        except KeyError:
+            pass
+
+        # load the data frame from disk:
+        try:
+            with open(self._entry_path(entry), "rb") as data_file:
+                x = pickle.load(data_file)
+        except Exception as e:
+            logger.warning("Cannot read from query cache: {}".format(e))
+            self._remove_entry(key)
+            raise KeyError(key)
+
+        if entry["memory"] <= self._memory.maxsize:
+            self._memory[key] = x
+        return x
+
+    def invalidate(self, resource_name):
+        """
+        Remove all entries for the resource from the cache.
+
+        Parameters
+        ----------
+        resource_name : str
+            The name of the resource, which is the first element of the
+            cache keys
+        """
+        for key in [x for x in self._index
+                    if isinstance(x, tuple) and x[0] == resource_name]:
+            self._remove_entry(key)
+        self._write_index()
 
     def resize(self, newsize):
-        new_cache = cachetools.LFUCache(
-            maxsize=newsize,
-            getsizeof=sys.getsizeof)
-        cached = [self._cache.popitem() for x in range(len(self._cache))]
-        for key, val in cached:
-            if sys.getsizeof(val) + new_cache.currsize <= new_cache.maxsize:
-                new_cache[key] = val
-        self._cache = new_cache
+        self.maxsize = newsize
+        self._evict_disk(0)
+        if self._memory.maxsize > newsize:
+            memory = self._new_memory_cache(newsize)
+            for key in list(self._memory.keys()):
+                val = self._memory[key]
+                if get_size(val) + memory.currsize <= memory.maxsize:
+                    memory[key] = val
+            self._memory = memory
+        self._write_index()
 
     def size(self):
-        return self._cache.currsize
+        """
+        Return the number of bytes used by the disk tier.
+        """
+        return sum(entry["size"] for entry in self._index.values())
+
+    def memory_size(self):
+        """
+        Return the number of bytes used by the memory tier.
+        """
+        return self._memory.currsize
 
     def clear(self):
-        self._backup = self._cache
-        self._cache = cachetools.LFUCache(
-            maxsize=self._backup.maxsize,
-            getsizeof=sys.getsizeof)
+        self._purge_backup()
+        self._backup = (self._index, self._memory)
+        self._index = {}
+        self._memory = self._new_memory_cache(self._memory.maxsize)
 
     def restore(self):
-        self._cache = self._backup
+        self._index, self._memory = self._backup
         self._backup = None
 
     def has_backup(self):
         return self._backup is not None
 
     def save(self):
-        if not os.path.exists(options.cfg.cache_path):
-            os.makedirs(options.cfg.cache_path)
-        file_name = os.path.join(options.cfg.cache_path, "coq_cache.db")
-        pickle.dump(self._cache, open(file_name, "wb"))
+        self._purge_backup()
+        self._write_index()
 
     def move(self, new_path):
-        shutil.move(os.path.join(options.cfg.cache_path, "coq_cache.db"),
-                    os.path.join(new_path, "coq_cache.db"))
+        if not os.path.exists(new_path):
+            os.makedirs(new_path)
+        if os.path.exists(self._folder()):
+            shutil.move(self._folder(), self._folder(new_path))
+        index_path = os.path.join(self._path, self.INDEX_NAME)
+        if os.path.exists(index_path):
+            shutil.move(index_path, os.path.join(new_path, self.INDEX_NAME))
+        self._path = new_path
 
 
 logger = logging.getLogger(NAME)
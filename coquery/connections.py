@@ -10,25 +10,191 @@ with Coquery. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import os
+import re
 import glob
+import collections
+import sqlite3
 import sqlalchemy
+import sqlalchemy.pool
 import imp
 import logging
+import threading
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
 from .defines import SQL_MYSQL, SQL_SQLITE, DEFAULT_CONFIGURATION
 from .general import CoqObject, get_home_dir
 from .unicode import utf8
 
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+
+# Default settings for the connection pools that are shared by all engines
+# of a connection:
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 10
+POOL_RECYCLE = 3600
+
+# Default number of worker threads that execute queries concurrently, each
+# with its own connection from the pool:
+QUERY_WORKERS = 4
+
+
+# Maximum number of compiled regular expressions that are kept for each
+# SQLite connection:
+REGEXP_CACHE_SIZE = 256
+
+
+class SQLiteRegexp(object):
+    """
+    The REGEXP function of an SQLite connection.
+
+    Each regular expression is compiled only once, and the compiled
+    expressions are kept in a cache of limited size from which the least
+    recently used expressions are discarded. The parts of an expression
+    that every match has to contain are also determined when it is
+    compiled. These literal strings are checked before the compiled
+    expression is applied, so that most values that don't match can be
+    discarded by a fast substring test.
+
+    The result only depends on the arguments, so the function can be
+    registered as deterministic. Case-insensitive matching is requested
+    by the inline flag '(?i)' in the expression.
+    """
+    def __init__(self, maxsize=REGEXP_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._cache = collections.OrderedDict()
+
+    @staticmethod
+    def get_literals(regex):
+        """
+        Return the literal prefix and the longest literal substring that
+        every match of the compiled regular expression has to contain.
+
+        Only literal characters on the top level of the expression are
+        considered, so the strings may be empty even if the expression
+        contains literal strings, e.g. in alternations or groups. The
+        strings are unicode strings also on Python 2.7.
+        """
+        try:
+            parsed = sre_parse.parse(regex.pattern, regex.flags)
+        except Exception:
+            return u"", u""
+
+        items = list(parsed)
+        prefix = u""
+        if (items and items[0] == (sre_parse.AT, sre_parse.AT_BEGINNING) and
+                not regex.flags & re.MULTILINE):
+            for op, value in items[1:]:
+                if op != sre_parse.LITERAL:
+                    break
+                prefix += unichr(value)
+
+        longest = current = u""
+        for op, value in items:
+            if op == sre_parse.LITERAL:
+                current += unichr(value)
+                longest = max(longest, current, key=len)
+            else:
+                current = ""
+        return prefix, longest
+
+    def compile(self, expr):
+        """
+        Return a tuple containing the compiled regular expression, its
+        literal prefix, its longest literal substring, and True if the
+        expression ignores case.
+        """
+        try:
+            entry = self._cache.pop(expr)
+        except KeyError:
+            regex = re.compile(expr)
+            prefix, literal = self.get_literals(regex)
+            ignore_case = bool(regex.flags & re.IGNORECASE)
+            if ignore_case:
+                prefix, literal = prefix.lower(), literal.lower()
+            entry = (regex, prefix, literal, ignore_case)
+            if len(self._cache) >= self.maxsize:
+                self._cache.popitem(last=False)
+        self._cache[expr] = entry
+        return entry
+
+    def __call__(self, expr, item):
+        if item is None:
+            return False
+        regex, prefix, literal, ignore_case = self.compile(expr)
+
+        value = item
+        if ignore_case:
+            # Case-insensitive matching treats some non-ASCII characters as
+            # equal to ASCII characters, so the literal strings are only
+            # checked if both they and the value are plain ASCII:
+            if is_ascii(prefix + literal) and is_ascii(item):
+                value = item.lower()
+            else:
+                value = None
+
+        if value is not None:
+            try:
+                if not value.startswith(prefix) or literal not in value:
+                    return False
+            except (AttributeError, TypeError, UnicodeError):
+                # e.g. byte strings with non-ASCII characters on Python 2.7
+                # are only matched by the regular expression:
+                pass
+        return regex.search(item) is not None
+
+
+def is_ascii(s):
+    """
+    Return True if the argument is a string that contains only ASCII
+    characters.
+    """
+    try:
+        return all(ord(x) < 128 for x in s)
+    except TypeError:
+        return False
+
+
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    """
+    Register the user-defined functions on a new SQLite connection.
+
+    This function is used as a listener for the 'connect' event of SQLite
+    engines so that every pooled connection provides the REGEXP operator.
+    """
+    function = SQLiteRegexp()
+    try:
+        dbapi_connection.create_function("REGEXP", 2, function,
+                                         deterministic=True)
+    except (TypeError, sqlite3.NotSupportedError):
+        # deterministic functions require Python 3.8 and SQLite 3.8.3:
+        dbapi_connection.create_function("REGEXP", 2, function)
+
 
 class Connection(CoqObject):
     MODULE = 1 << 1
     INSTALLER = 1 << 2
     DATABASE = 1 << 3
 
+    # True if separate read-only engines can be created:
+    read_only_engines = False
+
     def __init__(self, name, db_type=None):
         self.name = name
         self._resources = {}
         self._db_type = db_type
+        self._engines = {}
+        self._engine_lock = threading.Lock()
+        self._pool_options = dict(pool_size=POOL_SIZE,
+                                  max_overflow=POOL_MAX_OVERFLOW,
+                                  pool_recycle=POOL_RECYCLE)
 
     def db_type(self):
         return self._db_type
@@ -78,6 +244,23 @@ class Connection(CoqObject):
         # there is nothing to do here.
         pass
 
+    def get_database_version(self, db_name):
+        """
+        Return a value that changes whenever the database is reinstalled.
+
+        The virtual Connection class does not allocate any databases, so
+        there is no version information.
+        """
+        return None
+
+    def supports_common_table_expressions(self):
+        """
+        Return True if the database server supports WITH clauses.
+
+        The virtual Connection class does not have a database server.
+        """
+        return False
+
     def remove_resource(self, name, flags=(MODULE | DATABASE | INSTALLER)):
         resource = self.resources()[name][0]
         db_name = resource.db_name
@@ -124,8 +307,90 @@ class Connection(CoqObject):
     def count_resources(self):
         return len(self._resources)
 
-    def get_engine(self, database=None):
-        return sqlalchemy.create_engine(self.url(database))
+    def get_pool_options(self):
+        return dict(self._pool_options)
+
+    def set_pool_options(self, **kwargs):
+        """
+        Change the settings of the connection pool.
+
+        Engines that have already been created keep using their current
+        pool, so they are disposed if the settings change.
+
+        Parameters
+        ----------
+        kwargs : dict
+            Keyword arguments that are passed to sqlalchemy.create_engine(),
+            e.g. pool_size, max_overflow, or pool_recycle.
+        """
+        new_options = dict(self._pool_options)
+        new_options.update(kwargs)
+        if new_options != self._pool_options:
+            self._pool_options = new_options
+            self.dispose_engines()
+
+    def create_engine(self, database=None):
+        return sqlalchemy.create_engine(self.url(database),
+                                        **self._pool_options)
+
+    def get_engine(self, database=None, read_only=False):
+        """
+        Return the engine for the database.
+
+        Engines are shared: the engine is created when it is requested for
+        the first time, and subsequent calls return the same engine so
+        that its connection pool is reused. Callers must therefore not
+        dispose the engine themselves; use dispose_engines() instead.
+
+        Parameters
+        ----------
+        database : str
+            The name of the database, or None for a connection to the
+            server.
+        read_only : bool
+            True if the engine is only used for reading from the database.
+            Connections that support it, i.e. SQLite connections, open the
+            database in read-only mode for such an engine so that several
+            connections can read from the same file concurrently.
+
+        Returns
+        -------
+        engine : sqlalchemy.engine.Engine
+            The engine for the database
+        """
+        read_only = bool(read_only) and self.read_only_engines
+        key = (database, read_only)
+        with self._engine_lock:
+            try:
+                engine = self._engines[key]
+            except KeyError:
+                if read_only:
+                    engine = self.create_engine(database, read_only=True)
+                else:
+                    engine = self.create_engine(database)
+                self._engines[key] = engine
+        return engine
+
+    def dispose_engines(self, database=None):
+        """
+        Close the connection pools of the engines.
+
+        Parameters
+        ----------
+        database : str
+            The name of the database for which the engine is disposed. If
+            None, the engines for all databases are disposed.
+        """
+        with self._engine_lock:
+            if database is None:
+                engines = list(self._engines.values())
+                self._engines = {}
+            else:
+                engines = [self._engines.pop(key)
+                           for key in list(self._engines)
+                           if key[0] == database]
+        for engine in engines:
+            engine.dispose()
 
     def __repr__(self):
         template = "{name}({arguments})"
@@ -174,6 +439,12 @@ class MySQLConnection(Connection):
         if params is None:
             params = ["charset=utf8mb4", "local_infile=1"]
         self.params = params
+        self._cte_support = None
+
+    def create_engine(self, database=None):
+        kwargs = dict(self._pool_options)
+        kwargs["pool_pre_ping"] = True
+        return sqlalchemy.create_engine(self.url(database), **kwargs)
 
     def url(self, database=None):
         template = ("mysql+pymysql://{user}:{password}@{host}:{port}"
@@ -195,15 +466,10 @@ class MySQLConnection(Connection):
         try:
             with engine.connect() as connection:
                 result = connection.execute("SELECT VERSION()")
+                res = (True, result.fetchall()[0][0])
+                result.close()
         except sqlalchemy.exc.SQLAlchemyError as e:
             res = (False, e)
-        except Exception as e:
-            engine.dispose()
-            raise e
-        else:
-            res = (True, result.fetchall()[0][0])
-            result.close()
-            engine.dispose()
         return res
 
     def create_database(self, db_name):
@@ -215,14 +481,13 @@ class MySQLConnection(Connection):
             """.format(db_name.split()[0])
         with engine.connect() as connection:
             connection.execute(S)
-        engine.dispose()
 
     def remove_database(self, db_name):
-        engine = self.get_engine(db_name)
+        self.dispose_engines(db_name)
+        engine = self.get_engine()
         S = "DROP DATABASE {}".format(db_name)
         with engine.connect() as connection:
             connection.execute(S)
-        engine.dispose()
 
     def has_database(self, db_name):
         engine = self.get_engine(db_name)
@@ -235,12 +500,8 @@ class MySQLConnection(Connection):
             with engine.connect() as connection:
                 connection.execute(S)
         except sqlalchemy.exc.InternalError as e:
-            engine.dispose()
+            self.dispose_engines(db_name)
             return False
-        except Exception as e:
-            engine.dispose()
-            raise e
-        engine.dispose()
         return True
 
     def get_database_size(self, db_name):
@@ -251,9 +512,47 @@ class MySQLConnection(Connection):
             WHERE table_schema = '{}'""".format(db_name)
         with engine.connect() as connection:
             size = connection.execute(S).fetchone()[0]
-        engine.dispose()
         return size
 
+    def get_database_version(self, db_name):
+        """
+        Return a value that changes whenever the database is reinstalled.
+
+        The version is the creation time of the most recent table in the
+        database, together with the last time a table was updated (if the
+        storage engine provides this information).
+        """
+        engine = self.get_engine(db_name)
+        S = """
+            SELECT MAX(CREATE_TIME), MAX(UPDATE_TIME)
+            FROM information_schema.tables
+            WHERE table_schema = '{}'""".format(db_name)
+        with engine.connect() as connection:
+            created, updated = connection.execute(S).fetchone()
+        return "{}|{}".format(created, updated)
+
+    def supports_common_table_expressions(self):
+        """
+        Return True if the database server supports WITH clauses, i.e. if
+        it is at least MySQL 8.0 or MariaDB 10.2.
+        """
+        if self._cte_support is None:
+            try:
+                with self.get_engine().connect() as connection:
+                    version = connection.execute(
+                        "SELECT VERSION()").fetchone()[0]
+                numbers = tuple(int(x) for x in re.findall(r"\d+", version))
+                if "mariadb" in version.lower():
+                    minimum = (10, 2)
+                else:
+                    minimum = (8, 0)
+                self._cte_support = numbers[:2] >= minimum
+            except Exception as e:
+                logging.warning(
+                    "Cannot determine server version: {}".format(e))
+                return False
+        return self._cte_support
+
     def has_user(self, user):
         """
         Checks if the user specified by the argument exists on the current
@@ -265,8 +564,7 @@ class MySQLConnection(Connection):
 
         engine = self.get_engine()
         with engine.connect() as connection:
-            results = connection.execute(QUERY_USERS)
-        engine.dispose()
+            results = connection.execute(QUERY_USERS).fetchall()
 
         local_hosts = ["127.0.0.1", "localhost"]
 
@@ -288,47 +586,43 @@ class MySQLConnection(Connection):
         FLUSH_PRIV = "FLUSH PRIVILEGES"
 
         engine = self.get_engine()
+        with engine.connect() as connection:
+            connection.execute(
+                NEW_USER.format(
+                    user="'{}'".format(user),
+                    host="'{}'".format(self.host),
+                    pwd="'{}'".format(pwd)))
+
+        # now that the user has been created, grant it all privileges
+        # it needs:
         try:
             with engine.connect() as connection:
                 connection.execute(
-                    NEW_USER.format(
+                    GRANT_PRIV.format(
                         user="'{}'".format(user),
-                        host="'{}'".format(self.host),
-                        pwd="'{}'".format(pwd)))
-
-            # now that the user has been created, grant it all privileges
-            # it needs:
-            try:
-                with engine.connect() as connection:
-                    connection.execute(
-                        GRANT_PRIV.format(
-                            user="'{}'".format(user),
-                            host="'{}'".format(self.host)))
-                    connection.execute(FLUSH_PRIV)
-            except Exception as e:
-                self.drop_user(user)
-                raise RuntimeError("User not created:\n{}".format(str(e)))
-        finally:
-            engine.dispose()
+                        host="'{}'".format(self.host)))
+                connection.execute(FLUSH_PRIV)
+        except Exception as e:
+            self.drop_user(user)
+            raise RuntimeError("User not created:\n{}".format(str(e)))
 
     def drop_user(self, user):
         REMOVE_USER = "DROP USER {user}@{host}"
 
         engine = self.get_engine()
-        try:
-            with engine.connect() as connection:
-                connection.execute(
-                    REMOVE_USER.format(
-                        user="'{}'".format(user),
-                        host="'{}'".format(self.host)))
-        finally:
-            engine.dispose()
+        with engine.connect() as connection:
+            connection.execute(
+                REMOVE_USER.format(
+                    user="'{}'".format(user),
+                    host="'{}'".format(self.host)))
 
 
 class SQLiteConnection(Connection):
     """
     Define an SQLite connection.
     """
+    read_only_engines = True
+
     def __init__(self, name, path=None):
         """
         Parameters
@@ -348,8 +642,11 @@ class SQLiteConnection(Connection):
 
         self.path = path
 
-    def url(self, db_name):
-        template = "sqlite+pysqlite:///{path}"
+    def url(self, db_name, read_only=False):
+        if read_only:
+            template = "sqlite+pysqlite:///file:{path}?mode=ro&uri=true"
+        else:
+            template = "sqlite+pysqlite:///{path}"
         path = os.path.join(self.path, "{}.db".format(db_name))
         return template.format(path=path)
 
@@ -362,7 +659,24 @@ class SQLiteConnection(Connection):
     def create_database(self, db_name):
         pass
 
+    def create_engine(self, database=None, read_only=False):
+        """
+        Create an SQLite engine.
+
+        SQLite databases are files, so there is no benefit from a pool of
+        several connections. Instead, one connection per thread is kept
+        open and reused. The REGEXP function is registered once when this
+        connection is established.
+        """
+        engine = sqlalchemy.create_engine(
+            self.url(database, read_only),
+            poolclass=sqlalchemy.pool.SingletonThreadPool)
+        sqlalchemy.event.listen(engine, "connect",
+                                _register_sqlite_functions)
+        return engine
+
     def remove_database(self, db_name):
+        self.dispose_engines(db_name)
         os.remove(os.path.join(self.path, "{}.db".format(db_name)))
 
     def has_database(self, db_name):
@@ -373,6 +687,22 @@ class SQLiteConnection(Connection):
         path = os.path.join(self.path, "{}.db".format(db_name))
         return os.path.getsize(path)
 
+    def get_database_version(self, db_name):
+        """
+        Return a value that changes whenever the database is reinstalled.
+
+        The version is the modification time of the database file.
+        """
+        path = os.path.join(self.path, "{}.db".format(db_name))
+        return os.path.getmtime(path)
+
+    def supports_common_table_expressions(self):
+        """
+        Return True if the SQLite library supports WITH clauses, which
+        were introduced in version 3.8.3.
+        """
+        return sqlite3.sqlite_version_info >= (3, 8, 3)
+
 
 def get_connection(name, dbtype,
                    host=None, port=None, user=None, password=None,
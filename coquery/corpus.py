@@ -18,6 +18,7 @@ from collections import defaultdict
 import re
 import logging
 import math
+import numpy as np
 import pandas as pd
 import os
 import tempfile
@@ -33,7 +34,7 @@ from .defines import (
     CONTEXT_NONE,
     PREFERRED_ORDER)
 
-from .general import collapse_words, CoqObject, html_escape
+from .general import collapse_words, CoqObject, html_escape, merge_ranges
 from . import tokens
 from . import options
 from .links import get_by_hash
@@ -644,6 +645,31 @@ class BaseResource(CoqObject):
 class SQLResource(BaseResource):
     _get_orth_str = None
 
+    # column names of the frequency tables, see get_frequency_table():
+    _frequency_label = "Label"
+    _frequency_count = "Frequency"
+
+    # additional columns of the marginal count tables, see
+    # get_marginal_tables():
+    _marginal_min = "MinId"
+    _marginal_max = "MaxId"
+
+    # column names of the lookup tables for suffix and infix queries, see
+    # get_pattern_table():
+    _pattern_label = "Label"
+    _pattern_id = "Id"
+
+    # prefixes of the resource features for the lookup tables that the
+    # corpus builder derives from the resource tables:
+    _derived_table_prefixes = ("frequency_", "marginal_",
+                               "reverse_", "trigram_")
+
+    # cache for the estimates from estimate_token_frequency():
+    _token_frequency_cache = {}
+
+    # cache for the lexicon ids from get_lexicon_ids():
+    _lexicon_id_cache = {}
+
     def __init__(self, _, corpus):
         super(SQLResource, self).__init__()
         self._word_cache = {}
@@ -699,7 +725,6 @@ class SQLResource(BaseResource):
         table = getattr(self, "{}_table".format(rc_table))
         S = "SELECT COUNT(*) FROM {}".format(table)
         size = pd.read_sql(S, con=engine).iloc[0][0]
-        engine.dispose()
         return size
 
     def get_table_names(self, rc_table):
@@ -756,7 +781,6 @@ class SQLResource(BaseResource):
             first = False
         if chunk_signal:
             chunk_signal.emit((chunks + 1, chunks + 1))
-        engine.dispose()
 
     def get_module_path(self):
         path = options.cfg.current_connection.resources()[self.name][-1]
@@ -883,30 +907,67 @@ class SQLResource(BaseResource):
 
         zf.close()
 
-    def get_statistics(self, db_connection, signal=None, s=None):
-        stats = []
-        # determine table size for all columns
-        table_sizes = {}
+    @staticmethod
+    def get_distinct_count_string(table, column):
+        """
+        Return an SQL string that counts the distinct values in the column.
+
+        NULL values are counted as one additional value. In MySQL, the
+        values are compared by their binary representation so that values
+        that differ only in case are counted separately.
+        """
+        if options.cfg.current_connection.db_type() == SQL_MYSQL:
+            value = "BINARY {}".format(column)
+        else:
+            value = column
+        return """
+            SELECT COUNT(DISTINCT {value}) +
+                   CASE WHEN COUNT(*) > COUNT({column}) THEN 1 ELSE 0 END
+            FROM {table}""".format(value=value, column=column, table=table)
+
+    def get_statistics(self, db_connection, signal=None, s=None,
+                       executor=None):
+        """
+        Return a data frame with the number of entries and the number of
+        distinct values for each column in the resource tables.
+
+        The numbers are counted by the database server, so only a single
+        value is retrieved for each table and for each column.
+
+        Parameters
+        ----------
+        db_connection : Connection
+            The database connection that is used if no executor is given
+        signal, s :
+            A signal that is emitted with the string `s`, formatted with
+            the current resource feature, after each count
+        executor : QueryExecutor
+            An executor that runs the count queries concurrently. If None,
+            the queries are executed one after the other on the database
+            connection.
+        """
+        # determine table size for all columns, but skip the derived
+        # lookup tables:
+        tables = []
         for rc_table in [x for x in dir(self)
                          if not x.startswith("_") and
                          x.endswith("_table") and
-                         not x.startswith("tag_")]:
+                         not x.startswith(("tag_",) +
+                                          self._derived_table_prefixes)]:
             table = getattr(self, rc_table)
             if type(table) != str:
                 continue
-            S = "SELECT COUNT(*) FROM {}".format(table)
-            df = pd.DataFrame(db_connection.execute(S).fetchall())
-            table_sizes[table] = df.values.ravel()[0]
-            if signal:
-                signal.emit(s.format(rc_table))
+            tables.append((rc_table, table))
+        table_names = [table for _, table in tables]
 
-        # get distinct values for each feature:
+        # determine the columns for each feature:
+        columns = []
         for rc_feature in dir(self):
             if rc_feature.endswith("_table") or "_" not in rc_feature:
                 continue
             rc_table = "{}_table".format(rc_feature.split("_")[0])
             try:
-                if getattr(self, rc_table) not in table_sizes:
+                if getattr(self, rc_table) not in table_names:
                     continue
             except AttributeError:
                 continue
@@ -918,14 +979,32 @@ class SQLResource(BaseResource):
             except AttributeError:
                 pass
             else:
-                #S = "SELECT COUNT(DISTINCT {}) FROM {}".format(column, table)
-                #df = pd.read_sql(S, engine)
-                S = "SELECT {} FROM {}".format(column, table)
-                df = pd.DataFrame(db_connection.execute(S).fetchall(),
-                                  columns=[column])
-                stats.append([table, column, table_sizes[table], len(df[column].unique()), 0, 0, rc_feature])
-                if signal:
-                    signal.emit(s.format(rc_feature))
+                columns.append((rc_feature, table, column))
+
+        queries = (
+            [(rc_table, "SELECT COUNT(*) FROM {}".format(table))
+             for rc_table, table in tables] +
+            [(rc_feature, self.get_distinct_count_string(table, column))
+             for rc_feature, table, column in columns])
+
+        if executor:
+            pending = [executor.submit(S) for _, S in queries]
+        counts = []
+        for i, (label, S) in enumerate(queries):
+            if executor:
+                _, chunks = pending[i].get()
+                value = chunks[0].values.ravel()[0]
+            else:
+                value = db_connection.execute(S).fetchall()[0][0]
+            counts.append(int(value or 0))
+            if signal:
+                signal.emit(s.format(label))
+
+        table_sizes = dict(zip(table_names, counts))
+        stats = [[table, column, table_sizes[table], uniques, 0, 0,
+                  rc_feature]
+                 for (rc_feature, table, column), uniques
+                 in zip(columns, counts[len(tables):])]
 
         df = pd.DataFrame(stats)
 
@@ -1065,18 +1144,288 @@ class SQLResource(BaseResource):
         return S
 
     @classmethod
-    def get_token_order(cls, token_list):
-        l = sorted(token_list, key=lambda x: cls.string_entropy(x[1][1]))
-        return l
+    def estimate_token_frequency(cls, s):
+        """
+        Estimate the number of corpus tokens that match the query item
+        string.
+
+        The estimate is obtained from the frequency table for the word or
+        lemma specification of the query item, see get_frequency_table().
+        It ignores part-of-speech specifications, so for combined query
+        items, the estimate is an upper bound. The estimates are cached.
+
+        Parameters
+        ----------
+        s : str
+            A query item string
+
+        Returns
+        -------
+        freq : int
+            The estimated number of matching tokens, or None if no estimate
+            is available for the query item, e.g. because the corpus does
+            not provide the frequency table or because the query item is
+            negated.
+        """
+        token = tokens.COCAToken(s)
+        if (token.negated or token.lemmatize or
+                token.transcript_specifiers or token.gloss_specifiers):
+            return None
+        if token.word_specifiers and not token.lemma_specifiers:
+            query_item, spec_list = QUERY_ITEM_WORD, token.word_specifiers
+        elif token.lemma_specifiers and not token.word_specifiers:
+            query_item, spec_list = QUERY_ITEM_LEMMA, token.lemma_specifiers
+        else:
+            return None
+
+        db_name = getattr(cls, "db_name", None)
+        table = cls.get_frequency_table(query_item)
+        if not db_name or not table or spec_list == ["*"]:
+            return None
+
+        key = (db_name, query_item, tuple(spec_list),
+               bool(options.cfg.query_case_sensitive),
+               bool(options.cfg.regexp))
+        try:
+            return cls._token_frequency_cache[key]
+        except KeyError:
+            pass
+
+        alias = "{}.{}".format(table, cls._frequency_label)
+        # the specifications are already escaped by the token parser, like
+        # in get_token_conditions():
+        conditions = []
+        for x in spec_list:
+            val = tokens.COCAToken.replace_wildcards(x)
+            if options.cfg.regexp:
+                operator = "REGEXP"
+                val = cls.get_regexp_value(val)
+            elif tokens.COCAToken.has_wildcards(x):
+                operator = "LIKE"
+            else:
+                operator = "="
+            conditions.append(
+                cls.handle_case("{alias} {op} '{val}'").format(
+                    alias=alias, op=operator, val=val))
+
+        S = "SELECT SUM({table}.{count}) FROM {table} WHERE {where}".format(
+            table=table, count=cls._frequency_count,
+            where=" OR ".join(["({})".format(x) for x in conditions]))
+        if options.cfg.current_connection.db_type() == SQL_MYSQL:
+            S = S.replace("%", "%%")
+        try:
+            engine = options.cfg.current_connection.get_engine(db_name)
+            freq = engine.execute(S).fetchone()[0]
+        except Exception as e:
+            logging.warning(str(e))
+            # don't send the failing query again for this query item:
+            cls._token_frequency_cache[key] = None
+            return None
+
+        freq = int(freq or 0)
+        cls._token_frequency_cache[key] = freq
+        return freq
+
+    @staticmethod
+    def clear_token_frequency_cache(db_name):
+        """
+        Discard the cached estimates from estimate_token_frequency() for the
+        database.
+        """
+        cache = SQLResource._token_frequency_cache
+        for key in [x for x in cache if x[0] == db_name]:
+            del cache[key]
 
     @classmethod
-    def get_corpus_joins(cls, query_items, ignore_ngram=False):
+    def get_lexicon_ids(cls, rc_table, condition):
         """
-        Returns a list of corpus joins for the sub query
+        Return the ids of the entries in a lexicon table that match a
+        condition.
+
+        Query items with wildcards or regular expressions are matched
+        against every row of the lexicon table that is joined to the
+        corpus. If only few lexicon entries match the query item, it is
+        faster to look up their ids once, and to use these ids in the
+        query instead. The ids are cached for each condition.
+
+        Parameters
+        ----------
+        rc_table : str
+            The resource name of the lexicon table, e.g. 'word'
+        condition : str
+            The SQL condition that is matched against the lexicon table.
+            Column names are qualified by the table name.
+
+        Returns
+        -------
+        ids : list
+            The sorted list of ids of the matching entries, or None if
+            there are more matching entries than allowed by the
+            configuration variable 'lexicon_id_limit', or if the entries
+            could not be looked up.
+        """
+        limit = getattr(options.cfg, "lexicon_id_limit", 0)
+        if not limit:
+            return None
+
+        key = (cls.db_name, condition, limit)
+        try:
+            return cls._lexicon_id_cache[key]
+        except KeyError:
+            pass
+
+        S = "SELECT {id} FROM {table} WHERE {where} LIMIT {limit}".format(
+            id=getattr(cls, "{}_id".format(rc_table)),
+            table=getattr(cls, "{}_table".format(rc_table)),
+            where=condition,
+            limit=limit + 1)
+        if options.cfg.current_connection.db_type() == SQL_MYSQL:
+            S = S.replace("%", "%%")
+        try:
+            engine = options.cfg.current_connection.get_engine(cls.db_name)
+            ids = sorted(set(x for x, in engine.execute(S).fetchall()))
+        except Exception as e:
+            logging.warning(str(e))
+            # don't send the failing query again for this condition:
+            cls._lexicon_id_cache[key] = None
+            return None
+
+        if len(ids) > limit:
+            ids = None
+        cls._lexicon_id_cache[key] = ids
+        return ids
+
+    @classmethod
+    def get_pattern_table(cls, query_item, kind):
         """
+        Return the name of the lookup table for suffix or infix queries for
+        the query item type, or None if the corpus does not provide one.
 
-        joins = []
+        The lookup tables are created by the corpus builder. The 'reverse'
+        table contains the reversed values of the resource feature that is
+        mapped to the query item type, and the 'trigram' table contains
+        the character trigrams of these values. The values are stored in
+        lower case together with the id of their lexicon entry.
+
+        Parameters
+        ----------
+        query_item : str
+            The query item type, e.g. QUERY_ITEM_WORD
+        kind : str
+            Either 'reverse' or 'trigram'
+        """
+        item_type = query_item.rpartition("_")[-1]
+        return getattr(cls, "{}_{}_table".format(kind, item_type), None)
 
+    @classmethod
+    def get_pattern_prefilter(cls, query_item, s, id_alias):
+        """
+        Return an SQL condition that preselects the lexicon entries that
+        may match a query item specification with leading wildcards.
+
+        A B-tree index on a lexicon column can only be used if the value
+        of the column starts with a fixed string. For specifications that
+        start with a wildcard, the condition looks up the final literal
+        string in the table of reversed values, or the literals in the
+        trigram table. The condition may select more entries than the
+        specification matches, so it has to be combined with the condition
+        for the specification.
+
+        Parameters
+        ----------
+        query_item : str
+            The query item type of the specification, e.g. QUERY_ITEM_WORD
+        s : str
+            The query item specification, e.g. '*ism'
+        id_alias : str
+            The column that contains the id of the lexicon entry
+
+        Returns
+        -------
+        S : str
+            The SQL condition, or None if no lookup table can be used
+        """
+        if options.cfg.regexp or not tokens.COCAToken.has_wildcards(s):
+            return None
+        # the quotes in the specification are already escaped, but the
+        # lookup tables contain the unescaped values:
+        literals = [x.replace("''", "'").lower()
+                    for x in tokens.COCAToken.get_literals(s)]
+        # specifications with a fixed start can use the normal index, and
+        # literals with SQL wildcards or escape characters are not used:
+        if literals[0] or any(c in x for x in literals for c in "%_\\"):
+            return None
+
+        template = "{alias} IN (SELECT {id} FROM {table} WHERE {condition})"
+
+        reverse_table = cls.get_pattern_table(query_item, "reverse")
+        if literals[-1] and reverse_table:
+            condition = "{} LIKE '{}%'".format(
+                cls._pattern_label, literals[-1][::-1].replace("'", "''"))
+            return template.format(alias=id_alias, id=cls._pattern_id,
+                                   table=reverse_table, condition=condition)
+
+        trigram_table = cls.get_pattern_table(query_item, "trigram")
+        trigrams = sorted(set([x[i:i+3] for x in literals
+                               for i in range(len(x) - 2)]))
+        if trigrams and trigram_table:
+            return " AND ".join([
+                template.format(
+                    alias=id_alias, id=cls._pattern_id,
+                    table=trigram_table,
+                    condition="{} = '{}'".format(
+                        cls._pattern_label, x.replace("'", "''")))
+                for x in trigrams])
+        return None
+
+    @staticmethod
+    def get_id_condition(alias, ids):
+        """
+        Return an SQL condition that matches the ids in the column.
+        """
+        if not ids:
+            return "1 = 0"
+        return "{} IN ({})".format(alias, ", ".join(str(x) for x in ids))
+
+    @staticmethod
+    def clear_lexicon_id_cache(db_name):
+        """
+        Discard the lexicon ids from get_lexicon_ids() for the database.
+        """
+        cache = SQLResource._lexicon_id_cache
+        for key in [x for x in cache if x[0] == db_name]:
+            del cache[key]
+
+    @classmethod
+    def get_token_order(cls, token_list):
+        """
+        Sort the query tokens so that the most selective token comes first.
+
+        The first token in the list is used as the anchor of the corpus
+        joins, i.e. all other tokens are joined to it by their offset. Tokens
+        for which estimate_token_frequency() provides an estimate come
+        first, ordered by that estimate. The remaining tokens are ordered by
+        their string_entropy(), and unrestricted tokens ('*') come last.
+        """
+        def selectivity(x):
+            s = x[1][1]
+            if s == "*":
+                return (2, 0)
+            freq = cls.estimate_token_frequency(s)
+            if freq is not None:
+                return (0, freq)
+            return (1, cls.string_entropy(s))
+
+        return sorted(token_list, key=selectivity)
+
+    @staticmethod
+    def get_token_list(query_items):
+        """
+        Return a list of tuples for the query items that are not None.
+
+        Each tuple contains the offset of the token in the sub query, and a
+        tuple with the number of the query item and the item string.
+        """
         token_list = []
         offset = 0
 
@@ -1084,8 +1433,28 @@ class SQLResource(BaseResource):
             if item_string is not None:
                 token_list.append((offset, (i+1, item_string)))
                 offset += 1
+        return token_list
+
+    @classmethod
+    def get_corpus_joins(cls, query_items, ignore_ngram=False, anchor=None):
+        """
+        Returns a list of corpus joins for the sub query
 
-        token_list = cls.get_token_order(token_list)
+        Parameters
+        ----------
+        query_items : list
+            The query items of the sub query
+        ignore_ngram : bool
+            True if the n-gram lookup table is not used
+        anchor : str
+            The name of a table that contains the corpus rows that match
+            the first token from get_token_order(), see
+            get_anchor_query_string(). If None, the corpus table is used.
+        """
+
+        joins = []
+
+        token_list = cls.get_token_order(cls.get_token_list(query_items))
 
         width = getattr(cls, "corpusngram_width", 0)
         joined = False
@@ -1134,8 +1503,12 @@ class SQLResource(BaseResource):
                     s = ("INNER JOIN {{corpus}} AS COQ_CORPUS_{{N}} "
                          "ON {{id}}{{N}} = {comp}").format(
                              comp=comp.format(offs=offs))
+                if i == 0 and anchor:
+                    corpus = anchor
+                else:
+                    corpus = cls.get_subselect_corpus(N, ref_N)
                 s = s.format(
-                    corpus=cls.get_subselect_corpus(N, ref_N),
+                    corpus=corpus,
                     id=cls.corpus_id,
                     N=N, ref_N=ref_N,
                     comp=comp)
@@ -1437,6 +1810,40 @@ class SQLResource(BaseResource):
             **kwargs)
         return S
 
+    @staticmethod
+    def handle_case(s):
+        """
+        Return the condition string s so that it respects the case
+        sensitivity setting for the current connection.
+        """
+        db_type = options.cfg.current_connection.db_type()
+
+        # take care of case options:
+        if (options.cfg.query_case_sensitive):
+            if (db_type == SQL_MYSQL):
+                return "BINARY {}".format(s)
+            elif db_type == SQL_SQLITE:
+                return "{} COLLATE BINARY".format(s)
+        else:
+            if (db_type == SQL_MYSQL):
+                return s
+            elif db_type == SQL_SQLITE:
+                return "{} COLLATE NOCASE".format(s)
+
+    @staticmethod
+    def get_regexp_value(s):
+        """
+        Return the regular expression s so that it respects the case
+        sensitivity setting for the current connection.
+
+        Collations do not affect the REGEXP function of SQLite connections,
+        so case-insensitive matching is requested by an inline flag.
+        """
+        db_type = options.cfg.current_connection.db_type()
+        if db_type == SQL_SQLITE and not options.cfg.query_case_sensitive:
+            return "(?i){}".format(s)
+        return s
+
     @classmethod
     def get_token_conditions(cls, i, token):
         """
@@ -1444,20 +1851,7 @@ class SQLResource(BaseResource):
         conditions as values.
         """
 
-        def handle_case(s):
-            db_type = options.cfg.current_connection.db_type()
-
-            # take care of case options:
-            if (options.cfg.query_case_sensitive):
-                if (db_type == SQL_MYSQL):
-                    return "BINARY {}".format(s)
-                elif db_type == SQL_SQLITE:
-                    return "{} COLLATE BINARY".format(s)
-            else:
-                if (db_type == SQL_MYSQL):
-                    return s
-                elif db_type == SQL_SQLITE:
-                    return "{} COLLATE NOCASE".format(s)
+        handle_case = cls.handle_case
 
         def get_operator(S):
             if options.cfg.regexp:
@@ -1470,6 +1864,56 @@ class SQLResource(BaseResource):
                     operator = "="
             return operator
 
+        def get_condition(spec_list, alias):
+            if (len(spec_list) == 1):
+                x = spec_list[0]
+                val = tokens.COCAToken.replace_wildcards(x)
+                operator = get_operator(x)
+                if operator == "REGEXP":
+                    val = cls.get_regexp_value(val)
+                format_str = handle_case("{alias} {op} '{val}'")
+                return format_str.format(alias=alias,
+                                         op=operator,
+                                         val=val)
+
+            wildcards = []
+            explicit = []
+            for x in spec_list:
+                if tokens.COCAToken.has_wildcards(x):
+                    wildcards.append(x)
+                else:
+                    explicit.append(x)
+
+            if explicit:
+                format_str = handle_case("{alias} IN ({val_list})")
+                s_list = ", ".join(["'{}'".format(x) for x in explicit])
+                s_exp = [format_str.format(alias=alias, val_list=s_list)]
+            else:
+                s_exp = []
+
+            if options.cfg.regexp:
+                operator = "REGEXP"
+                get_value = cls.get_regexp_value
+            else:
+                operator = "LIKE"
+                get_value = lambda x: x
+            format_str = handle_case("{alias} {op} '{val}'")
+            s_list = [format_str.format(
+                        alias=alias,
+                        op=operator,
+                        val=get_value(tokens.COCAToken.replace_wildcards(x)))
+                      for x in wildcards]
+            return " OR ".join(s_list + s_exp)
+
+        def get_prefilter(query_item, spec_list, id_alias):
+            l = [cls.get_pattern_prefilter(query_item, x, id_alias)
+                 for x in spec_list]
+            if not all(l):
+                return None
+            if len(l) == 1:
+                return l[0]
+            return " OR ".join(["({})".format(x) for x in l])
+
         d = defaultdict(list)
         # Make sure that the token contains only those query item types that
         # are actually supported by the resource:
@@ -1499,40 +1943,34 @@ class SQLResource(BaseResource):
             alias = template.format(table=tab.upper(),
                                     name=col,
                                     N=i+1)
-            if (len(spec_list) == 1):
-                x = spec_list[0]
-                val = tokens.COCAToken.replace_wildcards(x)
-                format_str = handle_case("{alias} {op} '{val}'")
-                s = format_str.format(alias=alias,
-                                      op=get_operator(x),
-                                      val=val)
-            else:
-                wildcards = []
-                explicit = []
-                for x in spec_list:
-                    if tokens.COCAToken.has_wildcards(x):
-                        wildcards.append(x)
-                    else:
-                        explicit.append(x)
-
-                if explicit:
-                    format_str = handle_case("{alias} IN ({val_list})")
-                    s_list = ", ".join(["'{}'".format(x) for x in explicit])
-                    s_exp = [format_str.format(alias=alias, val_list=s_list)]
-                else:
-                    s_exp = []
-
-                if options.cfg.regexp:
-                    operator = "REGEXP"
-                else:
-                    operator = "LIKE"
-                format_str = handle_case("{alias} {op} '{val}'")
-                s_list = [format_str.format(
-                            alias=alias,
-                            op=operator,
-                            val=tokens.COCAToken.replace_wildcards(x))
-                          for x in wildcards]
-                s = " OR ".join(s_list + s_exp)
+            s = get_condition(spec_list, alias)
+
+            if (tab != "corpus" and not token.lemmatize and
+                    (options.cfg.regexp or
+                     any(tokens.COCAToken.has_wildcards(x)
+                         for x in spec_list))):
+                table = getattr(cls, "{}_table".format(tab))
+                id_column = getattr(cls, "{}_id".format(tab))
+                id_alias = "COQ_{}_{}.{}".format(tab.upper(), i+1, id_column)
+
+                # the lookup tables for suffix and infix queries are used
+                # to preselect the lexicon entries:
+                prefilter = get_prefilter(label, spec_list, id_alias)
+                if prefilter:
+                    s = "({}) AND ({})".format(prefilter, s)
+
+                # conditions with wildcards are replaced by the ids of the
+                # matching entries of the lexicon table, if possible:
+                lexicon_condition = get_condition(
+                    spec_list, "{}.{}".format(table, col))
+                prefilter = get_prefilter(
+                    label, spec_list, "{}.{}".format(table, id_column))
+                if prefilter:
+                    lexicon_condition = "({}) AND ({})".format(
+                        prefilter, lexicon_condition)
+                ids = cls.get_lexicon_ids(tab, lexicon_condition)
+                if ids is not None:
+                    s = cls.get_id_condition(id_alias, ids)
 
             d[tab].append(s)
             if token.lemmatize and label == QUERY_ITEM_POS:
@@ -1733,7 +2171,16 @@ class SQLResource(BaseResource):
         return columns
 
     @classmethod
-    def get_condition_list(cls, query_items, join_list, selected):
+    def get_condition_list(cls, query_items, join_list, selected,
+                           anchor=None):
+        """
+        Return the list of conditions for the WHERE clause of the query.
+
+        The table joins that are required by the conditions are appended
+        to join_list. If anchor is given, the conditions of the query item
+        with that number are omitted because they are already met by the
+        rows of the anchor table, see get_anchor_query_string().
+        """
         condition_list = []
         current_pos = 0
         # go through the query items and add all required list as well as
@@ -1750,11 +2197,12 @@ class SQLResource(BaseResource):
                     conditions = cls.get_token_conditions(i, token)
                 else:
                     conditions = {}
-                for _, l in conditions.items():
-                    s = " AND ".join(["({})".format(x) for x in l])
-                    if token.negated:
-                        s = "NOT ({})".format(s)
-                    condition_list.append(s)
+                if i + 1 != anchor:
+                    for _, l in conditions.items():
+                        s = " AND ".join(["({})".format(x) for x in l])
+                        if token.negated:
+                            s = "NOT ({})".format(s)
+                        condition_list.append(s)
 
                 if first_item != 1:
                     table_list, where_list = cls.get_feature_joins(
@@ -1770,15 +2218,22 @@ class SQLResource(BaseResource):
 
     @classmethod
     def get_query_string(cls,
-                         query_items, selected, columns=None, to_file=False):
+                         query_items, selected, columns=None, to_file=False,
+                         anchor=None):
         """
         Return an SQL string for the specified query.
+
+        If anchor is given, it is the number of the query item that is
+        used as the anchor of the corpus joins, and the corpus rows for
+        this item are taken from the table COQ_ANCHOR, see
+        get_quantified_query_string().
         """
         if columns is None or columns == []:
             columns = cls.get_required_columns(query_items, selected, to_file)
 
         # get list of self-joints for the corpus:
-        join_list = cls.get_corpus_joins(query_items)
+        join_list = cls.get_corpus_joins(
+            query_items, anchor="COQ_ANCHOR" if anchor else None)
 
         # Some tables are not linked by an ID, but by time alignments.
         # One example is the Segments table from the Buckeye corpus.
@@ -1798,7 +2253,8 @@ class SQLResource(BaseResource):
         # get list of conditions that will be placed in the WHERE clause:
         condition_list = cls.get_condition_list(query_items,
                                                 join_list,
-                                                selected)
+                                                selected,
+                                                anchor=anchor)
 
         if condition_list:
             sql_template = """{}
@@ -1814,20 +2270,345 @@ class SQLResource(BaseResource):
             """.format(S, int(options.cfg.number_of_tokens))
         return S
 
+    @classmethod
+    def get_quantified_query_string(cls, query_list, selected,
+                                    to_file=False):
+        """
+        Return a single SQL string for the subqueries of a quantified query.
+
+        The subqueries produced by tokens.preprocess_query() for the
+        different repetitions of quantified query items all have the same
+        number of query items and therefore also the same output columns.
+        They are combined by UNION ALL so that the database executes all of
+        them within a single query. Each branch of the union also returns
+        the number of query tokens of its subquery in the column
+        'coquery_invisible_number_of_tokens'.
+
+        If all subqueries are anchored on the same query item, the corpus
+        rows that match this item are determined only once in a common
+        table expression, and all branches are joined to it.
+
+        Parameters
+        ----------
+        query_list : list
+            A list of query item lists, one for each subquery
+        selected : list
+            The list of selected resource features
+
+        Returns
+        -------
+        S : str
+            The SQL string, or None if the subqueries cannot be combined
+            because they produce different output columns.
+        """
+        anchor = cls.get_shared_anchor(query_list)
+        branches = []
+        aliases = None
+        for i, query_items in enumerate(query_list):
+            columns = cls.get_required_columns(query_items, selected, to_file)
+            labels = [x.rpartition(" AS ")[-1] for x in columns]
+            if aliases is None:
+                aliases = labels
+            elif labels != aliases:
+                return None
+
+            number_of_tokens = len([x for _, x in query_items if x])
+            columns = columns + [
+                "{} AS coquery_invisible_number_of_tokens".format(
+                    number_of_tokens)]
+            S = cls.get_query_string(query_items, selected,
+                                     columns=columns, to_file=to_file,
+                                     anchor=anchor)
+
+            # each branch is wrapped in a derived table so that its LIMIT
+            # clause (if any) applies only to that branch:
+            branches.append("SELECT * FROM ({}) AS COQ_SUBQUERY_{}".format(
+                S, i + 1))
+
+        S = "\nUNION ALL\n".join(branches)
+        if anchor:
+            S = "WITH COQ_ANCHOR AS ({})\n{}".format(
+                cls.get_anchor_query_string(query_list[0], anchor), S)
+        return S
+
+    @classmethod
+    def get_shared_anchor(cls, query_list):
+        """
+        Return the number of the query item that is used as the anchor of
+        the corpus joins by all subqueries, or None if the subqueries use
+        different anchors.
+
+        None is also returned if the anchor is unrestricted, if the corpus
+        joins use an n-gram lookup table, or if the database does not
+        support common table expressions.
+        """
+        if len(query_list) < 2 or cls.has_ngram():
+            return None
+
+        anchors = set()
+        for query_items in query_list:
+            token_list = cls.get_token_order(cls.get_token_list(query_items))
+            if not token_list:
+                return None
+            _, (N, item_string) = token_list[0]
+            anchors.add((N, item_string))
+
+        if len(anchors) != 1:
+            return None
+        N, item_string = anchors.pop()
+        if item_string == "*":
+            return None
+        if not (options.cfg.current_connection
+                       .supports_common_table_expressions()):
+            return None
+        return N
+
+    @classmethod
+    def get_anchor_query_string(cls, query_items, anchor):
+        """
+        Return an SQL string that selects the corpus rows that match the
+        anchor query item.
+
+        The columns of the rows are labelled like those of the corpus
+        subselect for the query item, see get_subselect_corpus(), so that
+        the result can be used in place of the subselect.
+
+        Parameters
+        ----------
+        query_items : list
+            The query items of a subquery
+        anchor : int
+            The number of the anchor query item
+        """
+        anchor_items = [(pos, item_string if i + 1 == anchor else None)
+                        for i, (pos, item_string) in enumerate(query_items)]
+        join_list = ["FROM {} AS COQ_CORPUS_{}".format(
+            cls.get_subselect_corpus(anchor, anchor), anchor)]
+        condition_list = cls.get_condition_list(anchor_items, join_list, [])
+
+        S = "SELECT COQ_CORPUS_{}.* {}".format(anchor, " ".join(join_list))
+        if condition_list:
+            S = "{} WHERE {}".format(S, " AND ".join(condition_list))
+        return S
+
+    @classmethod
+    def get_aggregated_query_string(cls, query_list, selected,
+                                    to_file=False):
+        """
+        Return an SQL string that counts the matches of the query in the
+        database.
+
+        The query string from get_query_string() (or, for the subqueries
+        of a quantified query, from get_quantified_query_string()) is used
+        as a derived table that is grouped by all output columns, so that
+        the database returns only the distinct rows instead of one row for
+        each match. The number of matches that a row stands for is returned
+        in the column 'coquery_invisible_row_count', and the smallest
+        corpus id and origin id of these matches are retained.
+
+        Parameters
+        ----------
+        query_list : list
+            A list of query item lists, one for each subquery
+        selected : list
+            The list of selected resource features
+
+        Returns
+        -------
+        S : str
+            The SQL string, or None if the subqueries cannot be combined
+            because they produce different output columns.
+        """
+        columns = cls.get_required_columns(query_list[0], selected, to_file)
+        aliases = [x.rpartition(" AS ")[-1] for x in columns]
+        if len(query_list) > 1:
+            S = cls.get_quantified_query_string(query_list, selected,
+                                                to_file=to_file)
+            if S is None:
+                return None
+            # rows from subqueries of different lengths are kept apart:
+            keys = ["coquery_invisible_number_of_tokens"]
+            aliases.append("coquery_invisible_number_of_tokens")
+        else:
+            S = cls.get_query_string(query_list[0], selected,
+                                     columns=columns, to_file=to_file)
+            keys = []
+
+        if options.cfg.current_connection.db_type() == SQL_MYSQL:
+            value_template = "MIN({alias}) AS {alias}"
+            group_template = "BINARY {alias}"
+        else:
+            value_template = "{alias}"
+            group_template = "{alias}"
+
+        labels = []
+        groups = []
+        for alias in aliases:
+            if alias in keys:
+                labels.append(alias)
+                groups.append(alias)
+            elif alias.startswith("coquery_invisible"):
+                labels.append("MIN({alias}) AS {alias}".format(alias=alias))
+            else:
+                labels.append(value_template.format(alias=alias))
+                groups.append(group_template.format(alias=alias))
+        labels.append("COUNT(*) AS coquery_invisible_row_count")
+
+        S = "SELECT {labels} FROM ({S}) AS COQ_AGGREGATE".format(
+            labels=", ".join(labels), S=S)
+        if groups:
+            S = "{} GROUP BY {}".format(S, ", ".join(groups))
+        return S
+
+    @classmethod
+    def get_feature_alias(cls, rc_feature, N=1):
+        """
+        Return the column alias that is used for the resource feature in
+        the joins produced by get_corpus_joins() and get_condition_list().
+        """
+        _, tab, _ = cls.split_resource_feature(rc_feature)
+        col = getattr(cls, rc_feature)
+        if tab == "corpus":
+            return "{}{}".format(col, N)
+        else:
+            return "COQ_{}_{}.{}".format(tab.upper(), N, col)
+
+    @staticmethod
+    def get_item_table_string(items):
+        """
+        Return an SQL string for a derived table that contains the items in
+        the column 'coq_item'.
+        """
+        return " UNION ALL ".join(
+            ["SELECT '{}' AS coq_item".format(x) for x in items])
+
+    @classmethod
+    def get_frequency_table(cls, query_item=QUERY_ITEM_WORD):
+        """
+        Return the name of the frequency table for the query item type, or
+        None if the corpus does not provide one.
+
+        Frequency tables are created by the corpus builder. They contain
+        the number of tokens for each distinct value of the resource feature
+        that is mapped to the query item type.
+        """
+        item_type = query_item.rpartition("_")[-1]
+        return getattr(cls, "frequency_{}_table".format(item_type), None)
+
+    @classmethod
+    def get_marginal_tables(cls):
+        """
+        Return a dictionary with the marginal count tables that the corpus
+        provides.
+
+        Marginal count tables are created by the corpus builder. They
+        contain the number of tokens as well as the lowest and the highest
+        corpus id for each distinct combination of values of one or more
+        corpus features. The features are stored in columns that are named
+        after the resource features.
+
+        Returns
+        -------
+        d : dict
+            A dictionary with tuples of resource features as keys, and the
+            names of the marginal count tables as values
+        """
+        d = {}
+        for x in dir(cls):
+            if x.startswith("marginal_") and x.endswith("_table"):
+                features = x[len("marginal_"):-len("_table")]
+                d[tuple(features.split("__"))] = getattr(cls, x)
+        return d
+
+    @classmethod
+    def get_marginal_table(cls, features):
+        """
+        Return the name of the smallest marginal count table that contains
+        all resource features, or None if there is no such table.
+        """
+        candidates = [(len(key), table)
+                      for key, table in cls.get_marginal_tables().items()
+                      if set(features).issubset(key)]
+        if candidates:
+            return sorted(candidates)[0][1]
+        return None
+
+    @classmethod
+    def get_frequency_list_string(cls, items, query_item=QUERY_ITEM_WORD):
+        """
+        Return an SQL string that counts the tokens for each of the items.
+
+        The items are literal strings. They are placed in a derived table
+        that is joined either to the frequency table of the query item type
+        or, if there is no such table, to the corpus so that all frequencies
+        are obtained by a single grouped query. Items that do not occur in
+        the corpus are not contained in the results.
+
+        Parameters
+        ----------
+        items : list of str
+            A list of strings, already escaped for use in SQL
+        query_item : str
+            The query item type, e.g. QUERY_ITEM_WORD or QUERY_ITEM_LEMMA
+
+        Returns
+        -------
+        S : str
+            The SQL string. The results contain the columns 'coq_item' and
+            'coq_frequency'.
+        """
+        item_table = cls.get_item_table_string(items)
+        freq_table = cls.get_frequency_table(query_item)
+
+        if freq_table:
+            S = """
+            SELECT COQ_ITEMS.coq_item AS coq_item,
+                   SUM({freq_table}.{freq}) AS coq_frequency
+            FROM {freq_table}
+            INNER JOIN ({items}) AS COQ_ITEMS ON {condition}
+            GROUP BY COQ_ITEMS.coq_item""".format(
+                freq_table=freq_table,
+                freq=cls._frequency_count,
+                items=item_table,
+                condition=cls.handle_case("{}.{} = COQ_ITEMS.coq_item".format(
+                    freq_table, cls._frequency_label)))
+            return S
+
+        rc_feature = getattr(cls, query_item)
+        query_items = [(1, "*")]
+        join_list = cls.get_corpus_joins(query_items)
+        cls.get_condition_list(query_items, join_list, [rc_feature])
+
+        join_list.append(
+            "INNER JOIN ({items}) AS COQ_ITEMS ON {condition}".format(
+                items=item_table,
+                condition=cls.handle_case(
+                    "{} = COQ_ITEMS.coq_item".format(
+                        cls.get_feature_alias(rc_feature)))))
+
+        S = """
+        SELECT COQ_ITEMS.coq_item AS coq_item,
+               COUNT(*) AS coq_frequency
+        {joins}
+        GROUP BY COQ_ITEMS.coq_item""".format(joins=" ".join(join_list))
+        return S
+
     def is_part_of_speech(self, pos):
         pos_feature = getattr(self, QUERY_ITEM_POS, None)
         if pos_feature:
             current_token = tokens.COCAToken(pos)
             _, table, _ = self.split_resource_feature(pos_feature)
+            operator = self.get_operator(current_token)
+            if operator == "REGEXP":
+                pos = self.get_regexp_value(pos)
             S = "SELECT {} FROM {} WHERE {} {} '{}' LIMIT 1".format(
                 getattr(self, "{}_id".format(table)),
                 getattr(self, "{}_table".format(table)),
                 getattr(self, pos_feature),
-                self.get_operator(current_token),
+                operator,
                 pos)
             engine = options.cfg.current_connection.get_engine(self.db_name)
             df = pd.read_sql(S.replace("%", "%%"), engine)
-            engine.dispose()
             return len(df.index) > 0
         else:
             return False
@@ -1863,7 +2644,6 @@ class SQLResource(BaseResource):
 
         engine = options.cfg.current_connection.get_engine(self.db_name)
         df = pd.read_sql(S, engine)
-        engine.dispose()
 
         return df
 
@@ -1953,6 +2733,167 @@ class SQLResource(BaseResource):
             length=int(end - start + 1),
             position=position)
 
+    def get_context_range_string(self, ranges):
+        """
+        Return an SQL string that retrieves the words in the given ranges.
+
+        Parameters
+        ----------
+        ranges : list
+            A list of tuples (origin_id, start, end). Each tuple specifies
+            a range of corpus ids from the given origin. Both boundaries are
+            inclusive.
+
+        Returns
+        -------
+        S : str
+            An SQL string. The result table contains the columns 'Context'
+            (the word), 'coquery_invisible_corpus_id',
+            'coquery_invisible_origin_id', and, if the resource has a
+            sentence feature, 'coquery_invisible_sentence_id'.
+        """
+        spans = defaultdict(list)
+        for origin_id, start, end in ranges:
+            if isinstance(origin_id, float) and origin_id.is_integer():
+                origin_id = int(origin_id)
+            spans[origin_id].append(
+                "COQ_CORPUS_1.{corpus_token}1 BETWEEN {start} AND {end}".format(
+                    corpus_token=self.corpus_id, start=start, end=end))
+
+        corpus_origin = getattr(self, self.get_origin_rc())
+        conditions = [
+            "(COQ_CORPUS_1.{corpus_origin}1 = {origin_id} AND ({spans}))"
+            .format(corpus_origin=corpus_origin, origin_id=origin_id,
+                    spans=" OR ".join(spans[origin_id]))
+            for origin_id in spans]
+
+        columns = [
+            "COQ_CORPUS_1.{}1 AS coquery_invisible_corpus_id".format(
+                self.corpus_id),
+            "COQ_CORPUS_1.{}1 AS coquery_invisible_origin_id".format(
+                corpus_origin)]
+        _sentence_feature = self.get_sentence_feature()
+        if _sentence_feature:
+            columns.append(
+                "COQ_CORPUS_1.{}1 AS coquery_invisible_sentence_id".format(
+                    _sentence_feature))
+
+        return self.get_context_string_template().format(
+            where=" OR ".join(conditions),
+            length=int(sum([end - start + 1 for _, start, end in ranges])),
+            position=", ".join(columns))
+
+    def get_context_batch(self, token_ids, origin_ids, numbers_of_tokens,
+                          db_connection, sentence_ids=None,
+                          left=None, right=None, chunk_size=500):
+        """
+        Return the contexts for a list of tokens.
+
+        This is the batched equivalent of get_context(). The context windows
+        of all tokens are grouped by their origin id, and overlapping windows
+        are merged. The words in the merged windows are retrieved by range
+        queries that cover up to `chunk_size` windows each. The contexts of
+        the tokens are then sliced from these words in memory.
+
+        Parameters
+        ----------
+        token_ids, origin_ids, numbers_of_tokens : iterables
+            The corpus ids, the origin ids, and the number of tokens of the
+            matches for which the contexts are retrieved
+        db_connection : SQLAlchemy Connection
+            The connection used for the range queries
+        sentence_ids : iterable or None
+            If not None, the context of each match is restricted to the
+            tokens that share the sentence id of the match.
+        chunk_size : int
+            The maximum number of merged windows per range query
+
+        Returns
+        -------
+        l : list
+            A list of tuples (left, target, right), one for each token, as
+            returned by get_context().
+        """
+        left_span = left or options.cfg.context_left
+        right_span = right or options.cfg.context_right
+
+        token_ids = list(token_ids)
+        origin_ids = list(origin_ids)
+        widths = [int(x) for x in numbers_of_tokens]
+        if sentence_ids is None:
+            sentence_ids = [None] * len(token_ids)
+        else:
+            sentence_ids = list(sentence_ids)
+
+        windows = defaultdict(list)
+        for token_id, origin_id, width in zip(token_ids, origin_ids, widths):
+            if not pd.isnull(origin_id):
+                windows[origin_id].append(
+                    (max(0, int(token_id) - left_span),
+                     int(token_id) + width + right_span - 1))
+
+        ranges = [(origin_id, start, end)
+                  for origin_id in windows
+                  for start, end in merge_ranges(windows[origin_id])]
+
+        frames = []
+        for i in range(0, len(ranges), chunk_size):
+            S = self.get_context_range_string(ranges[i:i + chunk_size])
+            if options.cfg.verbose:
+                logging.info(S)
+            results = db_connection.execute(S)
+            frames.append(pd.DataFrame(results.fetchall(),
+                                       columns=results.keys()))
+
+        lookup = {}
+        if frames:
+            words = pd.concat(frames)
+            for origin_id, grp in words.groupby(
+                    "coquery_invisible_origin_id"):
+                grp = grp.sort_values("coquery_invisible_corpus_id")
+                if "coquery_invisible_sentence_id" in grp.columns:
+                    sentences = grp["coquery_invisible_sentence_id"].values
+                else:
+                    sentences = None
+                lookup[origin_id] = (
+                    grp["coquery_invisible_corpus_id"].values.astype(int),
+                    grp["Context"].values,
+                    sentences)
+
+        empty = (np.array([], dtype=int), np.array([], dtype=object), None)
+        contexts = []
+        for token_id, origin_id, width, sentence_id in zip(
+                token_ids, origin_ids, widths, sentence_ids):
+            if pd.isnull(origin_id):
+                contexts.append(([None] * left_span,
+                                 [None] * width,
+                                 [None] * right_span))
+                continue
+
+            ids, words, sentences = lookup.get(origin_id, empty)
+            token_id = int(token_id)
+            lower = ids.searchsorted(max(0, token_id - left_span), "left")
+            upper = ids.searchsorted(token_id + width + right_span - 1,
+                                     "right")
+            ids = ids[lower:upper]
+            words = words[lower:upper]
+            if sentence_id and sentences is not None:
+                keep = np.array([x == sentence_id
+                                 for x in sentences[lower:upper]],
+                                dtype=bool)
+                ids = ids[keep]
+                words = words[keep]
+
+            left_words = list(words[ids < token_id])
+            target_words = list(words[(ids >= token_id) &
+                                      (ids < token_id + width)])
+            right_words = list(words[ids >= token_id + width])
+            contexts.append(
+                ([''] * (left_span - len(left_words)) + left_words,
+                 target_words,
+                 right_words + [''] * (right_span - len(right_words))))
+        return contexts
+
     def get_origin_id(self, token_id):
         origin_rc = self.get_origin_rc()
         if not origin_rc:
@@ -1965,7 +2906,6 @@ class SQLResource(BaseResource):
                      token_id=token_id)
         engine = options.cfg.current_connection.get_engine(self.db_name)
         df = pd.read_sql(S, engine)
-        engine.dispose()
 
         return df.values.ravel()[0]
 
@@ -2001,7 +2941,6 @@ class SQLResource(BaseResource):
         engine = options.cfg.current_connection.get_engine(
             self.db_name)
         df = pd.read_sql(S, engine)
-        engine.dispose()
 
         # as each of the columns could potentially link to origin information,
         # we go through all of them:
@@ -2055,7 +2994,6 @@ class SQLResource(BaseResource):
                 engine = options.cfg.current_connection.get_engine(
                     self.db_name)
                 row = pd.read_sql(S, engine)
-                engine.dispose()
 
                 if len(row.index) > 0:
                     D = dict([(x, row.at[0, x]) for x in row.columns
@@ -2094,7 +3032,6 @@ class SQLResource(BaseResource):
 
         engine = options.cfg.current_connection.get_engine(self.db_name)
         df = pd.read_sql(S, engine)
-        engine.dispose()
         return df
 
 
@@ -2105,8 +3042,14 @@ class CorpusClass(object):
     _corpus_size_cache = {}
     _subcorpus_size_cache = {}
     _corpus_range_cache = {}
+    _subcorpus_table_cache = {}
     _context_cache = {}
 
+    # column names of the lookup table from get_subcorpus_table():
+    SUBCORPUS_SIZE = "coquery_invisible_subcorpus_size"
+    SUBCORPUS_MIN = "coquery_invisible_subcorpus_min"
+    SUBCORPUS_MAX = "coquery_invisible_subcorpus_max"
+
     def __init__(self):
         super(CorpusClass, self).__init__()
         self.resource = None
@@ -2133,6 +3076,12 @@ class CorpusClass(object):
         if not filters and getattr(self.resource, "number_of_tokens", None):
             return self.resource.number_of_tokens
 
+        if filters:
+            marginal = self.resource.get_marginal_table(
+                [rc_feature for rc_feature, _ in filters])
+            if marginal:
+                return self.get_marginal_size(marginal, filters)
+
         self.resource.table_list = []
         self.resource.joined_tables = []
         filter_strings = []
@@ -2173,12 +3122,44 @@ class CorpusClass(object):
             engine = options.cfg.current_connection.get_engine(
                 self.resource.db_name)
             df = pd.read_sql(S.replace("%", "%%"), engine)
-            engine.dispose()
             self._corpus_size_cache[S] = df.values.ravel()[0]
         if not filters:
             self.resource.number_of_tokens = self._corpus_size_cache[S]
         return self._corpus_size_cache[S]
 
+    def get_marginal_size(self, table, filters):
+        """
+        Return the number of tokens in the filtered corpus from a marginal
+        count table.
+
+        Parameters
+        ----------
+        table : str
+            The name of a marginal count table that contains all corpus
+            features from the filter list
+        filters : list
+            A list of tuples. The first element is a corpus feature, and
+            the second is a list of possible values.
+
+        Returns
+        -------
+        size : int
+            The number of tokens in the filtered corpus.
+        """
+        S = "SELECT SUM({count}) FROM {table} WHERE {conditions}".format(
+            count=self.resource._frequency_count,
+            table=table,
+            conditions=" AND ".join(
+                [self.get_value_condition(rc_feature, values)
+                 for rc_feature, values in filters]))
+        if S not in self._corpus_size_cache:
+            engine = options.cfg.current_connection.get_engine(
+                self.resource.db_name)
+            df = pd.read_sql(S.replace("%", "%%"), engine)
+            size = df.values.ravel()[0]
+            self._corpus_size_cache[S] = 0 if pd.isnull(size) else int(size)
+        return self._corpus_size_cache[S]
+
     def get_subcorpus_size(self, row, columns=None, subst=None):
         """
         Return the size of the subcorpus specified by the corpus features in
@@ -2217,6 +3198,173 @@ class CorpusClass(object):
             self._subcorpus_size_cache[tup] = size
         return self._subcorpus_size_cache[tup]
 
+    @staticmethod
+    def _format_sql_values(values):
+        l = []
+        for x in values:
+            if isinstance(x, str):
+                l.append("'{}'".format(x.replace("'", "''")))
+            else:
+                l.append(str(x))
+        return ", ".join(l)
+
+    @classmethod
+    def get_value_condition(cls, field, values):
+        """
+        Return an SQL condition that matches any of the values in the field.
+
+        Missing values in the list are matched by an IS NULL condition.
+        """
+        values = list(values)
+        l = []
+        known = [x for x in values if not pd.isnull(x)]
+        if known:
+            l.append("{} IN ({})".format(field,
+                                         cls._format_sql_values(known)))
+        if len(known) < len(values):
+            l.append("{} IS NULL".format(field))
+        return "({})".format(" OR ".join(l))
+
+    def get_subcorpus_table(self, df, columns, max_values=1000):
+        """
+        Return the sizes and the corpus id ranges of all subcorpora that are
+        specified by the corpus feature values in the data frame.
+
+        The subcorpora for all distinct combinations of feature values are
+        determined by a single grouped query. The query uses a marginal
+        count table if the corpus provides one for the features, and the
+        corpus table otherwise. If there are not more than `max_values`
+        distinct values in each column, the query is restricted to these
+        values.
+
+        Parameters
+        ----------
+        df : DataFrame
+            A data frame that contains a column 'coq_{rc_feature}_1' for
+            each corpus feature in `columns`
+        columns : list
+            A list of corpus resource features
+        max_values : int
+            The maximum number of values that are used to restrict the
+            grouped query
+
+        Returns
+        -------
+        lookup : DataFrame
+            A data frame with one row for each combination of feature
+            values. It contains the feature columns from `df` as well as
+            the columns SUBCORPUS_SIZE, SUBCORPUS_MIN, and SUBCORPUS_MAX.
+            The lookup table can be merged with `df` on the feature
+            columns.
+        """
+        data_columns = ["coq_{}_1".format(x) for x in columns]
+
+        if not columns:
+            size = self.get_corpus_size()
+            return pd.DataFrame({self.SUBCORPUS_SIZE: [size],
+                                 self.SUBCORPUS_MIN: [0],
+                                 self.SUBCORPUS_MAX: [size]})
+
+        marginal = self.resource.get_marginal_table(columns)
+        if marginal:
+            # use the marginal count table that was built at install time:
+            fields = [("{}.{}".format(marginal, rc_feature), column)
+                      for rc_feature, column in zip(columns, data_columns)]
+            size = "SUM({}.{})".format(marginal,
+                                       self.resource._frequency_count)
+            min_id = "MIN({}.{})".format(marginal,
+                                         self.resource._marginal_min)
+            max_id = "MAX({}.{})".format(marginal,
+                                         self.resource._marginal_max)
+            tables = marginal
+        else:
+            self.resource.table_list = []
+            self.resource.joined_tables = []
+            fields = []
+            for rc_feature, column in zip(columns, data_columns):
+                _, tab, _ = self.resource.split_resource_feature(rc_feature)
+                self.resource.add_table_path("corpus_id", rc_feature)
+                fields.append(("{}.{}".format(
+                    getattr(self.resource, "{}_table".format(tab)),
+                    getattr(self.resource, rc_feature)), column))
+            size = "COUNT(*)"
+            min_id = "MIN({}.{})".format(self.resource.corpus_table,
+                                         self.resource.corpus_id)
+            max_id = "MAX({}.{})".format(self.resource.corpus_table,
+                                         self.resource.corpus_id)
+            tables = " ".join([self.resource.corpus_table] +
+                              self.resource.table_list)
+
+        conditions = []
+        for field, column in fields:
+            values = df[column].unique()
+            if len(values) <= max_values:
+                conditions.append(self.get_value_condition(field, values))
+
+        if conditions:
+            where = "WHERE {}".format(" AND ".join(conditions))
+        else:
+            where = ""
+
+        S = """
+            SELECT {fields},
+                   {size} AS {size_column},
+                   {min_id} AS {min_column},
+                   {max_id} AS {max_column}
+            FROM {tables}
+            {where}
+            GROUP BY {groups}""".format(
+                fields=", ".join(["{} AS {}".format(field, column)
+                                  for field, column in fields]),
+                size=size, size_column=self.SUBCORPUS_SIZE,
+                min_id=min_id, min_column=self.SUBCORPUS_MIN,
+                max_id=max_id, max_column=self.SUBCORPUS_MAX,
+                tables=tables,
+                where=where,
+                groups=", ".join([field for field, _ in fields]))
+
+        key = (self.resource.db_name, S)
+        if key not in self._subcorpus_table_cache:
+            engine = options.cfg.current_connection.get_engine(
+                self.resource.db_name)
+            self._subcorpus_table_cache[key] = pd.read_sql(
+                S.replace("%", "%%"), engine)
+        return self._subcorpus_table_cache[key]
+
+    def get_subcorpus_values(self, df, columns, value):
+        """
+        Return a Series with the subcorpus size or corpus id range for each
+        row in the data frame.
+
+        Parameters
+        ----------
+        df : DataFrame
+            A data frame that contains a column 'coq_{rc_feature}_1' for
+            each corpus feature in `columns`
+        columns : list
+            A list of corpus resource features
+        value : str
+            One of SUBCORPUS_SIZE, SUBCORPUS_MIN, or SUBCORPUS_MAX
+
+        Returns
+        -------
+        val : Series
+            A Series with the same index as `df`. Rows whose subcorpus is
+            empty contain 0.
+        """
+        if len(df) == 0:
+            return pd.Series([], index=df.index, dtype=float)
+        lookup = self.get_subcorpus_table(df, columns)
+        data_columns = ["coq_{}_1".format(x) for x in columns]
+        if data_columns:
+            val = (df[data_columns].merge(lookup, how="left",
+                                          on=data_columns)[value]
+                                   .fillna(0))
+        else:
+            val = pd.Series([lookup[value].iloc[0]] * len(df))
+        val.index = df.index
+        return val
+
     @staticmethod
     def reverse_substitution(column, value, subst=None):
         """
@@ -2292,7 +3440,6 @@ class CorpusClass(object):
             engine = options.cfg.current_connection.get_engine(
                 self.resource.db_name)
             df = pd.read_sql(S.replace("%", "%%"), engine)
-            engine.dispose()
             val = df.values.ravel()[0:2]
         self._corpus_range_cache[cache_key] = val
         return self._corpus_range_cache[cache_key]
@@ -2320,6 +3467,32 @@ class CorpusClass(object):
             The number of tokens that match the query item specification
         """
 
+        s = self._escape_frequency_string(s)
+        key = self._get_frequency_key(s, engine)
+
+        if key in self._frequency_cache:
+            return self._frequency_cache[key]
+
+        query_list = tokens.preprocess_query(s, literal=literal)
+        freq = None
+
+        for sub in query_list:
+            S = self.resource.get_query_string(sub, [], columns=["COUNT(*)"])
+            try:
+                df = pd.read_sql(S, engine)
+            except Exception as e:
+                logging.warning(str(e))
+                print(str(e))
+            else:
+                if freq is None:
+                    freq = 0
+                freq += df.values.ravel()[0]
+
+        self._frequency_cache[key] = freq
+        return freq
+
+    @staticmethod
+    def _escape_frequency_string(s):
         if isinstance(s, (int, float)):
             s = str(s)
         # escape asterisks and question marks so that they are not interpreted
@@ -2330,32 +3503,196 @@ class CorpusClass(object):
         s = s.replace("#", "\\#")
         s = s.replace("/", "\\/")
         s = s.replace("%", "\\%")
+        return s
 
+    @staticmethod
+    def _get_frequency_key(s, engine):
         if options.cfg.query_case_sensitive:
-            key = (engine.url, s, True)
+            return (engine.url, s, True)
         else:
-            key = (engine.url, s.lower(), False)
+            return (engine.url, s.lower(), False)
 
-        if key in self._frequency_cache:
-            return self._frequency_cache[key]
+    @staticmethod
+    def _get_literal_word(s):
+        """
+        Return the SQL-escaped word if the query item specification s
+        matches only tokens with exactly that word, or None otherwise.
+        """
+        s = s.strip()
+        if (not s or options.cfg.regexp or
+                s.startswith("_") or
+                any(x in s for x in "\\ \t")):
+            return None
 
-        query_list = tokens.preprocess_query(s, literal=literal)
-        freq = None
+        token = tokens.COCAToken(s)
+        if (token.negated or token.lemmatize or
+                token.lemma_specifiers or token.class_specifiers or
+                token.transcript_specifiers or token.gloss_specifiers or
+                len(token.word_specifiers) != 1):
+            return None
 
-        for sub in query_list:
-            S = self.resource.get_query_string(sub, [], columns=["COUNT(*)"])
+        word = token.word_specifiers[0]
+        if (word.replace("''", "'") != s or
+                tokens.COCAToken.has_wildcards(word)):
+            return None
+        return word
+
+    def get_frequencies(self, items, engine, literal=False, chunk_size=250):
+        """
+        Return the frequencies for a list of query item specifications.
+
+        Duplicate items are only looked up once. The frequencies of all
+        items that consist of a single literal word are obtained by one
+        grouped query per chunk of items. Items that contain wildcards or
+        other query syntax are looked up by get_frequency().
+
+        Parameters
+        ----------
+        items : iterable
+            The query item specifications
+        engine : SQLAlchemy Engine
+            The DB engine to be used for the frequency query
+        literal : bool
+            Passed on to get_frequency() for items that are not looked up
+            by the grouped query
+        chunk_size : int
+            The maximum number of items in a grouped query
+
+        Returns
+        -------
+        d : dict
+            A dictionary with the items as keys and their frequencies as
+            values
+        """
+        freqs = {}
+        pending = {}
+        word_feature = getattr(self.resource, QUERY_ITEM_WORD, None)
+
+        for item in pd.unique(pd.Series(list(items), dtype=object)):
+            s = self._escape_frequency_string(item)
+            key = self._get_frequency_key(s, engine)
+            if key in self._frequency_cache:
+                freqs[item] = self._frequency_cache[key]
+                continue
+
+            word = self._get_literal_word(s) if word_feature else None
+            if word is None:
+                freqs[item] = self.get_frequency(item, engine, literal)
+            else:
+                value = word.replace("''", "'")
+                pending.setdefault(key, (word, value, []))[2].append(item)
+
+        freqs.update(self._query_frequencies(pending, engine,
+                                             QUERY_ITEM_WORD, chunk_size))
+        return freqs
+
+    def get_label_frequencies(self, labels, engine,
+                              query_item=QUERY_ITEM_WORD, chunk_size=250):
+        """
+        Return the frequencies for a list of labels.
+
+        Unlike get_frequencies(), the labels are not interpreted as query
+        item specifications. Each label is counted as a literal value of
+        the resource feature that is mapped to the query item type, so
+        wildcards or other query syntax have no special meaning. If the
+        corpus provides a frequency table for the query item type, this
+        table is used instead of the corpus table.
+
+        Parameters
+        ----------
+        labels : iterable
+            The labels, e.g. a column from a data frame
+        engine : SQLAlchemy Engine
+            The DB engine to be used for the frequency query
+        query_item : str
+            The query item type, either QUERY_ITEM_WORD (the default) or
+            QUERY_ITEM_LEMMA
+        chunk_size : int
+            The maximum number of labels in a grouped query
+
+        Returns
+        -------
+        d : dict
+            A dictionary with the labels as keys and their frequencies as
+            values. Missing values have the frequency None.
+        """
+        freqs = {}
+        pending = {}
+        db_type = options.cfg.current_connection.db_type()
+
+        if not getattr(self.resource, query_item, None):
+            raise UnsupportedQueryItemError(
+                query_item.rpartition("_")[-1].capitalize())
+
+        for label in pd.unique(pd.Series(list(labels), dtype=object)):
+            if label is None or pd.isnull(label):
+                freqs[label] = None
+                continue
+            value = str(label)
+            if options.cfg.query_case_sensitive:
+                key = (engine.url, query_item, value, True)
+            else:
+                key = (engine.url, query_item, value.lower(), False)
+            if key in self._frequency_cache:
+                freqs[label] = self._frequency_cache[key]
+                continue
+
+            sql_value = value.replace("'", "''")
+            if db_type == SQL_MYSQL:
+                sql_value = sql_value.replace("\\", "\\\\")
+            pending.setdefault(key, (sql_value, value, []))[2].append(label)
+
+        freqs.update(self._query_frequencies(pending, engine,
+                                             query_item, chunk_size))
+        return freqs
+
+    def _query_frequencies(self, pending, engine, query_item, chunk_size):
+        """
+        Look up the frequencies of the pending items by grouped queries.
+
+        Parameters
+        ----------
+        pending : dict
+            A dictionary with cache keys as keys, and tuples as values. Each
+            tuple contains the SQL-escaped value, the unescaped value, and
+            the list of items that share the cache key.
+
+        Returns
+        -------
+        d : dict
+            A dictionary with the items as keys and their frequencies as
+            values
+        """
+        freqs = {}
+        db_type = options.cfg.current_connection.db_type()
+        keys = list(pending.keys())
+        for chunk in [keys[i:i + chunk_size]
+                      for i in range(0, len(keys), chunk_size)]:
+            S = self.resource.get_frequency_list_string(
+                [pending[key][0] for key in chunk], query_item)
+            if db_type == SQL_MYSQL:
+                S = S.replace("%", "%%")
+            if options.cfg.verbose:
+                logging.info(S)
             try:
                 df = pd.read_sql(S, engine)
             except Exception as e:
                 logging.warning(str(e))
                 print(str(e))
+                counts = None
             else:
-                if freq is None:
-                    freq = 0
-                freq += df.values.ravel()[0]
+                counts = dict(zip(df["coq_item"], df["coq_frequency"]))
 
-        self._frequency_cache[key] = freq
-        return freq
+            for key in chunk:
+                _, value, item_list = pending[key]
+                if counts is None:
+                    freq = None
+                else:
+                    freq = int(counts.get(value, 0))
+                self._frequency_cache[key] = freq
+                for item in item_list:
+                    freqs[item] = freq
+        return freqs
 
     def get_tag_translate(self, s):
         """
@@ -2560,7 +3897,6 @@ class CorpusClass(object):
         else:
             tags = pd.DataFrame(columns=["COQ_TAG_TAG", "COQ_TAG_TYPE",
                                          "COQ_ATTRIBUTE", "COQ_ID"])
-        engine.dispose()
 
         try:
             df = df.sort_values(by=headers)
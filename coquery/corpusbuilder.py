@@ -16,9 +16,13 @@ import getpass
 import codecs
 import logging
 import collections
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os.path
 import warnings
 import time
+import numpy as np
 import pandas as pd
 import re
 import sys
@@ -80,7 +84,7 @@ from . import corpus
 from .tables import Column, Identifier, Link, Table
 
 from .errors import DependencyError, get_error_repr
-from .defines import (SQL_MYSQL,
+from .defines import (SQL_MYSQL, SQL_SQLITE,
                       DEFAULT_MISSING_VALUE,
                       QUERY_ITEM_GLOSS, QUERY_ITEM_LEMMA,
                       QUERY_ITEM_TRANSCRIPT, QUERY_ITEM_POS,
@@ -91,6 +95,45 @@ from .general import check_fs_case_sensitive
 
 insert_cache = collections.defaultdict(list)
 
+# the builder that is used by the worker processes that load the corpus
+# files, see BaseCorpusBuilder.build_load_files():
+_load_builder = None
+
+
+def _init_load_worker():
+    """
+    Prepare the builder inherited by a worker process so that the tables
+    keep their new rows in memory instead of committing them.
+    """
+    _load_builder._widget = None
+    for table in _load_builder._new_tables.values():
+        # rows from the parent process are committed by the parent:
+        table._add_cache = list()
+        table.start_recording()
+
+
+def _load_file(file_name):
+    """
+    Process the file in a worker process.
+
+    Returns
+    -------
+    tup : tuple
+        A tuple containing the process id, a dictionary with the records of
+        all tables (see Table.take_records()), the list of corpus rows, and
+        the number of tokens in the file. All ids are local to the worker
+        process, and the corpus ids start at 1 for each file.
+    """
+    builder = _load_builder
+    builder._corpus_id = 0
+    builder._corpus_buffer = []
+    builder.store_filename(file_name)
+    builder.process_file(file_name)
+    records = {name: table.take_records()
+               for name, table in builder._new_tables.items()}
+    return (os.getpid(), records, builder._corpus_buffer or [],
+            builder._corpus_id)
+
 new_code_str = """
     @staticmethod
     def get_name():
@@ -181,6 +224,36 @@ class BaseCorpusBuilder(corpus.SQLResource):
 
     _read_file_formatter = "Reading {file} (%v of %m)..."
 
+    # set _parallel_load to True in installers whose process_file() only
+    # depends on the content of the file. The files of these corpora are
+    # parsed by worker processes if the argument 'workers' is larger than 1:
+    _parallel_load = False
+    # the table that records the loaded files if the argument 'resume' is
+    # set, see store_checkpoint():
+    _checkpoint_table = "CoqBuildCheckpoint"
+    # the maximum number of lookup entries that each table keeps in memory
+    # while the corpus is built. Additional entries are moved to temporary
+    # files, see tables.Lexicon:
+    _max_lookup = 5000000
+
+    # marginal count tables are built for all corpus features unless this
+    # is set to False. _marginal_pairs is a list of tuples of two corpus
+    # features for which an additional joint table is built:
+    _marginal_tables = True
+    _marginal_pairs = []
+
+    # lookup tables for suffix and infix queries are only built if this is
+    # set to True, see build_pattern_tables():
+    _pattern_tables = False
+
+    # the number of corpus rows that are processed at a time while the
+    # n-gram lookup table is built, see build_lookup_ngram():
+    _ngram_chunk_size = 250000
+    # the number of lexicon rows that are processed at a time while the
+    # lookup tables for suffix and infix queries are built, see
+    # build_pattern_tables():
+    _pattern_chunk_size = 250000
+
     def __init__(self, gui=None):
         self.module_code = module_code
         self.table_description = {}
@@ -202,6 +275,11 @@ class BaseCorpusBuilder(corpus.SQLResource):
         self._file_list = []
 
         self._source_count = collections.Counter()
+        # mapping of the local ids from the worker processes to the ids in
+        # the tables, see merge_file_records():
+        self._worker_ids = {}
+        # files that were loaded by an interrupted build:
+        self._loaded_files = set()
 
         # auto-create tables for which the variables TAB_table and
         # TAB_columns exists (with TAB being the name of the table):
@@ -293,10 +371,7 @@ class BaseCorpusBuilder(corpus.SQLResource):
 
         if self._corpus_buffer:
             df = pd.DataFrame(self._corpus_buffer)
-            df.to_sql(self.corpus_table,
-                      self.DB.engine,
-                      if_exists="append",
-                      index=False)
+            self.DB.bulk_insert(df, self.corpus_table)
             self._corpus_buffer = []
 
     def create_table_description(self, table_name, column_list):
@@ -313,6 +388,7 @@ class BaseCorpusBuilder(corpus.SQLResource):
             A list of :class:`Column` instances
         """
         new_table = Table(table_name)
+        new_table.set_max_lookup(self._max_lookup)
         for x in column_list:
             if isinstance(x, Link):
                 try:
@@ -328,6 +404,20 @@ class BaseCorpusBuilder(corpus.SQLResource):
                 raise e
         self._new_tables[table_name] = new_table
 
+    def close_lookups(self):
+        """
+        Log the size of the lookups of the tables, and remove their entries.
+        """
+        for name, table in self._new_tables.items():
+            entries, memory, disk = table.get_lookup_usage()
+            if entries:
+                logging.info(
+                    "Lookup of table {}: {} entries, {:.1f} MB in memory, "
+                    "{:.1f} MB on disk".format(
+                        name, entries, memory / (1024.0 * 1024),
+                        disk / (1024.0 * 1024)))
+            table.close_lookup()
+
     def table(self, table_name):
         """
         Return a Table object matching the specified name.
@@ -991,9 +1081,218 @@ class BaseCorpusBuilder(corpus.SQLResource):
         """
         self.process_text_file(file_name)
 
+    def get_load_pool(self):
+        """
+        Return a pool of worker processes that parse the corpus files, or
+        None if the files are processed by the builder itself.
+
+        Worker processes are used if the installer sets _parallel_load and
+        if the argument 'workers' is larger than 1. They require that new
+        processes can be forked safely, which is not the case on Windows
+        and Mac OS X.
+
+        Database connections must not be shared with the worker processes.
+        Therefore, the connection of the builder is closed and the
+        connection pool of the engine is disposed before the processes are
+        forked. The builder then opens a new connection, see
+        setup_connection().
+        """
+        global _load_builder
+
+        workers = getattr(self.arguments, "workers", None) or 1
+        if (not self._parallel_load or workers < 2 or
+                sys.platform == "darwin"):
+            return None
+        try:
+            context = multiprocessing.get_context("fork")
+        except AttributeError:
+            # Python 2.7 always forks on POSIX systems:
+            if sys.platform.startswith("win"):
+                return None
+            context = multiprocessing
+        except ValueError:
+            return None
+
+        _load_builder = self
+        self.DB.connection.close()
+        self.DB.engine.dispose()
+        pool = context.Pool(workers, initializer=_init_load_worker)
+        self.DB.connection = self.DB.engine.connect()
+        self.setup_connection()
+        return pool
+
+    def get_merge_order(self):
+        """
+        Return the names of the new tables so that each table follows the
+        tables it links to.
+        """
+        order = []
+
+        def visit(name, path):
+            if name in order or name in path or name not in self._new_tables:
+                return
+            for column in self._new_tables[name].columns:
+                if column.key:
+                    visit(column._link, path + [name])
+            order.append(name)
+
+        for name in self._new_tables:
+            visit(name, [])
+        return order
+
+    def merge_file_records(self, pid, records, corpus_rows, token_count):
+        """
+        Add the records of a file that was processed by a worker process to
+        the tables.
+
+        The rows are added in the same way as if the file had been processed
+        by the builder: rows that were added by get_or_insert() in the
+        worker process receive the id of an equal existing row. The ids in
+        link columns are translated from the ids that are local to the
+        worker process to the ids in the tables.
+
+        Parameters
+        ----------
+        pid : int
+            The process id of the worker process
+        records : dict
+            A dictionary with the records of each table, see
+            Table.take_records()
+        corpus_rows : list
+            A list of dictionaries, one for each token in the file
+        token_count : int
+            The number of tokens in the file
+        """
+        mapping = self._worker_ids.setdefault(pid, {})
+        offset = self._corpus_id
+
+        def remap(value, link):
+            if link == self.corpus_table:
+                try:
+                    return value + offset
+                except TypeError:
+                    return value
+            return mapping.get(link, {}).get(value, value)
+
+        for name in self.get_merge_order():
+            table = self._new_tables[name]
+            links = [(column.name, column._link) for column in table.columns
+                     if column.key]
+
+            if name == self.corpus_table:
+                for row in corpus_rows:
+                    for column, link in links:
+                        if column in row:
+                            row[column] = remap(row[column], link)
+                    row[self.corpus_id] = row[self.corpus_id] + offset
+                if self._corpus_buffer is None:
+                    self._corpus_buffer = []
+                self._corpus_buffer.extend(corpus_rows)
+
+            rows, lookup = records.get(name, ([], []))
+            if not rows:
+                continue
+            ids = mapping.setdefault(name, {})
+            generated = table.primary.name not in table._row_order
+            for row, use_lookup in zip(rows, lookup):
+                if generated:
+                    local_id = row[0]
+                    values = dict(zip(table._row_order, row[1:]))
+                else:
+                    values = dict(zip(table._row_order, row))
+                for column, link in links:
+                    if column in values:
+                        values[column] = remap(values[column], link)
+                if use_lookup:
+                    new_id = table.get_or_insert(values)
+                else:
+                    new_id = table.add(values)
+                if generated:
+                    ids[local_id] = new_id
+
+        self._corpus_id += token_count
+
+    def get_checkpoint(self):
+        """
+        Return the checkpoint data frame of an interrupted build, or None
+        if there is none.
+        """
+        if not self.DB.has_table(self._checkpoint_table):
+            return None
+        df = pd.read_sql("SELECT * FROM {}".format(self._checkpoint_table),
+                         self.DB.engine)
+        if df.empty:
+            return None
+        return df.sort_values("Position")
+
+    def store_checkpoint(self, file_name, position):
+        """
+        Record that the file has been loaded, together with the state of
+        the tables so that an interrupted build can be resumed after this
+        file.
+
+        The checkpoint is written after the data of the file has been
+        committed. Checkpoints are only written if the argument 'resume' is
+        set.
+        """
+        if not getattr(self.arguments, "resume", False):
+            return
+        state = {"corpus_id": self._corpus_id,
+                 "tables": {name: [table._current_id, table._line_counter]
+                            for name, table in self._new_tables.items()}}
+        df = pd.DataFrame({"Position": [position],
+                           "File": [file_name],
+                           "State": [json.dumps(state)]})
+        df.to_sql(self._checkpoint_table, self.DB.engine,
+                  if_exists="append", index=False)
+
+    def restore_checkpoint(self):
+        """
+        Restore the state of the tables from the last checkpoint of an
+        interrupted build.
+
+        The data that was committed after the last checkpoint is removed,
+        and the lookups of the tables are filled from the database.
+
+        Returns
+        -------
+        files : set
+            The names of the files that have already been loaded
+        """
+        df = self.get_checkpoint()
+        if df is None:
+            return set()
+        state = json.loads(df["State"].values[-1])
+
+        for name, table in self._new_tables.items():
+            table.setDB(self.DB)
+            if name == self.corpus_table:
+                continue
+            current_id, line_counter = state["tables"].get(name, (0, 0))
+            table.restore(current_id, line_counter)
+
+        self._corpus_id = state["corpus_id"]
+        self.DB.connection.execute(
+            "DELETE FROM {} WHERE {} > {}".format(
+                self.corpus_table, self.corpus_id, self._corpus_id))
+        logging.info("Resuming build after {} files".format(len(df)))
+        return set(df["File"])
+
+    def remove_checkpoint(self):
+        if self.DB.has_table(self._checkpoint_table):
+            self.DB.connection.execute(
+                "DROP TABLE {}".format(self._checkpoint_table))
+
     def build_load_files(self):
-        """ Goes through the list of suitable files, and calls process_file()
-        on each file name. File names are added to the file table."""
+        """
+        Goes through the list of suitable files, and calls process_file()
+        on each file name. File names are added to the file table.
+
+        If the installer supports it, the files are processed by worker
+        processes, and their results are merged in the order of the file
+        list. Files that were loaded by an interrupted build are skipped
+        if the argument 'resume' is set.
+        """
         self._file_list = self.get_file_list(self.arguments.path,
                                              self.file_filter)
         if not self._file_list:
@@ -1004,20 +1303,35 @@ class BaseCorpusBuilder(corpus.SQLResource):
             self._widget.progressSet.emit(len(self._file_list), "")
             self._widget.progressUpdate.emit(0)
 
-        for i, file_name in enumerate(self._file_list):
-            if self._widget:
-                self._widget.labelSet.emit(
-                    self._read_file_formatter.format(file=file_name))
+        file_list = [x for x in self._file_list
+                     if x not in self._loaded_files]
+        skipped = len(self._file_list) - len(file_list)
 
-            if self.interrupted:
-                return
-            if not self.db_has(self.file_table, {self.file_path: file_name}):
+        pool = self.get_load_pool()
+        if pool:
+            results = pool.imap(_load_file, file_list)
+        try:
+            for i, file_name in enumerate(file_list):
+                if self._widget:
+                    self._widget.labelSet.emit(
+                        self._read_file_formatter.format(file=file_name))
+
+                if self.interrupted:
+                    return
                 logging.info("Loading file %s" % (file_name))
-                self.store_filename(file_name)
-                self.process_file(file_name)
-            if self._widget:
-                self._widget.progressUpdate.emit(i + 1)
-            self.commit_data()
+                if pool:
+                    self.merge_file_records(*next(results))
+                else:
+                    self.store_filename(file_name)
+                    self.process_file(file_name)
+                if self._widget:
+                    self._widget.progressUpdate.emit(skipped + i + 1)
+                self.commit_data()
+                self.store_checkpoint(file_name, skipped + i)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
 
     def db_has(self, table, values, case=False):
         return len(self.db_find(table, values, case).index) > 0
@@ -1123,67 +1437,106 @@ class BaseCorpusBuilder(corpus.SQLResource):
 
         return corpus_columns + word_columns
 
-    def build_lookup_get_insert_string(self):
-        template = """
-            INSERT INTO {corpus_ngram} ({columns})
-            SELECT {columns}
-            {join}"""
-
-        columns = self.build_lookup_get_ngram_columns()
-        joins = self.get_corpus_joins(
-            [(i+1, "*") for i in range(self.corpusngram_width)],
-            ignore_ngram=True)
+    def build_lookup_get_ngram_chunk(self, df, upper, na_value):
+        """
+        Return the rows of the N-gram lookup table for a range of corpus
+        rows.
 
-        s = template.format(
-            corpus_ngram=self.corpusngram_table,
-            columns=", ".join(columns),
-            join="\n".join(joins))
+        The word columns are produced by shifting the word ids of the corpus
+        rows. If there is no corpus row for a position within the N-gram,
+        e.g. at the end of the corpus, the word column contains the NA value.
 
-        return s
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            The corpus rows, ordered by their id. In addition to the rows in
+            the range, the data frame contains the next (width - 1) rows of
+            the corpus.
+        upper : int
+            The smallest corpus id that is not in the range
+        na_value : int or str
+            The value that is used for missing words
 
-    def build_lookup_get_padding_string(self):
-        """
-        Returns a string that can be used to pad the last rows of an N-gram
-        lookup table.
+        Returns
+        -------
+        df : pandas.DataFrame
+            A data frame with the columns from
+            :func:`build_lookup_get_ngram_columns`, containing one row for
+            each corpus row in the range.
         """
-        template = """
-            INSERT INTO {corpus_ngram} ({columns})
-            VALUES {values}"""
+        word_id = (getattr(self, "corpus_word_id", None) or
+                   getattr(self, "corpus_word"))
+        width = self.corpusngram_width
         columns = self.build_lookup_get_ngram_columns()
 
+        ids = df[self.corpus_id].values
+        words = df[word_id].values
+        n = int(np.searchsorted(ids, upper))
+        if words.dtype.kind in "iu" and isinstance(na_value, int):
+            dtype = words.dtype
+        else:
+            dtype = object
+
+        data = collections.OrderedDict(
+            [(name, df[name[:-1]].values[:n])
+             for name in columns[:-width]])
+        if len(ids):
+            for i, name in enumerate(columns[-width:]):
+                # find the corpus row that is i positions to the right:
+                target = ids[:n] + i
+                pos = np.minimum(np.searchsorted(ids, target), len(ids) - 1)
+                values = np.full(n, na_value, dtype=dtype)
+                valid = ids[pos] == target
+                values[valid] = words[pos[valid]]
+                data[name] = values
+        else:
+            for name in columns[-width:]:
+                data[name] = np.full(0, na_value, dtype=dtype)
+        return pd.DataFrame(data)
+
+    def build_lookup_read_ngram_chunk(self, bounds, na_value):
+        """
+        Read the corpus rows in the range, and return the rows of the
+        N-gram lookup table, see :func:`build_lookup_get_ngram_chunk`.
+
+        Parameters
+        ----------
+        bounds : tuple
+            A tuple containing the smallest corpus id in the range and the
+            smallest corpus id that is not in the range
+        na_value : int or str
+            The value that is used for missing words
+        """
+        lower, upper = bounds
         word_id = (getattr(self, "corpus_word_id", None) or
                    getattr(self, "corpus_word"))
+        columns = self.build_lookup_get_ngram_columns()
+        corpus_columns = [x[:-1]
+                          for x in columns[:-self.corpusngram_width]]
 
-        values = []
-        corpus_table = self._new_tables[self.corpus_table]
-        numerics = {col: corpus_table.get_column(
-                            col.rstrip("1234567890")).is_numeric()
-                    for col in columns}
-
-        for pad in range(1, self.corpusngram_width):
-            pos = self.corpusngram_width - pad
-            row = ["{{last_row}} + {}".format(pos)]
-            row += ["{{{}}}".format(x) if numerics[x] else
-                    "'{{{}}}'".format(x)
-                    for x in columns[1:-self.corpusngram_width]]
-
-            word_columns = (["{{{word}{n}}}".format(
-                                word=word_id,
-                                n=self.corpusngram_width - i)
-                             for i in reversed(range(pad))] +
-                            ["{na_value}"] * (pos))
-
-            values.insert(0, ", ".join(row + word_columns))
-
-        return template.format(
-            corpus_ngram=self.corpusngram_table,
-            columns=", ".join(columns),
-            values=""",
-                   """.join(["({})".format(x) for x in values]))
+        S = """
+            SELECT {columns}
+            FROM {corpus}
+            WHERE {corpus_id} >= {lower} AND {corpus_id} < {upper}
+            ORDER BY {corpus_id}""".format(
+                columns=", ".join(corpus_columns + [word_id]),
+                corpus=self.corpus_table,
+                corpus_id=self.corpus_id,
+                lower=lower,
+                upper=upper + self.corpusngram_width - 1)
+        with self.DB.engine.connect() as connection:
+            df = pd.read_sql(S.strip(), connection)
+        return self.build_lookup_get_ngram_chunk(df, upper, na_value)
 
     def build_lookup_ngram(self):
         """
         Create a lookup table for multi-item query strings.
+
+        The corpus table is read once in the order of the corpus ids, in
+        chunks of _ngram_chunk_size rows. The rows of the lookup table are
+        calculated for each chunk and bulk-loaded into the lookup table. On
+        MySQL, the chunks are read in parallel if the argument 'workers' is
+        larger than 1.
         """
 
         # create N-gram class attributes:
@@ -1192,13 +1545,11 @@ class BaseCorpusBuilder(corpus.SQLResource):
         setattr(type(self),
                 "corpusngram_width", int(self.arguments.ngram_width))
 
-        # determine highest ID in the corpus table
-        S = "SELECT MAX({}) FROM {}".format(self.corpus_id, self.corpus_table)
+        # determine the range of IDs in the corpus table
+        S = "SELECT MIN({id}), MAX({id}) FROM {corpus}".format(
+            id=self.corpus_id, corpus=self.corpus_table)
         with self.DB.engine.connect() as connection:
-            result = connection.execute(S).fetchone()
-        print(S)
-        print(result)
-        max_id = result[0]
+            min_id, max_id = connection.execute(S).fetchone()
         logging.info("Creating lookup table, max_id is {}".format(max_id))
 
         # determine suitable NA value
@@ -1207,12 +1558,6 @@ class BaseCorpusBuilder(corpus.SQLResource):
         else:
             na_value = DEFAULT_MISSING_VALUE
 
-        step = 250000 // self.corpusngram_width
-        current_id = 0
-
-        word_id = (getattr(self, "corpus_word_id", None) or
-                   getattr(self, "corpus_word"))
-
         ngram_table = self.build_lookup_get_ngram_table()
         self.create_table_description(self.corpusngram_table,
                                       ngram_table.columns)
@@ -1222,66 +1567,441 @@ class BaseCorpusBuilder(corpus.SQLResource):
                 options.cfg.current_connection.db_type(),
                 self._new_tables.values()))
 
+        if max_id is None:
+            return
+
+        step = self._ngram_chunk_size
+        ranges = [(lower, min(lower + step, max_id + 1))
+                  for lower in range(min_id, max_id + 1, step)]
+
+        # SQLite does not allow reading while the lookup table is written:
+        workers = getattr(self.arguments, "workers", 1) or 1
+        if self.DB.db_type != SQL_MYSQL:
+            workers = 1
+
         self._widget.progressSet.emit(
-            1 + ((max_id-1) // step),
+            len(ranges),
             "Creating ngram lookup table... (chunk %v of %m)")
-        self._widget.progressUpdate.emit(1)
-
-        sql_template = """
-            {insert_str}
-            WHERE {token_range}"""
+        self._widget.progressUpdate.emit(0)
 
-        _chunk = 1
-        with self.DB.engine.connect() as connection:
-            while current_id <= max_id and not self.interrupted:
-                token_range = (
-                    "{token}1 >= {lower} AND {token}1 < {upper}".format(
-                        token=self.corpus_id,
-                        lower=current_id,
-                        upper=current_id + step))
-
-                S = sql_template.format(
-                    insert_str=self.build_lookup_get_insert_string(),
-                    token_range=token_range)
-
-                connection.execute(S.strip().replace("\n", " "))
-                current_id = current_id + step
-
-                _chunk += 1
-                self._widget.progressUpdate.emit(_chunk)
-
-            padding_str = self.build_lookup_get_padding_string()
-
-            # get the last (width - 1) tokens from the corpus:
-            query_max_row = """
-                SELECT *
-                FROM {corpus}
-                WHERE {corpus_id} > {max_id} - {width}
-                ORDER BY {corpus_id}""".format(
-                    corpus=self.corpus_table,
-                    corpus_id=self.corpus_id,
-                    max_id=max_id,
-                    width=self.corpusngram_width - 1)
-            print(query_max_row)
-            df = pd.read_sql(query_max_row, connection)
-            print(df)
-
-            data_dict = {"{}1".format(x): df.iloc[-1][x]
-                         for x in df.iloc[-1].index if x != word_id}
-            word_dict = {"{}{}".format(word_id, i+2): x
-                         for i, x in enumerate(df[word_id].values)}
-            kwargs = {"na_value": na_value,
-                      "last_row": (df.iloc[-1][self.corpus_id] -
-                                   self.corpusngram_width + 1)}
-            kwargs.update(data_dict)
-            kwargs.update(word_dict)
-            S = padding_str.format(**kwargs)
-            print(S)
-            connection.execute(S.replace("\n", " ").strip())
+        pool = ThreadPool(workers) if workers > 1 else None
+        try:
+            _chunk = 0
+            # only read as many chunks as there are workers ahead of the
+            # chunk that is loaded, so that the memory usage is bounded:
+            for i in range(0, len(ranges), workers):
+                if self.interrupted:
+                    break
+                batch = ranges[i:i + workers]
+                if pool:
+                    chunks = pool.map(
+                        lambda x: self.build_lookup_read_ngram_chunk(
+                            x, na_value),
+                        batch)
+                else:
+                    chunks = [self.build_lookup_read_ngram_chunk(
+                        x, na_value) for x in batch]
+                for df in chunks:
+                    self.DB.bulk_insert(df, self.corpusngram_table)
+                    _chunk += 1
+                    self._widget.progressUpdate.emit(_chunk)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
 
     def build_index_ngram(self):
         pass
 
+    def build_frequency_get_insert_string(self, rc_feature, table_name,
+                                          db_type):
+        """
+        Return the SQL string that fills the frequency table for the
+        resource feature.
+
+        Parameters
+        ----------
+        rc_feature : str
+            The resource feature that is counted
+        table_name : str
+            The name of the frequency table
+        db_type : str
+            The database type. In MySQL, the values are grouped by their
+            binary representation so that case-sensitive lookups remain
+            possible.
+        """
+        query_items = [(1, "*")]
+        joins = self.get_corpus_joins(query_items, ignore_ngram=True)
+        self.get_condition_list(query_items, joins, [rc_feature])
+        alias = self.get_feature_alias(rc_feature)
+
+        if db_type == SQL_MYSQL:
+            label = "MIN({})".format(alias)
+            group = "BINARY {}".format(alias)
+        else:
+            label = alias
+            group = alias
+
+        template = """
+            INSERT INTO {table} ({label_column}, {count_column})
+            SELECT {label}, COUNT(*)
+            {joins}
+            GROUP BY {group}"""
+        return template.format(table=table_name,
+                               label_column=self._frequency_label,
+                               count_column=self._frequency_count,
+                               label=label,
+                               joins="\n".join(joins),
+                               group=group)
+
+    def build_frequency_tables(self):
+        """
+        Create a frequency table for the word and the lemma query item
+        types.
+
+        Each frequency table contains the number of tokens for each distinct
+        value of the resource feature that is mapped to the query item type.
+        The tables are used by CorpusClass.get_label_frequencies(), e.g. in
+        order to calculate the collocate frequencies, so that these
+        frequencies are not counted in the corpus table at query time.
+        """
+        self.set_query_items()
+
+        for query_item in [QUERY_ITEM_WORD, QUERY_ITEM_LEMMA]:
+            if self.interrupted:
+                return
+
+            rc_feature = getattr(self, query_item, None)
+            if not rc_feature:
+                continue
+
+            item_type = query_item.rpartition("_")[-1]
+            table_name = "{}Frequency{}".format(self.corpus_table,
+                                                item_type.capitalize())
+
+            _, tab, _ = self.split_resource_feature(rc_feature)
+            try:
+                column = self._new_tables[
+                    getattr(self, "{}_table".format(tab))].get_column(
+                        getattr(self, rc_feature))
+                data_type = column.data_type
+                base_type = column.base_type
+            except (KeyError, AttributeError):
+                data_type = base_type = "VARCHAR(255)"
+
+            description = "{label} {data_type}, {count} INT NOT NULL".format(
+                label=self._frequency_label,
+                data_type=data_type,
+                count=self._frequency_count)
+            S = self.build_frequency_get_insert_string(
+                rc_feature, table_name, self.DB.db_type)
+            try:
+                self.DB.create_table(table_name, description)
+                self.DB.connection.execute(S.strip())
+                if base_type.upper().endswith("TEXT"):
+                    length = self.DB.get_index_length(
+                        table_name, self._frequency_label)
+                else:
+                    length = None
+                self.DB.create_index(
+                    table_name,
+                    "{}{}".format(table_name, self._frequency_label),
+                    [self._frequency_label],
+                    index_length=length)
+            except Exception as e:
+                print(e)
+                logging.warning(e)
+                continue
+
+            setattr(type(self),
+                    "frequency_{}_table".format(item_type), table_name)
+
+    @staticmethod
+    def build_pattern_get_trigrams(df, label_column, id_column):
+        """
+        Return a data frame with the distinct lower-case character trigrams
+        of the labels in the data frame, together with the id of the label.
+        """
+        rows = set()
+        for label, row_id in zip(df[label_column], df[id_column]):
+            label = utf8(label).lower()
+            for i in range(len(label) - 2):
+                rows.add((label[i:i+3], row_id))
+        return pd.DataFrame(sorted(rows), columns=[label_column, id_column])
+
+    def build_pattern_tables(self):
+        """
+        Create lookup tables for suffix and infix queries for the word and
+        the lemma query item types.
+
+        For each query item type, one table contains the reversed values of
+        the resource feature that is mapped to the query item type, and
+        another table contains the character trigrams of these values. The
+        values are stored in lower case together with the id of their
+        lexicon entry. With an index on the values, query items that start
+        with a wildcard can be looked up without scanning the whole lexicon,
+        see SQLResource.get_pattern_prefilter().
+
+        The lexicon is read in ranges of _pattern_chunk_size ids, and the
+        rows of the lookup tables are bulk-loaded for each range. On MySQL,
+        the column for the reversed values has the data type of the lexicon
+        column.
+
+        The tables are only built if the class attribute _pattern_tables is
+        True.
+        """
+        if not self._pattern_tables:
+            return
+
+        self.set_query_items()
+
+        for query_item in [QUERY_ITEM_WORD, QUERY_ITEM_LEMMA]:
+            if self.interrupted:
+                return
+
+            rc_feature = getattr(self, query_item, None)
+            if not rc_feature:
+                continue
+            _, tab, _ = self.split_resource_feature(rc_feature)
+            if tab == "corpus":
+                continue
+
+            item_type = query_item.rpartition("_")[-1]
+            table = getattr(self, "{}_table".format(tab))
+            column = getattr(self, rc_feature)
+            id_column = getattr(self, "{}_id".format(tab))
+
+            if self.DB.db_type == SQL_MYSQL:
+                try:
+                    col = self._new_tables[table].get_column(column)
+                    label_type = col.data_type
+                    base_type = col.base_type
+                except (KeyError, AttributeError):
+                    label_type = (self.DB.get_field_type(table, column) or
+                                  "TEXT")
+                    base_type = label_type.partition("(")[0]
+                label_type = label_type.replace(" NOT NULL", "")
+                trigram_type = "VARCHAR(3)"
+            else:
+                label_type = trigram_type = "TEXT COLLATE NOCASE"
+                base_type = "TEXT"
+
+            tables = {}
+            for kind, data_type in [("reverse", label_type),
+                                    ("trigram", trigram_type)]:
+                table_name = "{}{}{}".format(self.corpus_table,
+                                             kind.capitalize(),
+                                             item_type.capitalize())
+                description = "{label} {data_type}, {id} INT".format(
+                    label=self._pattern_label, data_type=data_type,
+                    id=self._pattern_id)
+                self.DB.create_table(table_name, description)
+                tables[kind] = table_name
+
+            S = "SELECT MIN({id}), MAX({id}) FROM {table}".format(
+                id=id_column, table=table)
+            with self.DB.engine.connect() as connection:
+                min_id, max_id = connection.execute(S).fetchone()
+
+            S = """
+                SELECT {id} AS {id_label}, {column} AS {label}
+                FROM {table}
+                WHERE {id} >= {{lower}} AND {id} < {{upper}}""".format(
+                    id=id_column, id_label=self._pattern_id,
+                    column=column, label=self._pattern_label, table=table)
+
+            try:
+                if max_id is None:
+                    bounds = []
+                else:
+                    bounds = range(min_id, max_id + 1,
+                                   self._pattern_chunk_size)
+                for lower in bounds:
+                    if self.interrupted:
+                        return
+                    with self.DB.engine.connect() as connection:
+                        df = pd.read_sql(
+                            S.format(
+                                lower=lower,
+                                upper=lower + self._pattern_chunk_size
+                            ).strip(),
+                            connection)
+                    df = df[df[self._pattern_label].notnull()]
+                    reverse = pd.DataFrame({
+                        self._pattern_label: [utf8(x).lower()[::-1] for x
+                                              in df[self._pattern_label]],
+                        self._pattern_id: df[self._pattern_id].values})
+                    self.DB.bulk_insert(reverse, tables["reverse"])
+                    self.DB.bulk_insert(
+                        self.build_pattern_get_trigrams(
+                            df, self._pattern_label, self._pattern_id),
+                        tables["trigram"])
+
+                for kind, table_name in tables.items():
+                    index_length = None
+                    if (kind == "reverse" and
+                            self.DB.db_type == SQL_MYSQL and
+                            base_type.upper().endswith("TEXT")):
+                        index_length = self.DB.get_index_length(
+                            table_name, self._pattern_label)
+                    self.DB.create_index(
+                        table_name,
+                        "{}{}".format(table_name, self._pattern_label),
+                        [self._pattern_label],
+                        index_length=index_length)
+            except Exception as e:
+                S = "Error building the {} lookup tables for {}: {}".format(
+                    item_type, table, e)
+                logging.error(S)
+                print(S)
+                raise e
+
+            for kind, table_name in tables.items():
+                setattr(type(self), "{}_{}_table".format(kind, item_type),
+                        table_name)
+
+    def get_marginal_features(self):
+        """
+        Return a list of feature tuples for which marginal count tables are
+        built by build_marginal_tables().
+
+        The list contains one tuple for each corpus feature that is not
+        stored in the corpus table itself and that is neither a time feature
+        nor a feature of an annotation table, followed by the pairs from the
+        class attribute _marginal_pairs.
+        """
+        l = []
+        for rc_feature, _ in self.get_corpus_features():
+            _, tab, feature = self.split_resource_feature(rc_feature)
+            if (tab.startswith("corpus") or
+                    tab in self.annotations or
+                    feature in ("id", "columns", "starttime", "endtime") or
+                    rc_feature in self._time_features or
+                    not isinstance(getattr(self, rc_feature), str)):
+                continue
+            l.append((rc_feature,))
+        l = sorted(l)
+        for pair in self._marginal_pairs:
+            if tuple(pair) not in l:
+                l.append(tuple(pair))
+        return l
+
+    def build_marginal_get_insert_string(self, features, table_name,
+                                         db_type):
+        """
+        Return the SQL string that fills the marginal count table for the
+        resource features.
+
+        Parameters
+        ----------
+        features : tuple
+            The resource features that are counted
+        table_name : str
+            The name of the marginal count table
+        db_type : str
+            The database type. In MySQL, the values are grouped by their
+            binary representation so that case-sensitive lookups remain
+            possible.
+        """
+        query_items = [(1, "*")]
+        joins = self.get_corpus_joins(query_items, ignore_ngram=True)
+        self.get_condition_list(query_items, joins, list(features))
+        aliases = [self.get_feature_alias(x) for x in features]
+        corpus_id = self.get_feature_alias("corpus_id")
+
+        if db_type == SQL_MYSQL:
+            labels = ["MIN({})".format(x) for x in aliases]
+            groups = ["BINARY {}".format(x) for x in aliases]
+        else:
+            labels = groups = aliases
+
+        template = """
+            INSERT INTO {table} ({columns}, {count}, {min}, {max})
+            SELECT {labels}, COUNT(*), MIN({id}), MAX({id})
+            {joins}
+            GROUP BY {groups}"""
+        return template.format(table=table_name,
+                               columns=", ".join(features),
+                               count=self._frequency_count,
+                               min=self._marginal_min,
+                               max=self._marginal_max,
+                               labels=", ".join(labels),
+                               id=corpus_id,
+                               joins="\n".join(joins),
+                               groups=", ".join(groups))
+
+    def build_marginal_tables(self):
+        """
+        Create a marginal count table for each corpus feature, and for each
+        pair of corpus features in the class attribute _marginal_pairs.
+
+        Each marginal count table contains the number of tokens as well as
+        the lowest and the highest corpus id for each distinct combination
+        of values of the resource features. The tables are used by
+        CorpusClass.get_corpus_size() and CorpusClass.get_subcorpus_table()
+        so that the sizes of subcorpora are not counted in the corpus table
+        at query time.
+        """
+        if not self._marginal_tables:
+            return
+
+        for features in self.get_marginal_features():
+            if self.interrupted:
+                return
+
+            table_name = "{}Marginal{}".format(
+                self.corpus_table,
+                "".join([x.capitalize()
+                         for feature in features
+                         for x in feature.split("_")]))
+
+            columns = []
+            text_columns = False
+            for rc_feature in features:
+                _, tab, _ = self.split_resource_feature(rc_feature)
+                try:
+                    column = self._new_tables[
+                        getattr(self, "{}_table".format(tab))].get_column(
+                            getattr(self, rc_feature))
+                    data_type = column.data_type
+                    base_type = column.base_type
+                except (KeyError, AttributeError):
+                    data_type = base_type = "VARCHAR(255)"
+                if base_type.upper().endswith("TEXT"):
+                    text_columns = True
+                columns.append("{} {}".format(rc_feature, data_type))
+
+            description = ", ".join(
+                columns +
+                ["{} INT NOT NULL".format(self._frequency_count),
+                 "{} INT".format(self._marginal_min),
+                 "{} INT".format(self._marginal_max)])
+            S = self.build_marginal_get_insert_string(
+                features, table_name, self.DB.db_type)
+            try:
+                self.DB.create_table(table_name, description)
+                self.DB.connection.execute(S.strip())
+                # TEXT columns can only be indexed by a prefix, so only the
+                # first feature is indexed in that case:
+                if text_columns:
+                    variables = [features[0]]
+                    length = self.DB.get_index_length(table_name,
+                                                      features[0])
+                else:
+                    variables = list(features)
+                    length = None
+                self.DB.create_index(
+                    table_name, "{}Features".format(table_name),
+                    variables, index_length=length)
+            except Exception as e:
+                print(e)
+                logging.warning(e)
+                continue
+
+            setattr(type(self),
+                    "marginal_{}_table".format("__".join(features)),
+                    table_name)
+
     def build_optimize(self):
         """
         Optimizes the table columns so that they use a minimal amount
@@ -1354,68 +2074,187 @@ class BaseCorpusBuilder(corpus.SQLResource):
         if self.interrupted:
             return
 
-    def build_create_indices(self):
+    def get_indexed_columns(self):
         """
-        Create a MySQL index for each column in the database.
+        Return the columns that are used by queries.
 
-        In Coquery, each column of a corpus table can be included in the
-        output, and the columns are also available for filtering. As access
-        to MySQL columns can be very significantly faster if the column is
-        indexed, the corpus builder creates indices for any data column.
+        A column is used if it stores a resource feature that can be
+        selected in a query, or if it is a key that is used to join another
+        table.
 
-        The downside is that indexing may take considerable time for larger
-        corpora such as the British National Corpus or the Corpus of
-        Contemporary American English. Indices also increase the disk space
-        required to store the corpus database.
+        Returns
+        -------
+        d : dict
+            A dictionary with table names as keys and sets of column names
+            as values. Tables that are not resource tables, e.g. the N-gram
+            lookup table, are not included.
+        """
+        features = [x for x in self.get_class_variables()
+                    if "_" in x and not x.startswith("_") and
+                    isinstance(getattr(self, x), str)]
+        table_names = {}
+        for rc_feature in features:
+            _, tab, feature = self.split_resource_feature(rc_feature)
+            if feature == "table":
+                table_names[tab] = getattr(self, rc_feature)
+
+        binary = (self.audio_features + self.video_features +
+                  self.image_features)
+        d = {name: set() for name in table_names.values()}
+        for rc_feature in features:
+            _, tab, feature = self.split_resource_feature(rc_feature)
+            if (tab in table_names and
+                    feature not in ("table", "columns") and
+                    rc_feature not in binary):
+                d[table_names[tab]].add(getattr(self, rc_feature))
+
+        for table in self._new_tables.values():
+            if table.name in d:
+                d[table.name].update([column.name for column in table.columns
+                                      if column.key])
+        return d
+
+    def get_composite_indices(self):
+        """
+        Return the composite indices for the common lookup patterns.
+
+        A composite index is created for the word and the part-of-speech
+        and for the lemma and the part-of-speech if these query items are
+        stored in the same table. The primary key of the table is included
+        so that joins can be resolved by using the index alone.
 
-        However, the performance increase won by indexing usually clearly
-        outweighs these disadvantages.
+        Returns
+        -------
+        l : list
+            A list of tuples, each containing the table name, the index name,
+            and the list of indexed columns.
         """
-        index_list = []
-        for table_name in self._new_tables:
+        self.set_query_items()
+        l = []
+        for first, second in [(QUERY_ITEM_WORD, QUERY_ITEM_POS),
+                              (QUERY_ITEM_LEMMA, QUERY_ITEM_POS)]:
+            try:
+                features = [getattr(self, first), getattr(self, second)]
+                tabs = [self.split_resource_feature(x)[1] for x in features]
+                table_name = getattr(self, "{}_table".format(tabs[0]))
+            except (AttributeError, ValueError):
+                continue
+            if tabs[0] != tabs[1] or table_name not in self._new_tables:
+                continue
             table = self._new_tables[table_name]
-            for column in table.columns:
-                if not isinstance(column, Identifier):
-                    index_list.append((table.name, column.name))
+            columns = [getattr(self, x) for x in features]
+            if table.primary and table.primary.name not in columns:
+                columns.append(table.primary.name)
+
+            # TEXT and BLOB columns require index lengths:
+            if any([table.get_column(x) is None or
+                    table.get_column(x).base_type.endswith(("TEXT", "BLOB"))
+                    for x in columns]):
+                continue
+            index = (table_name, "_".join(columns), columns)
+            if index not in l:
+                l.append(index)
+        return l
 
-        if self._widget:
-            self._widget.progressSet.emit(len(index_list),
-                                          "Creating indices... (%v of %m)")
-            self._widget.progressUpdate.emit(0)
+    def get_index_list(self):
+        """
+        Return the indices that are created by :func:`build_create_indices`.
 
-        i = 0
-        for table, column in index_list:
-            if self.interrupted:
-                return
+        By default, there is an index for each column that is not the
+        primary key. If the argument 'index_mode' is "used", only the
+        columns from :func:`get_indexed_columns` are indexed, and the
+        composite indices from :func:`get_composite_indices` are added.
 
-            try:
-                this_column = self._new_tables[table].get_column(column)
+        Returns
+        -------
+        l : list
+            A list of tuples, each containing the table name, the index name,
+            the list of indexed columns, and the index length (or None).
+        """
+        used_only = getattr(self.arguments, "index_mode", "all") == "used"
+        if used_only:
+            used_columns = self.get_indexed_columns()
+
+        index_list = []
+        for table_name in self._new_tables:
+            table = self._new_tables[table_name]
+            for column in table.columns:
+                if isinstance(column, Identifier):
+                    continue
+                if (used_only and table.name in used_columns and
+                        column.name not in used_columns[table.name]):
+                    continue
 
                 # do not create an index for BLOBs (they are used only to
                 # store binary information that should never be used for
                 # queries or joins):
-                if this_column.base_type.endswith("BLOB"):
+                if column.base_type.endswith("BLOB"):
                     continue
 
                 # indices for TEXT columns require a key length:
-                if this_column.base_type.endswith("TEXT"):
+                if column.base_type.endswith("TEXT"):
                     logging.warning("TEXT data type is deprecated")
-                    if this_column.index_length:
-                        length = this_column.index_length
+                    if column.index_length:
+                        length = column.index_length
                     else:
-                        length = self.DB.get_index_length(table, column)
+                        try:
+                            length = self.DB.get_index_length(table.name,
+                                                              column.name)
+                        except Exception as e:
+                            print(e)
+                            logging.warning(e)
+                            continue
                 else:
                     length = None
+                index_list.append((table.name, column.name, [column.name],
+                                   length))
 
-                self.DB.create_index(table, column, [column],
-                                     index_length=length)
-            except Exception as e:
-                print(e)
-                logging.warning(e)
+        if used_only:
+            index_list += [(table, name, columns, None) for
+                           table, name, columns
+                           in self.get_composite_indices()]
+        return index_list
 
-            i += 1
+    def build_create_indices(self):
+        """
+        Create a MySQL index for each column in the database.
+
+        In Coquery, each column of a corpus table can be included in the
+        output, and the columns are also available for filtering. As access
+        to MySQL columns can be very significantly faster if the column is
+        indexed, the corpus builder creates indices for any data column.
+
+        The downside is that indexing may take considerable time for larger
+        corpora such as the British National Corpus or the Corpus of
+        Contemporary American English. Indices also increase the disk space
+        required to store the corpus database. The argument 'index_mode'
+        can be set to "used" in order to index only those columns that are
+        used by queries, see :func:`get_index_list`.
+
+        On MySQL, the indices of each table are added by a single ALTER
+        TABLE statement, and the tables are indexed concurrently if the
+        argument 'workers' is larger than 1. On SQLite, all indices are
+        created within one transaction.
+
+        However, the performance increase won by indexing usually clearly
+        outweighs these disadvantages.
+        """
+        index_list = self.get_index_list()
+
+        if self._widget:
+            self._widget.progressSet.emit(len(index_list),
+                                          "Creating indices... (%v of %m)")
+            self._widget.progressUpdate.emit(0)
+
+        def progress(i):
             if self._widget:
-                self._widget.progressUpdate.emit(i + 1)
+                self._widget.progressUpdate.emit(i)
+
+        self.DB.create_indices(
+            index_list,
+            workers=getattr(self.arguments, "workers", 1) or 1,
+            callback=progress,
+            interrupted=lambda: self.interrupted)
 
     def get_class_variables(self):
         return dir(self)
@@ -1700,12 +2539,27 @@ class BaseCorpusBuilder(corpus.SQLResource):
                     logging.info("Import failed.")
                     raise DependencyError(package, url)
 
+        self.setup_connection()
+        logging.info("Builder initialized")
+
+    def setup_connection(self):
+        """
+        Set the session options of the database connection that is used
+        during the build.
+        """
         if self.DB.db_type == SQL_MYSQL:
             self.DB.connection.execute("SET NAMES 'utf8'")
             self.DB.connection.execute("SET CHARACTER SET 'utf8mb4'")
             self.DB.connection.execute("SET unique_checks=0")
             self.DB.connection.execute("SET foreign_key_checks=0")
-        logging.info("Builder initialized")
+        elif (self.DB.db_type == SQL_SQLITE and
+              not getattr(self.arguments, "resume", False)):
+            # The database file is removed if the build fails, so there is
+            # no need for a rollback journal or for waiting until the
+            # writes have reached the disk. Resumable builds keep these
+            # safeguards so that the database survives an interruption.
+            self.DB.connection.execute("PRAGMA journal_mode=OFF")
+            self.DB.connection.execute("PRAGMA synchronous=OFF")
 
     def remove_build(self):
         """
@@ -1742,7 +2596,8 @@ class BaseCorpusBuilder(corpus.SQLResource):
     def build_finalize(self):
         """ Wrap up everything after the corpus installation is complete. """
         if self.interrupted:
-            self.remove_build()
+            if not getattr(self.arguments, "resume", False):
+                self.remove_build()
             S = "Interrupted building {} (after {:.3f} seconds)".format(
                 self.name, time.time() - self.start_time)
         else:
@@ -1769,6 +2624,14 @@ class BaseCorpusBuilder(corpus.SQLResource):
           requires a lot of disk space
         * :func:`build_optimize` to ensure that the SQL tables use the optimal
           data format for the data
+        * :func:`build_frequency_tables` to store the frequencies of words
+          and lemmas so that they don't need to be counted at query time
+        * :func:`build_marginal_tables` to store the sizes of the
+          subcorpora defined by the corpus features so that they don't need
+          to be counted at query time
+        * :func:`build_pattern_tables` to create lookup tables for suffix
+          and infix queries (if enabled by the class attribute
+          _pattern_tables)
         * :func:`build_create_indices` to create database indices that speed
           up the SQL queries
         * :func:`build_write_module` to write the corpus module to the
@@ -1794,7 +2657,12 @@ class BaseCorpusBuilder(corpus.SQLResource):
                 self._widget.progressUpdate.emit(0)
 
         self.check_arguments()
-        self.setup_db(self.arguments.only_module)
+        resume = getattr(self.arguments, "resume", False)
+        self.setup_db(self.arguments.only_module or resume)
+        # only the database of an interrupted build can be resumed:
+        if (resume and not self.arguments.only_module and
+                self.get_checkpoint() is None):
+            self.setup_db(False)
 
         if self._widget:
             steps = 3 + (int(self.arguments.lookup_ngram) +
@@ -1818,17 +2686,22 @@ class BaseCorpusBuilder(corpus.SQLResource):
                         if self.arguments.metadata:
                             self.add_metadata(self.arguments.metadata,
                                               self.arguments.metadata_column)
-                        self.build_create_tables()
+                        if resume and self.get_checkpoint() is not None:
+                            self._loaded_files = self.restore_checkpoint()
+                        else:
+                            self.build_create_tables()
                         #progress_done()
 
                     # read files
                     if not self.interrupted:
                         logging.info("Stage 2")
                         current = progress_next(current)
-                        if self.arguments.metadata:
+                        if self.arguments.metadata and not self._loaded_files:
                             self.store_metadata()
                         self.build_load_files()
                         self.commit_data()
+                        if not self.interrupted:
+                            self.remove_checkpoint()
                         #progress_done()
 
                     # any additional stage
@@ -1840,6 +2713,9 @@ class BaseCorpusBuilder(corpus.SQLResource):
                                 stage()
                         #progress_done()
 
+                    # the lookups are not needed anymore:
+                    self.close_lookups()
+
                     # optimize
                     if (not self.interrupted and
                             self.DB.db_type == SQL_MYSQL):
@@ -1862,6 +2738,21 @@ class BaseCorpusBuilder(corpus.SQLResource):
                         print(S)
                         raise e
 
+                    # frequency tables
+                    if not self.interrupted:
+                        logging.info("Stage 5a")
+                        self.build_frequency_tables()
+
+                    # marginal count tables
+                    if not self.interrupted:
+                        logging.info("Stage 5b")
+                        self.build_marginal_tables()
+
+                    # lookup tables for suffix and infix queries
+                    if not self.interrupted:
+                        logging.info("Stage 5c")
+                        self.build_pattern_tables()
+
                     # build indexes
                     if not self.interrupted:
                         logging.info("Stage 6")
@@ -1875,17 +2766,33 @@ class BaseCorpusBuilder(corpus.SQLResource):
                     current = progress_next(current)
                     self.build_write_module()
 
+                    # remove query results for previous installations of
+                    # the corpus from the cache:
+                    query_cache = getattr(options.cfg, "query_cache", None)
+                    if query_cache is not None:
+                        query_cache.invalidate(self.name)
+                    corpus.SQLResource.clear_token_frequency_cache(
+                        self.arguments.db_name)
+                    corpus.SQLResource.clear_lexicon_id_cache(
+                        self.arguments.db_name)
+
                 self.build_finalize()
+                # build_load_files() may have replaced the connection:
+                self.DB.connection.close()
             except Exception as e:
                 for x in get_error_repr(sys.exc_info()):
                     print(x)
                     logging.warning(x)
                 logging.warning(str(e))
                 print(str(e))
-                self.remove_build()
+                self.close_lookups()
+                # keep the database so that the build can be resumed:
+                if not resume:
+                    self.remove_build()
                 self.DB.connection.close()
                 raise e
-        self.DB.engine.dispose()
+        options.cfg.current_connection.dispose_engines(
+            self.arguments.db_name)
 
     def create_installer_module(self):
         """
@@ -17,6 +17,10 @@ LOG_STRING = "%(asctime)s %(levelname)-8s %(message)s"
 
 DEFAULT_MISSING_VALUE = "<NA>"
 
+# Wildcard query items are resolved to the ids of the matching lexicon
+# entries if there are at most this many entries:
+DEFAULT_LEXICON_ID_LIMIT = 5000
+
 # The following labels are used to refer to the different types of query
 # tokens, e.g. in corpusbuilder.py when mapping the different query item
 # types to different fields in the data base:
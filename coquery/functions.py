@@ -800,11 +800,18 @@ class Freq(BaseFreq):
             pass
         # ignore external columns:
         columns = [x for x in self.columns if not x.startswith("db_")]
+        # rows that were aggregated by the database carry the number of
+        # matches that they stand for in 'coquery_invisible_row_count':
+        weighted = "coquery_invisible_row_count" in df.columns
         if len(columns) == 0:
             # if the function is applied over no columns (e.g. because all
             # columns are hidden), the function returns a Series containing
             # simply the length of the data frame:
-            val = self.constant(df, len(df))
+            if weighted:
+                val = self.constant(
+                    df, int(df["coquery_invisible_row_count"].sum()))
+            else:
+                val = self.constant(df, len(df))
             return val
 
         # There is an ugly, ugly bug/feature in Pandas up to at least 0.18.0
@@ -840,11 +847,16 @@ class Freq(BaseFreq):
              for x in [y for y in df.columns.values
                        if y not in columns and
                        not y.startswith(("coquery_invisible"))]}
-        d[columns[0]] = "count"
+        if weighted:
+            count_column = "coquery_invisible_row_count"
+            d[count_column] = "sum"
+        else:
+            count_column = columns[0]
+            d[count_column] = "count"
 
         val = df.merge(df.groupby(columns)
                          .agg(d)
-                         .rename(columns={columns[0]: self.get_id()})
+                         .rename(columns={count_column: self.get_id()})
                          .reset_index(), on=columns, how="left")[self.get_id()]
         val.index = df.index
 
@@ -969,9 +981,9 @@ class ReferenceCorpusFrequency(BaseReferenceCorpus):
 
         # get the frequency from the reference corpus for the concatenated
         # columns:
-        val = _s.apply(lambda x: self._res.corpus.get_frequency(x, engine))
+        freqs = self._res.corpus.get_frequencies(_s.unique(), engine)
+        val = _s.map(freqs)
         val.index = df.index
-        engine.dispose()
         return val
 
 
@@ -1240,18 +1252,16 @@ class ConditionalProbability2(Proportion):
         left = df[self.columns[0]]
         engine = options.cfg.current_connection.get_engine(resource.db_name)
         try:
-            freq_full = span.apply(
-                lambda x: resource.corpus.get_frequency(x, engine))
-            freq_part = left.apply(
-                lambda x: resource.corpus.get_frequency(x, engine))
+            freq_full = span.map(
+                resource.corpus.get_frequencies(span.unique(), engine))
+            freq_part = left.map(
+                resource.corpus.get_frequencies(left.unique(), engine))
         except Exception as e:
             print(str(e))
             logging.error(str(e))
             val = self.constant(df, None)
         else:
             val = freq_full / freq_part
-        finally:
-            engine.dispose()
         return val
 
 
@@ -1348,7 +1358,6 @@ class SubcorpusSize(CorpusSize):
     def evaluate(self, df, **kwargs):
         try:
             session = get_toplevel_window().Session
-            manager = session.get_manager()
             fun = SubcorpusSize(session=session,
                                 columns=self.columns, group=self.group)
             if self.find_function(df, fun):
@@ -1363,12 +1372,12 @@ class SubcorpusSize(CorpusSize):
             column_list = [x for x in corpus_features
                            if "coq_{}_1".format(x) in self.columns]
             if df.iloc[0].coquery_invisible_dummy is not pd.np.nan:
-                val = df.apply(session.Corpus.get_subcorpus_size,
-                               columns=column_list,
-                               axis=1,
-                               subst=manager.get_column_substitutions)
+                # look up the sizes of all subcorpora at once:
+                val = session.Corpus.get_subcorpus_values(
+                    df, column_list, session.Corpus.SUBCORPUS_SIZE)
             else:
-                val = df.Series(name=self.get_id())
+                val = pd.Series([pd.np.nan] * len(df), index=df.index,
+                                name=self.get_id())
             return val
         except Exception as e:
             print(e)
@@ -1378,27 +1387,27 @@ class SubcorpusSize(CorpusSize):
 class SubcorpusRangeMin(CorpusSize):
     _name = "statistics_subcorpus_range_min"
 
-    def _func(self, row, session):
-        min_r, max_r = session.Corpus.get_subcorpus_range(row)
-        return min_r
+    def _get_value(self, session):
+        return session.Corpus.SUBCORPUS_MIN
 
     def evaluate(self, df, *args, **kwargs):
         session = get_toplevel_window().Session
 
         corpus_features = [x for x, _ in
                            session.Resource.get_corpus_features()]
-        column_list = [col for col in self.columns if col in
-                       ["coq_{}_1".format(y) for y in corpus_features]]
-        val = df.apply(lambda x: self._func(x[column_list], session), axis=1)
+        column_list = [x for x in corpus_features
+                       if "coq_{}_1".format(x) in self.columns]
+        # look up the ranges of all subcorpora at once:
+        val = session.Corpus.get_subcorpus_values(
+            df, column_list, self._get_value(session))
         return val
 
 
 class SubcorpusRangeMax(SubcorpusRangeMin):
     _name = "statistics_subcorpus_range_max"
 
-    def _func(self, row, session):
-        min_r, max_r = session.Corpus.get_subcorpus_range(row)
-        return max_r
+    def _get_value(self, session):
+        return session.Corpus.SUBCORPUS_MAX
 
 
 #############################################################################
@@ -1474,54 +1483,41 @@ class ContextColumns(Function):
                             self._sentence_column = sentence_col
 
                 get_toplevel_window().useContextConnection.emit(db_connection)
-                val = df.apply(lambda x: self._func(row=x,
-                                                    session=session,
-                                                    connection=db_connection),
-                               axis="columns")
+                if self._sentence_column:
+                    sentence_ids = df[self._sentence_column]
+                else:
+                    sentence_ids = None
+                contexts = resource.get_context_batch(
+                    df["coquery_invisible_corpus_id"],
+                    df["coquery_invisible_origin_id"],
+                    df["coquery_invisible_number_of_tokens"],
+                    db_connection,
+                    sentence_ids=sentence_ids,
+                    left=self.left, right=self.right)
                 get_toplevel_window().closeContextConnection.emit(
                     db_connection)
-                val.index = df.index
+                val = pd.DataFrame(
+                    [self._func(left, target, right)
+                     for left, target, right in contexts],
+                    columns=self.get_context_columns(),
+                    index=df.index)
                 return val
 
-    def _func(self, row, session, connection):
-        if self._sentence_column:
-            sentence_id = row[self._sentence_column]
-        else:
-            sentence_id = None
-
-        left, target, right = session.Resource.get_context(
-                                row["coquery_invisible_corpus_id"],
-                                row["coquery_invisible_origin_id"],
-                                row["coquery_invisible_number_of_tokens"],
-                                connection,
-                                left=self.left, right=self.right,
-                                sentence_id=sentence_id)
-
-        val = pd.Series(data=left + right,
-                        index=self.left_cols + self.right_cols)
-        return val
+    def get_context_columns(self):
+        return self.left_cols + self.right_cols
+
+    def _func(self, left, target, right):
+        return left + right
 
 
 class ContextKWIC(ContextColumns):
     _name = "coq_context_kwic"
 
-    def _func(self, row, session, connection):
-        if self._sentence_column:
-            sentence_id = row[self._sentence_column]
-        else:
-            sentence_id = None
-
-        left, target, right = session.Resource.get_context(
-                                row["coquery_invisible_corpus_id"],
-                                row["coquery_invisible_origin_id"],
-                                row["coquery_invisible_number_of_tokens"],
-                                connection,
-                                left=self.left, right=self.right,
-                                sentence_id=sentence_id)
-
-        val = pd.Series(data=[collapse_words(left), collapse_words(right)],
-                        index=["coq_context_left", "coq_context_right"])
-        return val
+    def get_context_columns(self):
+        return ["coq_context_left", "coq_context_right"]
+
+    def _func(self, left, target, right):
+        return [collapse_words(left), collapse_words(right)]
 
 
 class ContextString(ContextColumns):
@@ -1531,22 +1527,12 @@ class ContextString(ContextColumns):
     def __init__(self, *args):
         super(ContextString, self).__init__(*args)
 
-    def _func(self, row, session, connection):
-        if self._sentence_column:
-            sentence_id = row[self._sentence_column]
-        else:
-            sentence_id = None
-
-        left, target, right = session.Resource.get_context(
-                                row["coquery_invisible_corpus_id"],
-                                row["coquery_invisible_origin_id"],
-                                row["coquery_invisible_number_of_tokens"],
-                                connection,
-                                left=self.left, right=self.right,
-                                sentence_id=sentence_id)
+    def get_context_columns(self):
+        return [self._name]
 
+    def _func(self, left, target, right):
         words = left + [x.upper() for x in target if x] + right
-        return pd.Series(data=[collapse_words(words)], index=[self._name])
+        return [collapse_words(words)]
 
 
 ##############################################################################
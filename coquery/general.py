@@ -14,6 +14,7 @@ from __future__ import division
 from __future__ import print_function
 
 import math
+import re
 import hashlib
 import sys
 import os
@@ -261,6 +262,53 @@ def get_chunk(iterable, chunk_size=250000):
             itertools.islice(iterable, chunk_size - 1))
 
 
+def merge_ranges(ranges):
+    """
+    Merge overlapping or adjacent integer ranges.
+
+    Parameters
+    ----------
+    ranges : iterable
+        An iterable of tuples (start, end). Both boundaries are inclusive.
+
+    Returns
+    -------
+    l : list
+        A sorted list of tuples (start, end) that cover the same integers as
+        the input ranges, but which neither overlap nor touch each other.
+    """
+    l = []
+    for start, end in sorted(ranges):
+        if l and start <= l[-1][1] + 1:
+            l[-1] = (l[-1][0], max(l[-1][1], end))
+        else:
+            l.append((start, end))
+    return l
+
+
+def normalize_sql(S):
+    """
+    Collapse all whitespace in the SQL string that is not part of a quoted
+    string literal.
+
+    Parameters
+    ----------
+    S : str
+        An SQL string
+
+    Returns
+    -------
+    S : str
+        The SQL string with all runs of whitespace outside of string
+        literals replaced by a single space, and without leading or
+        trailing whitespace.
+    """
+    parts = re.split(r"('(?:[^'\\]|\\.|'')*')", S)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).strip()
+
+
 def get_directory_size(path):
     total_size = 0
     for dir_path, _, files in os.walk(path):
@@ -1917,10 +1917,6 @@ class CoqMainWindow(QtWidgets.QMainWindow):
             self.stop_progress_indicator()
             options.cfg.app.alert(self, 0)
         else:
-            try:
-                self.Session.db_engine.dispose()
-            except Exception as e:
-                print(e)
             self.Session = self.new_session
             del self.new_session
             self.user_columns = False
@@ -2728,6 +2724,8 @@ class CoqMainWindow(QtWidgets.QMainWindow):
             options.cfg.groups = self.ui.tree_groups.groups()
 
             self.save_configuration()
+            for connection in options.cfg.connections.values():
+                connection.dispose_engines()
             event.accept()
 
         if not self.last_results_saved and options.cfg.ask_on_quit:
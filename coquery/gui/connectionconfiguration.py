@@ -695,13 +695,12 @@ class ConnectionConfiguration(QtWidgets.QDialog):
                                   host=host, port=port,
                                   user=root_name, password=root_password)
             try:
-                engine = con.get_engine()
+                con.get_engine()
             except Exception as e:
+                con.dispose_engines()
                 QtWidgets.QMessageBox.critical(
                     self, "Access as root failed", msg_sql_root_fail)
                 return
-            finally:
-                engine.dispose()
 
             try:
                 con.create_user(name, password)
@@ -715,6 +714,8 @@ class ConnectionConfiguration(QtWidgets.QDialog):
                 QtWidgets.QMessageBox.information(
                     self,
                     "User created", msg_sql_new_user_success.format(name))
+            finally:
+                con.dispose_engines()
 
             self.ui.user.setText(name)
             self.ui.password.setText(password)
@@ -14,6 +14,7 @@ from __future__ import print_function
 
 import argparse
 import codecs
+import multiprocessing
 import re
 import os
 import sys
@@ -282,6 +283,12 @@ class MetaGui(QtWidgets.QDialog):
         namespace.use_meta = False
         namespace.lookup_ngram = False
         namespace.metadata = False
+        # leave one processor for the GUI and for the builder itself:
+        namespace.workers = max(1, multiprocessing.cpu_count() - 1)
+        # keep the database of an interrupted build, and continue after
+        # the last loaded file when the corpus is installed again:
+        namespace.resume = True
+        namespace.index_mode = "used"
 
         # FIXME: check if the following one-letter variables are still used
         # in CorpusBuilder.build().
@@ -1130,6 +1137,7 @@ class PackageGui(BuilderGui):
         namespace.lookup_ngram = False
         namespace.ngram_width = None
         namespace.metadata = None
+        namespace.resume = True
         if self.ngram_width is not None:
             namespace.lookup_ngram = True
             namespace.ngram_width = self.ngram_width
@@ -125,7 +125,6 @@ class UniqueViewer(QtWidgets.QDialog):
         else:
             S = "SELECT {} FROM {}".format(self.column, self.table)
             self.df = pd.read_sql(S, engine)
-        engine.dispose()
 
         items = (self.df[self.column].apply(utf8)
                                      .apply(QtWidgets.QTableWidgetItem))
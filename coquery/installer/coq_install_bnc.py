@@ -21,6 +21,8 @@ from coquery.corpusbuilder import (BaseCorpusBuilder,
 
 class BuilderClass(BaseCorpusBuilder):
     file_filter = "???.xml"
+    _parallel_load = True
+    _pattern_tables = True
 
     expected_files = (
         ['A00.xml', 'A01.xml', 'A02.xml', 'A03.xml', 'A04.xml', 'A05.xml',
@@ -14,9 +14,12 @@ from __future__ import unicode_literals
 import logging
 import itertools
 import collections
+import numpy as np
 import pandas as pd
 import re
 import scipy
+import scipy.special
+import scipy.stats
 
 from .defines import (QUERY_MODE_TYPES, QUERY_MODE_FREQUENCIES,
                       QUERY_MODE_CONTINGENCY, QUERY_MODE_COLLOCATIONS,
@@ -25,7 +28,7 @@ from .defines import (QUERY_MODE_TYPES, QUERY_MODE_FREQUENCIES,
                       CONTEXT_NONE, CONTEXT_COLUMNS, CONTEXT_KWIC,
                       CONTEXT_STRING,
                       QUERY_ITEM_WORD)
-from .functions import (Freq,
+from .functions import (Freq, FreqPMW, FreqPTW,
                         ContextColumns, ContextKWIC, ContextString,
                         MutualInformation, ConditionalProbability,
                         SubcorpusSize)
@@ -198,6 +201,37 @@ class Manager(CoqObject):
     def set_filters(self, filter_list):
         self._filters = filter_list
 
+    def accepts_aggregates(self, session):
+        """
+        Return True if the manager can process query results that were
+        already aggregated by the database, i.e. results that contain only
+        one row for each distinct combination of values, together with the
+        number of matches of that row in 'coquery_invisible_row_count'.
+        """
+        return False
+
+    def uses_distinct_rows(self, session):
+        """
+        Return True if the results of the manager only depend on the
+        distinct rows of the query results and their number of matches.
+
+        This is the case if all functions that are applied to the results
+        are frequency counts, and if no function, context, filter or group
+        requires the individual matches. Results that are displayed in the
+        GUI never qualify because they are kept in the data table, and may
+        be processed by other managers later.
+        """
+        if (options.cfg.gui or
+                options.cfg.context_mode != CONTEXT_NONE or
+                options.cfg.limit_matches):
+            return False
+        if (self._filters or self._groups or
+                session.column_functions.get_list() or
+                session.summary_group.filters):
+            return False
+        return all(fnc in (Freq, FreqPMW, FreqPTW)
+                   for fnc, _ in session.summary_group.functions)
+
     def set_groups(self, groups):
         self._groups = groups
 
@@ -771,6 +805,9 @@ class Manager(CoqObject):
 
 
 class Types(Manager):
+    def accepts_aggregates(self, session):
+        return self.uses_distinct_rows(session)
+
     def summarize(self, df, session):
         df = super(Types, self).summarize(df, session)
         return self.distinct(df, session)
@@ -779,6 +816,11 @@ class Types(Manager):
 class FrequencyList(Manager):
     name = "FREQUENCY"
 
+    def accepts_aggregates(self, session):
+        if type(self) != FrequencyList:
+            return False
+        return self.uses_distinct_rows(session)
+
     def summarize(self, df, session):
         vis_cols = get_visible_columns(df, manager=self, session=session)
         freq_function = Freq(columns=vis_cols)
@@ -1019,10 +1061,10 @@ class Collocations(Manager):
             collocates[["coq_collocate_frequency_left",
                         "coq_collocate_frequency_right"]].sum(axis=1))
         # calculate total frequency of collocate
+        freqs = session.Resource.corpus.get_label_frequencies(
+            collocates["coq_collocate_label"], session.db_engine)
         collocates["statistics_frequency"] = (
-            collocates["coq_collocate_label"].apply(
-                session.Resource.corpus.get_frequency,
-                engine=session.db_engine, literal=True))
+            collocates["coq_collocate_label"].map(freqs))
         # calculate conditional probabilities:
         func = ConditionalProbability()
         collocates["coq_conditional_probability"] = func.evaluate(
@@ -1078,28 +1120,101 @@ class ContrastMatrix(FrequencyList):
     _ll_cache = {}
     ignore_user_functions = True
 
+    # number of rows of the test matrix that are calculated at a time, see
+    # get_loglikelihood_matrix():
+    chunk_size = 500
+
     def matrix(self, df, session):
         df = df.reset_index(drop=True)
         labels = self.collapse_columns(df, session)
         df["coquery_invisible_row_id"] = labels
-        #df = df.sort_values(by="coquery_invisible_row_id")
 
-        self.p_values = pd.Series()
+        try:
+            freq = df[self._freq_function.get_id()].values
+            size = df[self._subcorpus_size.get_id()].values
+        except KeyError as e:
+            print(e)
+            self.p_values = pd.Series()
+            return df
 
-        for i, x in enumerate(labels):
-            columns = ["statistics_g_test_{}".format(x),
-                       "COQ_P_{}".format(x)]
+        g2, p_g2 = self.get_loglikelihood_matrix(freq, size,
+                                                 self.chunk_size)
 
-            try:
-                df[columns] = df.apply(
-                    self.retrieve_loglikelihood, axis=1, label=x, df=df)
-            except KeyError as e:
-                print(e)
-                return df
-            else:
-                self.p_values = self.p_values.append(df[columns[-1]][i:])
-        df = df[[col for col in df.columns if not col.startswith("COQ_P_")]]
-        return df
+        # Each comparison is counted once for the FDR correction, i.e. the
+        # p values are taken from the lower triangle of the matrix
+        # (including the diagonal):
+        rows, cols = np.tril_indices(len(df))
+        self.p_values = pd.Series(p_g2[rows, cols])
+
+        matrix = pd.DataFrame(
+            g2, index=df.index,
+            columns=["statistics_g_test_{}".format(x) for x in labels])
+        return pd.concat([df, matrix], axis=1)
+
+    @staticmethod
+    def get_loglikelihood_matrix(freq, size, chunk_size=None):
+        """
+        Calculate the G-test statistics for all pairs of rows.
+
+        For each pair of rows r and c, a G-test is performed on the 2x2
+        contingency table that contains the frequencies and the remaining
+        tokens of the two subcorpora. The test statistic is negative if the
+        relative frequency in row r is lower than in row c.
+
+        Parameters
+        ----------
+        freq : array
+            The frequencies of each row
+        size : array
+            The subcorpus sizes of each row
+        chunk_size : int
+            The number of rows that are calculated at a time. Smaller
+            values reduce the size of the temporary arrays for large
+            matrices. If None, all rows are calculated at once.
+
+        Returns
+        -------
+        tup : tuple
+            Two arrays of shape (n, n), the first containing the G-test
+            statistics, the second containing the p values. Comparisons
+            for which the test is undefined because an expected frequency is
+            zero have a statistic and a p value of 0.
+        """
+        freq = np.asarray(freq, dtype=float)
+        size = np.asarray(size, dtype=float)
+        n = len(freq)
+        chunk_size = chunk_size or max(n, 1)
+
+        g2 = np.zeros((n, n))
+        p_g2 = np.zeros((n, n))
+
+        f_c = freq[np.newaxis, :]
+        t_c = size[np.newaxis, :]
+        for start in range(0, n, chunk_size):
+            f_r = freq[start:start + chunk_size, np.newaxis]
+            t_r = size[start:start + chunk_size, np.newaxis]
+
+            # observed frequencies of the four cells:
+            observed = [f_r, f_c, t_r - f_r, t_c - f_c]
+
+            # marginal totals:
+            total = t_r + t_c
+            row_1 = f_r + f_c
+            row_2 = total - row_1
+            with np.errstate(divide="ignore", invalid="ignore"):
+                expected = [row_1 * t_r / total, row_1 * t_c / total,
+                            row_2 * t_r / total, row_2 * t_c / total]
+                valid = np.all([x > 0 for x in expected], axis=0)
+
+                g = 2 * sum(scipy.special.xlogy(obs, obs / exp)
+                            for obs, exp in zip(observed, expected))
+                g = np.where(valid, g, 0)
+                p = np.where(valid, scipy.stats.chi2.sf(g, 1), 0)
+                g = np.where(valid & (f_r / t_r < f_c / t_c), -g, g)
+
+            g2[start:start + chunk_size] = g
+            p_g2[start:start + chunk_size] = p
+        return g2, p_g2
 
     def summarize(self, df, session):
         """
@@ -1188,28 +1303,6 @@ class ContrastMatrix(FrequencyList):
                                  self._subcorpus_size.get_id())]
         return df.apply(fnc, cols=vis_cols, axis=1).unique()
 
-    def retrieve_loglikelihood(self, row, df, label):
-        freq = self._freq_function.get_id()
-        size = self._subcorpus_size.get_id()
-
-        freq_1 = row[freq]
-        total_1 = row[size]
-
-        freq_2 = df[df["coquery_invisible_row_id"] == label][freq].values[0]
-        total_2 = df[df["coquery_invisible_row_id"] == label][size].values[0]
-
-        obs = [[freq_1, freq_2], [total_1 - freq_1, total_2 - freq_2]]
-        try:
-            g2, p_g2, _, _ = scipy.stats.chi2_contingency(
-                obs, correction=False, lambda_="log-likelihood")
-            if (freq_1 / total_1) < (freq_2 / total_2):
-                val = pd.Series([-g2, p_g2])
-            else:
-                val = pd.Series([g2, p_g2])
-            return val
-        except ValueError:
-            return pd.Series([0, 0])
-
     def get_cell_content(self, index, df, session):
         """
         Return that content for the indexed cell that is needed to handle
@@ -43,13 +43,15 @@ from .errors import (
 from .defines import (
     DEFAULT_CONFIGURATION,
     SQL_SQLITE, SQL_MYSQL,
-    DEFAULT_MISSING_VALUE,
+    DEFAULT_MISSING_VALUE, DEFAULT_LEXICON_ID_LIMIT,
     QUERY_MODES, QUERY_MODE_TOKENS,
     CONTEXT_NONE, CONTEXT_COLUMNS, CONTEXT_KWIC, CONTEXT_STRING)
 from .unicode import utf8
 from .links import parse_link_text
 from .filters import parse_filter_text
-from .connections import get_connection, SQLiteConnection
+from .connections import (get_connection, SQLiteConnection,
+                          POOL_SIZE, POOL_MAX_OVERFLOW, POOL_RECYCLE,
+                          QUERY_WORKERS)
 
 # make ast work in all Python versions:
 if not hasattr(ast, "TryExcept"):
@@ -284,6 +286,11 @@ class Options(object):
                                              self.config_name)
         connection = SQLiteConnection(DEFAULT_CONFIGURATION)
         self.args.connections = dict(Default=connection)
+        self.args.pool_size = POOL_SIZE
+        self.args.pool_max_overflow = POOL_MAX_OVERFLOW
+        self.args.pool_recycle = POOL_RECYCLE
+        self.args.query_workers = QUERY_WORKERS
+        self.args.lexicon_id_limit = DEFAULT_LEXICON_ID_LIMIT
 
         self.args.reference_corpus = {}
         self.args.main_window = None
@@ -383,6 +390,7 @@ class Options(object):
         group.add_argument("-C", "--output_case", help="be case-sensitive in the output (default: ignore case)", action="store_true", dest="output_case_sensitive")
         group.add_argument("--query_case", help="be case-sensitive when querying (default: ignore case)", action="store_true", dest="query_case_sensitive")
         group.add_argument("-r", "--regexp", help="use regular expressions", action="store_true", dest="regexp")
+        group.add_argument("--workers", help="execute up to N queries concurrently (default: {})".format(QUERY_WORKERS), type=int, dest="query_workers", metavar="N")
 
         # Output options:
         group = self.parser.add_argument_group("Output options")
@@ -497,6 +505,7 @@ class Options(object):
             "query_mode": QUERY_MODE_TOKENS,
             "query_string": "",
             "query_cache_size": 500 * 1024 * 1024,
+            "query_cache_memory_size": 100 * 1024 * 1024,
             "use_cache": use_cachetools,
             "query_case_sensitive": False,
             "output_case_sensitive": False,
@@ -524,6 +533,11 @@ class Options(object):
             "show_log_messages": "ERROR,WARNING,INFO",
             "decimal_digits": 3,
             "drop_on_na": False,
+            "pool_size": POOL_SIZE,
+            "pool_max_overflow": POOL_MAX_OVERFLOW,
+            "pool_recycle": POOL_RECYCLE,
+            "query_workers": QUERY_WORKERS,
+            "lexicon_id_limit": DEFAULT_LEXICON_ID_LIMIT,
             }
 
         import inspect
@@ -583,6 +597,23 @@ class Options(object):
             connection = get_connection(**connection_dict[i])
             self.args.connections[connection.name] = connection
 
+        # read the settings of the connection pools:
+        self.args.pool_size = config_file.int(
+            "sql", "pool_size", d=defaults)
+        self.args.pool_max_overflow = config_file.int(
+            "sql", "pool_max_overflow", d=defaults)
+        self.args.pool_recycle = config_file.int(
+            "sql", "pool_recycle", d=defaults)
+        self.args.query_workers = config_file.int(
+            "sql", "query_workers", d=defaults)
+        self.args.lexicon_id_limit = config_file.int(
+            "sql", "lexicon_id_limit", d=defaults)
+        for connection in self.args.connections.values():
+            connection.set_pool_options(
+                pool_size=self.args.pool_size,
+                max_overflow=self.args.pool_max_overflow,
+                pool_recycle=self.args.pool_recycle)
+
         # select active SQL configuration, or use Default as fallback
         connection_name = DEFAULT_CONFIGURATION
         try:
@@ -611,6 +642,7 @@ class Options(object):
                 self.args.query_list = []
                 pass
             self.args.query_cache_size = config_file.int("main", "query_cache_size", d=defaults)
+            self.args.query_cache_memory_size = config_file.int("main", "query_cache_memory_size", d=defaults)
             self.args.query_case_sensitive = config_file.bool("main", "query_case_sensitive", d=defaults)
             self.args.output_case_sensitive = config_file.bool("main", "output_case_sensitive", d=defaults)
             self.args.regexp = config_file.bool("main", "regexp", d=defaults)
@@ -949,6 +981,7 @@ def save_configuration():
     if cfg.xkcd is not None:
         config.set("main", "xkcd", cfg.xkcd)
     config.set("main", "query_cache_size", cfg.query_cache_size)
+    config.set("main", "query_cache_memory_size", cfg.query_cache_memory_size)
     config.set("main", "use_cache", bool(cfg.use_cache))
 
     if cfg.custom_installer_path:
@@ -959,6 +992,11 @@ def save_configuration():
         config.add_section("sql")
 
     config.set("sql", "active_configuration", connection_name)
+    config.set("sql", "pool_size", cfg.pool_size)
+    config.set("sql", "pool_max_overflow", cfg.pool_max_overflow)
+    config.set("sql", "pool_recycle", cfg.pool_recycle)
+    config.set("sql", "query_workers", cfg.query_workers)
+    config.set("sql", "lexicon_id_limit", cfg.lexicon_id_limit)
 
     for i, name in enumerate(cfg.connections):
         connection = cfg.connections[name]
@@ -1193,6 +1231,9 @@ def set_current_server(name):
         The name of the MySQL configuration
     """
     global cfg
+    previous = getattr(cfg, "current_connection", None)
+    if previous is not None and previous.name != name:
+        previous.dispose_engines()
     cfg.current_connection = cfg.connections.get(name, None)
     cfg.current_connection.find_resources()
 
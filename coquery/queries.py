@@ -15,6 +15,7 @@ from __future__ import print_function
 import hashlib
 import logging
 import os
+from multiprocessing.pool import ThreadPool
 
 import pandas as pd
 
@@ -26,6 +27,149 @@ from . import tokens
 from . import options
 from . import managers
 from coquery.unicode import utf8
+from coquery.general import normalize_sql
+
+# number of rows that are fetched from the database at a time:
+FETCH_CHUNK_SIZE = 50000
+
+
+def attach_databases(connection, db_names):
+    """
+    Attach the SQLite databases to the connection.
+
+    Databases that are already attached to the connection, e.g. because a
+    pooled connection is reused, are not attached again.
+    """
+    if not db_names:
+        return
+    attached = {row[1] for row
+                in connection.execute("PRAGMA database_list").fetchall()}
+    for db_name in db_names:
+        if db_name in attached:
+            continue
+        path = os.path.join(options.cfg.database_path,
+                            "{}.db".format(db_name))
+        S = "ATTACH DATABASE '{}' AS {}".format(path, db_name)
+        try:
+            connection.execute(S)
+        except Exception:
+            error = "Exception raised when executing {}".format(S)
+            logging.warning(error)
+
+
+def fetch_chunks(results, columns, chunk_size):
+    """
+    Yield the rows from a result proxy as data frames.
+
+    Parameters
+    ----------
+    results : ResultProxy
+        The result of an executed query
+    columns : list
+        The column names of the result
+    chunk_size : int
+        The maximum number of rows in a data frame
+
+    Yields
+    ------
+    df : DataFrame
+        A data frame with up to chunk_size rows. If the result does not
+        contain any row, a single empty data frame is yielded.
+    """
+    empty = True
+    while True:
+        rows = results.fetchmany(chunk_size)
+        if not rows:
+            break
+        empty = False
+        yield pd.DataFrame.from_records(rows, columns=columns)
+    if empty:
+        yield pd.DataFrame(columns=columns)
+
+
+def execute_query(connection, query_string, attach_list, chunk_size):
+    """
+    Execute the query string, and yield the results in chunks.
+
+    The first item that is yielded is the list of column names of the
+    result, followed by the data frames produced by fetch_chunks().
+    """
+    attach_databases(connection, attach_list)
+    try:
+        results = (connection
+                   .execution_options(stream_results=True)
+                   .execute(query_string.replace("%", "%%")))
+    except Exception as e:
+        print(query_string)
+        print(e)
+        raise e
+
+    columns = results.keys()
+    yield columns
+    try:
+        for df in fetch_chunks(results, columns, chunk_size):
+            yield df
+    finally:
+        results.close()
+
+
+class QueryExecutor(object):
+    """
+    A pool of worker threads that execute query strings concurrently.
+
+    Each worker uses a connection of its own from the connection pool of
+    the engine. The results of a query string are fetched completely by
+    the worker, so that the connection can be returned to the pool
+    immediately.
+    """
+    def __init__(self, engine, workers, chunk_size=None):
+        """
+        Parameters
+        ----------
+        engine : sqlalchemy.engine.Engine
+            The engine that provides the connections
+        workers : int
+            The number of worker threads
+        chunk_size : int
+            The maximum number of rows in a chunk. If None, the value of
+            FETCH_CHUNK_SIZE is used.
+        """
+        self.workers = workers
+        self._engine = engine
+        self._chunk_size = chunk_size or FETCH_CHUNK_SIZE
+        self._pool = ThreadPool(workers)
+
+    def submit(self, query_string, attach_list=None):
+        """
+        Submit the query string to the workers.
+
+        Returns
+        -------
+        result : AsyncResult
+            The pending result. Its get() method returns a tuple containing
+            the column names and the list of data frames with the rows, or
+            raises the exception that occurred when executing the query.
+        """
+        return self._pool.apply_async(self._execute,
+                                      (query_string, attach_list or []))
+
+    def _execute(self, query_string, attach_list):
+        connection = self._engine.connect()
+        try:
+            chunks = execute_query(connection, query_string, attach_list,
+                                   self._chunk_size)
+            columns = next(chunks)
+            return columns, list(chunks)
+        finally:
+            connection.close()
+
+    def shutdown(self):
+        """
+        Stop the workers. Queries that have not been started yet are
+        discarded.
+        """
+        self._pool.terminate()
+        self._pool.join()
 
 
 class TokenQuery(object):
@@ -49,8 +193,63 @@ class TokenQuery(object):
         self.results_frame = pd.DataFrame()
         self._keys = []
         self.empty_query = False
+        self._jobs = None
 
-    def run(self, connection=None, to_file=False, **kwargs):
+    def get_database_version(self):
+        """
+        Return the version of the database of the current resource, or None
+        if the version cannot be determined.
+        """
+        try:
+            return options.cfg.current_connection.get_database_version(
+                self.Resource.db_name)
+        except Exception as e:
+            logging.warning(
+                "Cannot determine database version: {}".format(e))
+            return None
+
+    def get_cache_key(self, query_string, manager_hash, db_version=None):
+        """
+        Return the key that is used to store the results of the current
+        sub query in the query cache.
+
+        The key contains the resource, the version of the database, the
+        query items, the selected features, and the query options. The SQL
+        string is included as a hash after its whitespace is normalized,
+        so queries that differ only in their formatting share a key.
+
+        Parameters
+        ----------
+        query_string : str
+            The SQL string for the current sub query
+        manager_hash : str
+            The hash of the current data manager
+        db_version :
+            The version of the database, see get_database_version()
+
+        Returns
+        -------
+        key : tuple
+            The cache key
+        """
+        sql_hash = hashlib.md5(
+            normalize_sql(query_string).encode("utf-8")).hexdigest()
+        if options.cfg.limit_matches:
+            limit = options.cfg.number_of_tokens
+        else:
+            limit = None
+        return (self.Resource.name,
+                options.cfg.current_connection.name,
+                db_version,
+                tuple(self._sub_query),
+                tuple(sorted(options.cfg.selected_features)),
+                bool(options.cfg.query_case_sensitive),
+                bool(options.cfg.regexp),
+                limit,
+                manager_hash,
+                sql_hash)
+
+    def run(self, connection=None, to_file=False, executor=None, **kwargs):
         """
         Run the query, and store the results in an internal data frame.
 
@@ -65,153 +264,260 @@ class TokenQuery(object):
             False if they will be displayed in the GUI. Data that is written
             directly to a file contains less information, e.g. it doesn't
             contain an origin ID or a corpus ID (unless requested).
+        executor : QueryExecutor
+            If given, the subqueries are executed concurrently by the
+            workers of the executor.
+        """
+        frames = [df for df
+                  in self.iter_results(connection, to_file, executor=executor)
+                  if len(df) > 0]
+
+        if frames:
+            # concatenate the chunks only once so that the rows are not
+            # copied again for each subquery. Columns that only contained
+            # NULL values in some of the chunks are converted back to the
+            # type of the other chunks:
+            self.results_frame = pd.concat(frames, ignore_index=True)
+            if len(frames) > 1:
+                self.results_frame = self.results_frame.infer_objects()
+        else:
+            self.results_frame = pd.DataFrame()
+        return self.results_frame
+
+    def get_subqueries(self, to_file=False, manager=None):
+        """
+        Return the SQL strings that are executed for the query.
+
+        Parameters
+        ----------
+        to_file : bool
+            See run().
+        manager : Manager
+            The data manager for the query. If None, the manager for the
+            current query mode is used.
+
+        Returns
+        -------
+        subqueries : list
+            A list of tuples. Each tuple contains the query items that are
+            used for the token bookkeeping of the results, and the SQL
+            string. The subqueries of a quantified query are combined into
+            a single SQL string if possible.
+        """
+        if manager is None:
+            manager = managers.get_manager(options.cfg.MODE,
+                                           self.Resource.name)
+
+        tokens.QueryToken.set_pos_check_function(
+            self.Resource.pos_check_function)
+
+        query_string = None
+        if manager.accepts_aggregates(self.Session):
+            # The database only returns the distinct rows and their number
+            # of matches if the manager does not need the individual
+            # matches. This is not possible if duplicate matches from the
+            # subqueries of a quantified query have to be removed.
+            if (len(self.query_list) == 1 or
+                    not options.cfg.drop_duplicates):
+                query_string = self.Resource.get_aggregated_query_string(
+                    self.query_list,
+                    selected=options.cfg.selected_features,
+                    to_file=to_file)
+        # The subqueries of a quantified query are combined into a single
+        # SQL query if possible. The last subquery is used for the token
+        # bookkeeping of the combined query.
+        if not query_string and len(self.query_list) > 1:
+            query_string = self.Resource.get_quantified_query_string(
+                self.query_list,
+                selected=options.cfg.selected_features,
+                to_file=to_file)
+        if query_string:
+            subqueries = [(self.query_list[-1], query_string)]
+        else:
+            subqueries = [
+                (sub_query,
+                 self.Resource.get_query_string(
+                     query_items=sub_query,
+                     selected=options.cfg.selected_features,
+                     to_file=to_file))
+                for sub_query in self.query_list]
+        return subqueries
+
+    def prepare(self, to_file=False, executor=None):
+        """
+        Prepare the subqueries of the query.
+
+        For each subquery, the query string is created and looked up in the
+        query cache. If an executor is given, the subqueries that are not
+        cached are submitted to its workers, so that they are executed while
+        the results of earlier queries are still processed.
+
+        Parameters
+        ----------
+        to_file : bool
+            See run().
+        executor : QueryExecutor
+            The executor that runs the subqueries, or None if the
+            subqueries are executed on the connection passed to
+            iter_results().
         """
         manager = managers.get_manager(options.cfg.MODE, self.Resource.name)
         manager_hash = manager.get_hash()
+        if options.cfg.use_cache:
+            db_version = self.get_database_version()
 
-        self.results_frame = pd.DataFrame()
+        TokenQuery._id += 1
+        self._query_id = TokenQuery._id
 
         self._max_number_of_tokens = 0
         for x in self.query_list:
             self._max_number_of_tokens = max(self._max_number_of_tokens,
                                              len(x))
 
-        tokens.QueryToken.set_pos_check_function(
-            self.Resource.pos_check_function)
+        if options.cfg.current_connection.db_type() == SQL_SQLITE:
+            attach_list = self.Resource.get_attach_list(
+                options.cfg.selected_features)
+        else:
+            attach_list = []
+
+        subqueries = self.get_subqueries(to_file, manager)
+
+        self._jobs = []
+        for self._sub_query, query_string in subqueries:
+
+            cache_key = None
+            result = None
+            if options.cfg.use_cache and query_string:
+                cache_key = self.get_cache_key(query_string, manager_hash,
+                                               db_version)
+                try:
+                    result = options.cfg.query_cache.get(cache_key)
+                except KeyError:
+                    pass
+
+            if result is None and query_string and executor:
+                result = executor.submit(query_string, attach_list)
+
+            self._jobs.append((self._sub_query, query_string, cache_key,
+                               attach_list, result))
+
+    def iter_results(self, connection=None, to_file=False,
+                     add_to_cache=True, chunk_size=None, executor=None):
+        """
+        Run the subqueries of the query, and yield the results in chunks.
 
-        for i, self._sub_query in enumerate(self.query_list):
+        The rows of each subquery are fetched from the database in chunks
+        of a limited size, so that the complete result set is never held in
+        memory as a list of rows. If the query cache is used, a cached
+        result is yielded as a single chunk.
+
+        The chunks are always yielded in the order of the subqueries, even
+        if the subqueries are executed concurrently.
+
+        Parameters
+        ----------
+        to_file : bool
+            See run().
+        add_to_cache : bool
+            True if the results of subqueries that are not cached yet are
+            added to the query cache. The chunks of a subquery have to be
+            kept in memory until the subquery is completed if this is True.
+        chunk_size : int
+            The maximum number of rows in a chunk. If None, the value of
+            FETCH_CHUNK_SIZE is used.
+        executor : QueryExecutor
+            See prepare(). The executor is ignored if the query has
+            already been prepared.
+
+        Yields
+        ------
+        df : DataFrame
+            A data frame containing a chunk of the query results. A
+            subquery that does not return any row yields an empty data
+            frame.
+        """
+        chunk_size = chunk_size or FETCH_CHUNK_SIZE
+        if self._jobs is None:
+            self.prepare(to_file, executor)
+        jobs, self._jobs = self._jobs, None
+
+        for i, job in enumerate(jobs):
+            self._sub_query, query_string, cache_key, attach_list, result = job
             l = [utf8(x) for _, x in self._sub_query if x]
             self._current_number_of_tokens = len(l)
             self._current_subquery_string = " ".join(l)
 
-            if len(self.query_list) > 1:
+            if len(jobs) > 1:
                 s = "Subquery #{} of {}: {}".format(
                             i+1,
-                            len(self.query_list),
+                            len(jobs),
                             self._current_subquery_string)
                 logging.info(s)
 
-            query_string = self.Resource.get_query_string(
-                query_items=self._sub_query,
-                selected=options.cfg.selected_features,
-                to_file=to_file)
+            if isinstance(result, pd.DataFrame):
+                yield self.process_chunk(result.copy())
+                continue
 
-            df = None
-            if options.cfg.use_cache and query_string:
-                try:
-                    md5 = hashlib.md5("".join(sorted(query_string)).encode()).hexdigest()
-                    df = options.cfg.query_cache.get((self.Resource.name,
-                                                      manager_hash, md5))
-                except KeyError:
-                    md5 = ""
+            if not query_string:
+                yield self.process_chunk(pd.DataFrame())
+                continue
+
+            if options.cfg.verbose:
+                logging.info(query_string)
 
-            if df is None:
-                if not query_string:
-                    df = pd.DataFrame()
+            if result is None:
+                chunks = execute_query(connection, query_string, attach_list,
+                                       chunk_size)
+                columns = next(chunks)
+            else:
+                columns, chunks = result.get()
+
+            store = (options.cfg.use_cache and add_to_cache and
+                     cache_key is not None)
+            cached_chunks = []
+            for df in chunks:
+                if store:
+                    cached_chunks.append(df)
+                    df = df.copy()
+                yield self.process_chunk(df)
+
+            if store:
+                if cached_chunks:
+                    df = (pd.concat(cached_chunks, ignore_index=True)
+                            .infer_objects())
                 else:
-                    if options.cfg.verbose:
-                        logging.info(query_string)
-
-                    # SQLite: attach external databases
-                    if options.cfg.current_connection.db_type() == SQL_SQLITE:
-                        attach_list = self.Resource.get_attach_list(
-                            options.cfg.selected_features)
-                        for db_name in attach_list:
-                            path = os.path.join(options.cfg.database_path,
-                                                "{}.db".format(db_name))
-                            S = "ATTACH DATABASE '{}' AS {}".format(
-                                path, db_name)
-                            try:
-                                connection.execute(S)
-                            except Exception:
-                                error = ("Exception raised when executing "
-                                         "{}").format(S)
-                                logging.warning(error)
+                    df = pd.DataFrame(columns=columns)
+                options.cfg.query_cache.add(cache_key, df)
 
+    def process_chunk(self, df):
+        """
+        Apply the output settings to a chunk of query results from the
+        current subquery.
+        """
+        if not options.cfg.output_case_sensitive and len(df.index) > 0:
+            word_column = getattr(self.Resource, QUERY_ITEM_WORD, None)
+            lemma_column = getattr(self.Resource, QUERY_ITEM_LEMMA, None)
+            for x in df.columns:
+                if ((word_column and word_column in x) or
+                        (lemma_column and lemma_column in x)):
                     try:
-                        results = (connection
-                                   .execution_options(stream_results=True)
-                                   .execute(query_string.replace("%", "%%")))
-                    except Exception as e:
-                        print(query_string)
-                        print(e)
-                        raise e
-
-                    df = pd.DataFrame(list(iter(results)),
-                                      columns=results.keys())
-
-                    if len(df) == 0:
-                        df = pd.DataFrame(columns=results.keys())
-
-                    del results
-
-                    if options.cfg.use_cache:
-                        options.cfg.query_cache.add(
-                            (self.Resource.name, manager_hash, md5),
-                            df)
-
-            if not options.cfg.output_case_sensitive and len(df.index) > 0:
-                word_column = getattr(self.Resource, QUERY_ITEM_WORD, None)
-                lemma_column = getattr(self.Resource, QUERY_ITEM_LEMMA, None)
-                for x in df.columns:
-                    if ((word_column and word_column in x) or
-                            (lemma_column and lemma_column in x)):
-                        try:
-                            if options.cfg.output_to_lower:
-                                fnc = str.lower
-                            else:
-                                fnc = str.upper
-
-                            df[x] = list(map(lambda s: fnc(s) if s else s,
-                                             df[x]))
-
-                        except AttributeError:
-                            pass
-
-            df["coquery_invisible_number_of_tokens"] = self._current_number_of_tokens
-
-            if len(df) > 0:
-                if self.results_frame.empty:
-                    self.results_frame = df
-                else:
-                    # apply clumsy hack that tries to make sure that the dtypes of
-                    # data frames containing NaNs or empty strings does not change
-                    # when appending the new data frame to the previous.
-
-                    if df.dtypes.tolist() != self.results_frame.dtypes.tolist():
-                        print("DIFFERENT DTYPES!")
-
-                    ## The same hack is also needed in session.run_queries().
-                    #if len(self.results_frame) > 0 and df.dtypes.tolist() != dtype_list.tolist():
-                        #for x in df.columns:
-                            ## the idea is that pandas/numpy use the 'object'
-                            ## dtype as a fall-back option for strange results,
-                            ## including those with NaNs.
-                            ## One problem is that integer columns become floats
-                            ## in the process. This is so because Pandas does not
-                            ## have an integer NA type:
-                            ## http://pandas.pydata.org/pandas-docs/stable/gotchas.html#support-for-integer-na
-
-                            #if df.dtypes[x] != dtype_list[x]:
-                                #_working = None
-                                #if df.dtypes[x] == object:
-                                    #if not df[x].any():
-                                        #df[x] = [np.nan] * len(df)
-                                        #dtype_list[x] = self.results_frame[x].dtype
-                                #elif dtype_list[x] == object:
-                                    #if not self.results_frame[x].any():
-                                        #self.results_frame[x] = [np.nan] * len(self.results_frame)
-                                        #dtype_list[x] = df[x].dtype
-                    #else:
-                        #dtype_list = df.dtypes
-                    #print(dtype_list)
-
-                    self.results_frame = self.results_frame.append(df)
-
-        self.results_frame = self.results_frame.reset_index(drop=True)
-        TokenQuery._id += 1
-        self._query_id = TokenQuery._id
-        return self.results_frame
+                        if options.cfg.output_to_lower:
+                            fnc = str.lower
+                        else:
+                            fnc = str.upper
+
+                        df[x] = list(map(lambda s: fnc(s) if s else s,
+                                         df[x]))
+
+                    except AttributeError:
+                        pass
+
+        # the combined query of a quantified query already contains the
+        # number of tokens of each row:
+        if "coquery_invisible_number_of_tokens" not in df.columns:
+            df["coquery_invisible_number_of_tokens"] = (
+                self._current_number_of_tokens)
+        return df
 
     def get_max_tokens(self):
         """
@@ -355,6 +661,33 @@ class StatisticsQuery(TokenQuery):
         return df
 
     def run(self, connection=None, to_file=False, **kwargs):
-        self.results_frame = self.Session.Resource.get_statistics(connection, **kwargs)
+        # The statistics are cached until the database is modified:
+        cache_key = None
+        if options.cfg.use_cache:
+            db_version = self.get_database_version()
+            if db_version is not None:
+                cache_key = (self.Resource.name, "statistics", db_version)
+                try:
+                    self.results_frame = options.cfg.query_cache.get(
+                        cache_key)
+                    return self.results_frame
+                except KeyError:
+                    pass
+
+        executor = None
+        workers = options.cfg.query_workers
+        if workers and workers > 1:
+            engine = options.cfg.current_connection.get_engine(
+                self.Resource.db_name, read_only=True)
+            executor = QueryExecutor(engine, workers)
+        try:
+            self.results_frame = self.Session.Resource.get_statistics(
+                connection, executor=executor, **kwargs)
+        finally:
+            if executor:
+                executor.shutdown()
+
+        if cache_key is not None:
+            options.cfg.query_cache.add(cache_key, self.results_frame)
         return self.results_frame
 
@@ -27,9 +27,9 @@ from . import options
 from .errors import (
     TokenParseError, IllegalArgumentError, SQLNoConnectorError,
     EmptyInputFileError, CorpusUnavailableQueryTypeError)
-from .defines import SQL_SQLITE, COLUMN_NAMES, QUERY_MODE_STATISTICS
+from .defines import COLUMN_NAMES, QUERY_MODE_STATISTICS
 from .general import Print
-from coquery.queries import StatisticsQuery, TokenQuery
+from coquery.queries import StatisticsQuery, TokenQuery, QueryExecutor
 from . import managers
 from . import functionlist
 
@@ -122,6 +122,8 @@ class Session(object):
         else:
             if append and not self._first_saved_dataframe:
                 file_mode = "a"
+            elif not options.cfg.gui and options.cfg.append:
+                file_mode = "a"
             else:
                 file_mode = "w"
                 if options.cfg.verbose:
@@ -141,31 +143,131 @@ class Session(object):
         else:
             header = False
 
-        df[columns].to_csv(
-            output_file,
-            header=header,
-            sep=options.cfg.output_separator,
-            encoding="utf-8",
-            float_format="%.{}f".format(options.cfg.digits),
-            index=False)
-        output_file.flush()
+        try:
+            df[columns].to_csv(
+                output_file,
+                header=header,
+                sep=options.cfg.output_separator,
+                encoding="utf-8",
+                float_format="%.{}f".format(options.cfg.digits),
+                index=False)
+            output_file.flush()
+        finally:
+            if output_file is not sys.stdout:
+                output_file.close()
         self._first_saved_dataframe = False
 
-    def connect_to_db(self):
-        def _sqlite_regexp(expr, item):
-            """
-            Function which adds regular expressions to SQLite
-            """
-            if options.cfg.query_case_sensitive:
-                match = re.search(expr, item)
-            else:
-                match = re.search(expr, item, re.IGNORECASE)
-            return match is not None
+    def is_streamable(self, manager):
+        """
+        Return True if the query results can be written to the output
+        chunk by chunk.
+
+        Streaming is only possible if processing the results does not
+        depend on other rows than the current one, i.e. if the results are
+        neither summarized, grouped, sampled nor affected by column
+        functions, and if there are no duplicates across the subqueries of
+        a query that would have to be removed.
+        """
+        if self.is_statistics_session() or type(manager) != managers.Manager:
+            return False
+        if (manager._groups or
+                options.cfg.sample_matches or
+                self.summary_group.get_functions() or
+                self.column_functions.get_list()):
+            return False
+        if options.cfg.drop_duplicates:
+            return all(len(query.query_list) <= 1
+                       for query in self.query_list)
+        return True
+
+    def stream_query(self, query, manager, to_file=False):
+        """
+        Run the query, and write the results to the output as they are
+        fetched from the database.
+
+        Returns
+        -------
+        tup : tuple
+            A tuple containing the number of matches and the number of
+            output rows.
+        """
+        raw_length = 0
+        output_length = 0
+        for df in query.iter_results(self.db_connection, to_file=to_file,
+                                     add_to_cache=False):
+            if len(df) == 0:
+                continue
+            raw_length += len(df)
+            output_length += self.save_chunk(query, manager, df)
+
+        if raw_length == 0:
+            # write the dummy row that is used for empty queries:
+            output_length += self.save_chunk(query, manager, pd.DataFrame())
+        return raw_length, output_length
+
+    def save_chunk(self, query, manager, df):
+        """
+        Process a chunk of query results, and write it to the output.
+
+        Returns
+        -------
+        n : int
+            The number of output rows
+        """
+        df = query.insert_static_data(df)
+        df = df[self.set_preferred_order(list(df.columns))]
+        df = self.encode_strings(df)
+        # the cached context columns belong to the previous chunk:
+        manager.reset_context_cache()
+        df = manager.process(df, session=self)
+        self.save_dataframe(df, append=True)
+        return len(df)
+
+    @staticmethod
+    def encode_strings(df):
+        """
+        Return the data frame with all string columns encoded as UTF-8 if
+        Coquery is run under Python 2.
+        """
+        if sys.version_info < (3, 0):
+            for col in df.columns:
+                if df.dtypes[col] == object:
+                    try:
+                        df[col] = df[col].str.encode("utf-8")
+                    except Exception as e:
+                        print(e)
+                        logging.warning(e)
+        return df
+
+    def get_executor(self, queries, to_file=False):
+        """
+        Return an executor that runs the subqueries of the queries
+        concurrently, or None if they are executed one after the other on
+        the session connection.
+
+        Concurrent execution is only used if there is more than one
+        subquery, so that the results of a single query can still be
+        fetched from the database in chunks. The workers fetch the complete
+        results of their subqueries, so no executor should be used if the
+        results are streamed to the output.
+
+        The subqueries of a quantified query that are combined into a
+        single SQL query count as one subquery.
+        """
+        workers = options.cfg.query_workers
+        if self.is_statistics_session() or not workers or workers < 2:
+            return None
+        if sum(len(query.get_subqueries(to_file))
+               for query in queries) < 2:
+            return None
+        engine = options.cfg.current_connection.get_engine(
+            self.Resource.db_name, read_only=True)
+        return QueryExecutor(engine, workers)
 
+    def connect_to_db(self):
+        # The engine is shared by the connection, and SQLite connections
+        # already provide the REGEXP function, see connections.py:
         self.db_connection = self.db_engine.connect()
-        if options.cfg.current_connection.db_type() == SQL_SQLITE:
-            self.db_connection.connection.create_function("REGEXP", 2,
-                                                          _sqlite_regexp)
 
     def prepare_queries(self):
         self.query_list = []
@@ -209,20 +311,52 @@ class Session(object):
         manager.set_groups(self.groups)
         manager.set_column_order(options.cfg.column_order)
 
+        # Results that are written to a file (or to the standard output if
+        # Coquery is run as a console program) are streamed to the output
+        # unless the processing of the results requires the complete
+        # data table:
+        stream = ((to_file or not options.cfg.gui) and
+                  self.is_streamable(manager))
+        if stream and not options.cfg.gui:
+            manager.set_column_substitutions(
+                self.get_column_substitutions())
+        self.to_file = to_file
+
         dtype_list = []
+        data_frames = []
         self.queries = {}
         _queried = []
 
+        run_list = []
+        for i, current_query in enumerate(self.query_list):
+            if current_query.query_string in _queried and not to_file:
+                warnings.warn(
+                    "Duplicate query string detected: {}".format(
+                        current_query.query_string))
+                continue
+            _queried.append(current_query.query_string)
+            run_list.append((i, current_query))
+
+        # The workers fetch the complete results of their subqueries, so
+        # streamed results are always fetched on the session connection:
+        if stream:
+            executor = None
+        else:
+            executor = self.get_executor([query for _, query in run_list],
+                                         to_file)
+
         try:
-            for i, current_query in enumerate(self.query_list):
-                if current_query.query_string in _queried and not to_file:
-                    warnings.warn(
-                        "Duplicate query string detected: {}".format(
-                            current_query.query_string))
-                    continue
-                _queried.append(current_query.query_string)
+            for n, (i, current_query) in enumerate(run_list):
                 self.queries[i] = current_query
 
+                if executor:
+                    # submit the subqueries of the next queries so that the
+                    # workers are busy while the results of the current
+                    # query are processed:
+                    for _, next_query in run_list[n:n + executor.workers]:
+                        if next_query._jobs is None:
+                            next_query.prepare(to_file, executor)
+
                 if options.cfg.gui and number_of_queries > 1:
                     options.cfg.main_window.updateMultiProgress.emit(i+1)
                 if not self.quantified_number_labels:
@@ -237,16 +371,23 @@ class Session(object):
                 else:
                     logging.info("Start query: '{}'".format(
                         current_query.query_string))
+                if stream:
+                    raw_length, output_length = self.stream_query(
+                        current_query, manager, to_file)
+                    self.log_query_time(start_time, raw_length,
+                                        output_length)
+                    continue
+
                 df = current_query.run(connection=self.db_connection,
-                                       to_file=to_file, **kwargs)
+                                       to_file=to_file, executor=executor,
+                                       **kwargs)
                 raw_length = len(df)
 
                 # apply clumsy hack that tries to make sure that the dtypes of
                 # data frames containing NaNs or empty strings does not change
                 # when appending the new data frame to the previous.
 
-                # The same hack is also needed in TokenQuery.run().
-                if (len(self.data_table) > 0 and
+                if (data_frames and
                         df.dtypes.tolist() != dtype_list.tolist()):
                     for x in df.columns:
                         # the idea is that pandas/numpy use the 'object'
@@ -266,53 +407,48 @@ class Session(object):
                             if df.dtypes[x] == object:
                                 if not df[x].any():
                                     df[x] = [pd.np.nan] * len(df)
-                                    dtype_list[x] = self.data_table[x].dtype
+                                    dtype_list[x] = data_frames[-1][x].dtype
                             elif dtype_list[x] == object:
-                                if not self.data_table[x].any():
-                                    dummy = [pd.np.nan] * len(self.data_table)
-                                    self.data_table[x] = dummy
+                                if not any(frame[x].any()
+                                           for frame in data_frames):
+                                    for frame in data_frames:
+                                        frame[x] = [pd.np.nan] * len(frame)
                                     dtype_list[x] = df[x].dtype
                 else:
                     dtype_list = df.dtypes
 
                 df = current_query.insert_static_data(df)
 
-                self.to_file = to_file
-
                 if not to_file:
-                    self.data_table = self.data_table.append(df)
+                    data_frames.append(df)
                 else:
+                    # the cached context columns belong to the previous
+                    # query:
+                    manager.reset_context_cache()
                     df = manager.process(df, session=self)
                     self.save_dataframe(df, append=True)
 
-                s_list = ["{:.3f} seconds".format(time.time() - start_time),
-                          "{} match{}".format(
-                              raw_length,
-                              "es" if raw_length != 1 else "")]
-                if len(df) != raw_length:
-                    s_list.append(
-                        "{} output_row{}".format(
-                            len(df),
-                            "s" if len(df) != 1 else ""))
-                logging.info(
-                    "Query executed ({})".format(", ".join(s_list)))
+                self.log_query_time(start_time, raw_length, len(df))
         finally:
+            if executor:
+                executor.shutdown()
+                # discard subqueries that were submitted, but whose results
+                # were not used because of an error:
+                for _, query in run_list:
+                    query._jobs = None
             self.db_connection.close()
 
+        # concatenate the results of all queries only once:
+        if data_frames:
+            self.data_table = pd.concat(data_frames, sort=False)
+        if stream and not options.cfg.gui:
+            return
+
         ordered_columns = self.set_preferred_order(
             list(self.data_table.columns))
         self.data_table = self.data_table[ordered_columns]
 
-        if sys.version_info < (3, 0):
-            for col in self.data_table.columns:
-                if self.data_table.dtypes[col] == object:
-                    try:
-                        self.data_table[col] = (
-                            self.data_table[col].str
-                                                .encode("utf-8"))
-                    except Exception as e:
-                        print(e)
-                        logging.warning(e)
+        self.data_table = self.encode_strings(self.data_table)
 
         if not options.cfg.gui:
             self.aggregate_data()
@@ -341,6 +477,20 @@ class Session(object):
                 index=False)
             output_file.flush()
 
+    @staticmethod
+    def log_query_time(start_time, raw_length, output_length):
+        s_list = ["{:.3f} seconds".format(time.time() - start_time),
+                  "{} match{}".format(
+                      raw_length,
+                      "es" if raw_length != 1 else "")]
+        if output_length != raw_length:
+            s_list.append(
+                "{} output_row{}".format(
+                    output_length,
+                    "s" if output_length != 1 else ""))
+        logging.info(
+            "Query executed ({})".format(", ".join(s_list)))
+
     def get_manager(self):
         if not self.Resource:
             return None
@@ -381,6 +531,17 @@ class Session(object):
         manager.set_groups(self.groups)
         manager.set_column_order(options.cfg.column_order)
 
+        manager.set_column_substitutions(self.get_column_substitutions())
+
+        self.output_object = manager.process(self.data_table,
+                                             self,
+                                             recalculate)
+
+    def get_column_substitutions(self):
+        """
+        Return the column substitutions that are stored in the settings for
+        the current corpus.
+        """
         column_properties = {}
         try:
             column_properties = options.settings.value("column_properties",
@@ -389,11 +550,7 @@ class Session(object):
             options.settings.setValue("column_properties",
                                       column_properties)
         prop = column_properties.get(options.cfg.corpus, {})
-        manager.set_column_substitutions(prop.get("substitutions", {}))
-
-        self.output_object = manager.process(self.data_table,
-                                             self,
-                                             recalculate)
+        return prop.get("substitutions", {})
 
     def drop_cached_aggregates(self):
         self._manager_cache = {}
@@ -11,19 +11,17 @@ with Coquery. If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 
+import collections
+import io
 import logging
-import codecs
+import os
 import sys
+import tempfile
+from multiprocessing.pool import ThreadPool
 import pandas as pd
 
-try:
-    from cStringIO import StringIO as IO_Stream
-except ImportError:
-    from io import BytesIO as IO_Stream
-
 from .errors import DependencyError, SQLProgrammingError
 from .defines import SQL_MYSQL, SQL_SQLITE
-from .general import get_chunk
 from . import options
 from . import capturer
 
@@ -32,6 +30,54 @@ if options.use_mysql:
     import pymysql.cursors
 
 
+class _StrippedFile(object):
+    """
+    A read-only file object that returns the lines of a text file without
+    leading and trailing whitespace and without NUL characters.
+
+    The object can be passed to pandas.read_csv(). On Python 2.7, the lines
+    are returned as UTF-8 encoded byte strings.
+    """
+    def __init__(self, f):
+        self._lines = iter(f)
+        self._buffer = []
+        self._size = 0
+        self._empty = b"" if sys.version_info < (3, 0) else ""
+
+    @staticmethod
+    def clean(line):
+        line = "{}\n".format(line.strip().replace("\x00", ""))
+        if sys.version_info < (3, 0):
+            line = line.encode("utf-8")
+        return line
+
+    def read(self, size=-1):
+        while size is None or size < 0 or self._size < size:
+            try:
+                line = self.clean(next(self._lines))
+            except StopIteration:
+                break
+            self._buffer.append(line)
+            self._size += len(line)
+
+        data = self._empty.join(self._buffer)
+        if size is not None and size >= 0:
+            data, rest = data[:size], data[size:]
+        else:
+            rest = self._empty
+        self._buffer = [rest] if rest else []
+        self._size = len(rest)
+        return data
+
+    def __iter__(self):
+        for line in self._buffer:
+            yield line
+        self._buffer = []
+        self._size = 0
+        for line in self._lines:
+            yield self.clean(line)
+
+
 class SqlDB(object):
     """ A wrapper for MySQL. """
     def __init__(self, Host, Port, Type, User, Password, db_name="",
@@ -89,7 +135,7 @@ class SqlDB(object):
                     FROM information_schema.tables
                     WHERE table_schema = '{}' AND table_name = '{}'
                     """.format(self.db_name, table_name)
-                return bool(connection.execute(S))
+                return bool(connection.execute(S).fetchall())
             elif self.db_type == SQL_SQLITE:
                 S = """
                     SELECT *
@@ -251,11 +297,108 @@ class SqlDB(object):
         cursor.execute(S)
         return cursor
 
+    def bulk_insert(self, df, table_name):
+        """
+        Append the rows from the data frame to an existing table.
+
+        The rows are loaded by the native bulk-loading facility of the
+        database engine instead of by individual INSERT statements. For
+        MySQL, the data frame is written to a temporary file that is read
+        by LOAD DATA LOCAL INFILE. For SQLite, the rows are inserted by a
+        single prepared statement within one transaction.
+
+        Parameters
+        ----------
+        df : Pandas DataFrame
+            The dataframe that is to be loaded into the database table. The
+            column names have to match the column names of the table.
+        table_name : string
+            The name of the table
+
+        Returns
+        -------
+        lines : int
+            The number of lines that have been loaded into the table.
+        """
+        if not len(df):
+            return 0
+
+        if self.db_type == SQL_MYSQL:
+            self._load_data_infile(df, table_name)
+        else:
+            S = "INSERT INTO {} ({}) VALUES ({})".format(
+                table_name,
+                ", ".join(df.columns),
+                ", ".join(["?"] * len(df.columns)))
+            # convert numpy types to Python types, and missing values to
+            # NULL:
+            values = df.astype(object).where(pd.notnull(df), None)
+            con = self.engine.raw_connection()
+            try:
+                cursor = con.cursor()
+                cursor.executemany(S, values.itertuples(index=False,
+                                                        name=None))
+                con.commit()
+            finally:
+                con.close()
+        return len(df)
+
+    def _load_data_infile(self, df, table_name):
+        """
+        Load the data frame into a MySQL table by using LOAD DATA LOCAL
+        INFILE.
+
+        The values are escaped as required by the default field and line
+        format of LOAD DATA, and missing values are written as \\N so
+        that they are read as NULL.
+        """
+        columns = []
+        for column in df.columns:
+            values = df[column].astype(str)
+            if df[column].dtype == object:
+                values = (values.str.replace("\\", "\\\\", regex=False)
+                                .str.replace("\t", "\\t", regex=False)
+                                .str.replace("\n", "\\n", regex=False)
+                                .str.replace("\r", "\\r", regex=False))
+            values[df[column].isnull().values] = "\\N"
+            columns.append(values)
+        lines = columns[0].str.cat(columns[1:], sep="\t")
+
+        temp_file = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
+        try:
+            with temp_file:
+                for line in lines:
+                    temp_file.write(line.encode("utf-8"))
+                    temp_file.write(b"\n")
+            S = """
+                LOAD DATA LOCAL INFILE '{path}'
+                INTO TABLE {table}
+                CHARACTER SET utf8mb4
+                FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+                LINES TERMINATED BY '\\n'
+                ({columns})
+                """.format(path=temp_file.name.replace("\\", "/"),
+                           table=table_name,
+                           columns=", ".join(df.columns))
+            con = self.engine.raw_connection()
+            try:
+                cursor = con.cursor()
+                cursor.execute(S)
+                con.commit()
+            finally:
+                con.close()
+        finally:
+            os.remove(temp_file.name)
+
     def load_dataframe(self, df, table_name, index_label,
                        if_exists="append"):
         """
         Load the table with content from the dataframe.
 
+        If the rows are appended to an existing table, they are loaded by
+        using :func:`bulk_insert`. Otherwise, the table is created from the
+        dataframe.
+
         Parameters
         ----------
         df : Pandas DataFrame
@@ -278,6 +421,11 @@ class SqlDB(object):
             The number of lines that have been loaded into the table.
         """
         df.index = pd.RangeIndex(start=1, stop=len(df)+1, step=1)
+        if if_exists == "append" and self.has_table(table_name):
+            if index_label:
+                df = df.rename_axis(index_label).reset_index()
+            return self.bulk_insert(df, table_name)
+
         df.to_sql(table_name,
                   self.engine,
                   if_exists=if_exists,
@@ -290,6 +438,11 @@ class SqlDB(object):
         """
         Load the file content into the SQL table.
 
+        The file is read in chunks of `chunksize` lines, and each chunk is
+        loaded into the table before the next chunk is read. Leading and
+        trailing whitespace and NUL characters are removed from each line,
+        see _StrippedFile.
+
         Parameters
         ----------
         table_name : string
@@ -311,38 +464,34 @@ class SqlDB(object):
         """
         count = 0
         chunk_signal = kwargs.pop("chunksignal", None)
-        with codecs.open(file_name, "r", encoding=encoding) as big_file:
+        fillna = kwargs.pop("fillna", None)
+        drop_duplicate = kwargs.pop("drop_duplicate", None)
+        kwargs.setdefault("keep_default_na", False)
 
-            # Iterate the chunks:
-            for i, lines in enumerate(get_chunk(big_file, chunksize)):
+        capt = capturer.Capturer(stderr=True)
+        with capt, io.open(file_name, "r", encoding=encoding) as input_file:
+            # the lines are decoded by io.open(), and _StrippedFile
+            # re-encodes them as UTF-8 only on Python 2.7:
+            reader = pd.read_csv(_StrippedFile(input_file), encoding="utf-8",
+                                 engine="c", chunksize=chunksize, **kwargs)
+            for i, df in enumerate(reader):
                 if chunk_signal:
                     chunk_signal.emit(i, None)
-                content = list(lines)
-                count += len(content)
-
-                # create IO stream for chunk:
-                if sys.version_info < (3, 0):
-                    buffer = (u"\n".join([x.strip() for x in content])
-                                   .replace("\x00", "")
-                                   .encode("utf-8"))
-                    stream = IO_Stream(buffer)
-                else:
-                    buffer = ("\n".join([x.strip() for x in content])
-                                  .replace("\x00", ""))
-                    stream = IO_Stream(bytes(buffer, encoding="utf-8"))
-
-                # load the IO stream containing a chunk from the big
-                # file into the matching table name:
-                columns = self.load_infile(stream,
-                                           table_name=table,
-                                           if_exists=if_exists,
-                                           index=index,
-                                           keep_default_na=False,
-                                           **kwargs).columns
-                if i == 0:
-                    kwargs["names"] = columns
-                    kwargs["header"] = None
-                kwargs["skiprows"] = None
+                if fillna is not None:
+                    df = df.fillna(fillna)
+                if drop_duplicate:
+                    df = df[~df.duplicated(drop_duplicate)]
+                self.load_dataframe(df,
+                                    table_name=table,
+                                    index_label=index,
+                                    if_exists=if_exists)
+                count += len(df)
+                # create the table only once:
+                if if_exists == "replace":
+                    if_exists = "append"
+        for x in capt:
+            logging.warning("File {} – {}".format(file_name, x))
+            print("File {} – {}".format(file_name, x))
 
         return count
 
@@ -587,6 +736,111 @@ class SqlDB(object):
             index_name, table_name, ",".join(variables))
         self.connection.execute(S)
 
+    def create_indices(self, indices, workers=1, callback=None,
+                       interrupted=None):
+        """
+        Create several indices.
+
+        On MySQL, the indices of each table are added by a single ALTER
+        TABLE statement so that each table is processed only once. If more
+        than one worker is requested, the tables are processed concurrently
+        by using separate connections. On SQLite, the indices are created
+        within a single transaction.
+
+        If an index cannot be created, a warning is logged, and the
+        remaining indices are created.
+
+        Parameters
+        ----------
+        indices : list
+            A list of tuples, each containing the table name, the index
+            name, the list of indexed columns, and the index length (or
+            None), see :func:`create_index`.
+        workers : int
+            The number of tables that are indexed concurrently (MySQL only)
+        callback : callable
+            A function that is called with the number of indices that have
+            been created so far.
+        interrupted : callable
+            A function that returns True if index creation is to be
+            stopped.
+        """
+        def get_definition(variables, index_length):
+            if index_length:
+                variables = ["%s(%s)" % (variables[0], index_length)]
+            return ",".join(variables)
+
+        def warn(e):
+            print(e)
+            logging.warning(e)
+
+        count = 0
+        if self.db_type == SQL_MYSQL:
+            tables = collections.OrderedDict()
+            for table_name, index_name, variables, length in indices:
+                tables.setdefault(table_name, []).append(
+                    (index_name, get_definition(variables, length)))
+
+            def alter_table(item):
+                table_name, table_indices = item
+                if interrupted and interrupted():
+                    return 0
+                S = "ALTER TABLE {} {}".format(
+                    table_name,
+                    ", ".join(["ADD INDEX {}({})".format(name, definition)
+                               for name, definition in table_indices]))
+                with self.engine.connect() as connection:
+                    try:
+                        connection.execute(S)
+                    except Exception:
+                        # retry the indices one by one so that a single
+                        # failing index does not prevent the others:
+                        for name, definition in table_indices:
+                            try:
+                                connection.execute(
+                                    "ALTER TABLE {} ADD INDEX {}({})".format(
+                                        table_name, name, definition))
+                            except Exception as e:
+                                warn(e)
+                return len(table_indices)
+
+            if workers > 1 and len(tables) > 1:
+                pool = ThreadPool(min(workers, len(tables)))
+                try:
+                    for n in pool.imap_unordered(alter_table, tables.items()):
+                        count += n
+                        if callback:
+                            callback(count)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for item in tables.items():
+                    count += alter_table(item)
+                    if callback:
+                        callback(count)
+        else:
+            con = self.engine.raw_connection()
+            try:
+                cursor = con.cursor()
+                if not getattr(con, "in_transaction", False):
+                    cursor.execute("BEGIN")
+                for table_name, index_name, variables, length in indices:
+                    if interrupted and interrupted():
+                        break
+                    try:
+                        cursor.execute("CREATE INDEX {} ON {}({})".format(
+                            index_name, table_name,
+                            get_definition(variables, length)))
+                    except Exception as e:
+                        warn(e)
+                    count += 1
+                    if callback:
+                        callback(count)
+                con.commit()
+            finally:
+                con.close()
+
     def executemany(self, s, d):
         s = s.replace("%s", "?")
         self.connection.execute(s, d)
@@ -11,14 +11,26 @@ with Coquery. If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 
+import ast
 import collections
+import numbers
+import os
 import pandas as pd
 import re
+import shutil
+import sqlite3
 import sys
+import tempfile
+import unicodedata
 
 from .defines import SQL_MYSQL, SQL_SQLITE
 from .unicode import utf8
 
+try:
+    string_types = (unicode, str)
+except NameError:
+    string_types = (str, )
+
 
 class Column(object):
     """ Define an object that stores the description of a column in one
@@ -152,6 +164,278 @@ class Link(Column):
         raise ValueError("No corresponding table found for {}".format(self))
 
 
+def _intern(value):
+    """
+    Return the interned version of the value if the value is a string.
+    """
+    try:
+        return sys.intern(value)
+    except (AttributeError, TypeError):
+        return value
+
+
+def _normalize_key(key):
+    """
+    Return the key as a tuple in which equal values have the same
+    representation.
+
+    Integral numbers are converted to int, so that e.g. 1 and 1.0 give the
+    same key, and byte strings are converted to unicode. Strings are
+    interned.
+    """
+    values = []
+    for x in key:
+        if isinstance(x, numbers.Integral):
+            x = int(x)
+        elif isinstance(x, numbers.Real):
+            x = float(x)
+            if x.is_integer():
+                x = int(x)
+        elif isinstance(x, bytes):
+            x = utf8(x)
+        values.append(_intern(x))
+    return tuple(values)
+
+
+def _prepare_column(values):
+    """
+    Prepare the values of a table column so that they can be committed to
+    the data base.
+
+    Missing values are replaced by empty strings. Strings are converted to
+    unicode (Python 2.7) and normalized to NFKC. As NFKC leaves ASCII
+    strings unchanged, the strings are normalized only if the column
+    contains any non-ASCII character.
+
+    Parameters
+    ----------
+    values : sequence
+        The values of the column
+
+    Returns
+    -------
+    values : list
+        The prepared values
+    """
+    # 'x != x' is True for NaN:
+    if any([x is None or x != x for x in values]):
+        values = ["" if x is None or x != x else x for x in values]
+    else:
+        values = list(values)
+
+    strings = [x for x in values if isinstance(x, string_types)]
+    if not strings:
+        return values
+    if sys.version_info < (3, 0):
+        values = [utf8(x) if isinstance(x, string_types) else x
+                  for x in values]
+        strings = [x for x in values if isinstance(x, string_types)]
+    try:
+        "".join(strings).encode("ascii")
+    except UnicodeError:
+        values = [unicodedata.normalize("NFKC", x)
+                  if isinstance(x, string_types) else x
+                  for x in values]
+    return values
+
+
+class Lexicon(object):
+    """
+    A mapping from the values of table rows to their row ids.
+
+    Lexicons are used by tables to look up the id of a row. The strings in
+    the values are interned so that equal strings share the same memory.
+    If a maximum size is set, the lexicon keeps at most this number of
+    entries in memory. When the limit is reached, the entries are moved to
+    a new segment, i.e. an SQLite database file in a temporary directory.
+    Segments are not changed after they have been written, so worker
+    processes that inherit the lexicon can read from them while the parent
+    process adds new entries.
+
+    Keys are normalized by _normalize_key() so that keys that compare
+    equal in memory also match after they have been moved to a segment.
+    """
+    def __init__(self, max_size=0):
+        """
+        Parameters
+        ----------
+        max_size : int
+            The maximum number of entries that are kept in memory. If 0,
+            all entries are kept in memory.
+        """
+        self.max_size = max_size
+        self._memory = {}
+        self._segments = []
+        self._disk_size = 0
+        self._path = None
+        self._connections = {}
+        self._pid = os.getpid()
+        # reverse indexes that map the values at some key positions to an
+        # id, see find():
+        self._indexes = {}
+
+    @staticmethod
+    def _encode(key):
+        return repr(key)
+
+    @staticmethod
+    def _decode(s):
+        return ast.literal_eval(s)
+
+    def _connect(self, path):
+        # SQLite connections must not be shared with forked processes:
+        if self._pid != os.getpid():
+            self._connections = {}
+            self._pid = os.getpid()
+        try:
+            return self._connections[path]
+        except KeyError:
+            con = sqlite3.connect(path)
+            self._connections[path] = con
+            return con
+
+    def _find(self, key):
+        if not self._segments:
+            return None
+        encoded = self._encode(key)
+        for path in reversed(self._segments):
+            row = self._connect(path).execute(
+                "SELECT Id FROM Lookup WHERE Key = ?", (encoded, )).fetchone()
+            if row:
+                return row[0]
+        return None
+
+    def __len__(self):
+        return len(self._memory) + self._disk_size
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        key = _normalize_key(key)
+        self._memory[key] = value
+        for positions, index in self._indexes.items():
+            index.setdefault(tuple([key[i] for i in positions]), value)
+        if self.max_size and len(self._memory) >= self.max_size:
+            self.spill()
+
+    def get(self, key, default=None):
+        key = _normalize_key(key)
+        try:
+            return self._memory[key]
+        except KeyError:
+            value = self._find(key)
+            if value is None:
+                return default
+            return value
+
+    def items(self):
+        for item in self._memory.items():
+            yield item
+        for path in self._segments:
+            for s, value in self._connect(path).execute(
+                    "SELECT Key, Id FROM Lookup"):
+                key = self._decode(s)
+                if key not in self._memory:
+                    yield key, value
+
+    def find(self, values):
+        """
+        Return the id of an entry whose key matches the values at the given
+        key positions, or None if there is no such entry.
+
+        For each combination of key positions, a reverse index is built
+        when find() is called for the first time. The index is updated by
+        all later insertions.
+
+        Parameters
+        ----------
+        values : dict
+            A dictionary with key positions as keys, and the values that
+            the key has to match at these positions as values.
+
+        Returns
+        -------
+        value : int or NoneType
+        """
+        positions = tuple(sorted(values))
+        try:
+            index = self._indexes[positions]
+        except KeyError:
+            index = {}
+            for key, value in self.items():
+                index.setdefault(tuple([key[i] for i in positions]), value)
+            self._indexes[positions] = index
+        return index.get(_normalize_key([values[i] for i in positions]))
+
+    def spill(self):
+        """
+        Move the entries from memory to a new segment.
+        """
+        if not self._memory:
+            return
+        if self._path is None:
+            self._path = tempfile.mkdtemp(prefix="coq_lexicon_")
+        path = os.path.join(self._path,
+                            "segment{}.db".format(len(self._segments)))
+        con = self._connect(path)
+        con.execute("PRAGMA journal_mode=OFF")
+        con.execute("PRAGMA synchronous=OFF")
+        con.execute("CREATE TABLE Lookup (Key TEXT PRIMARY KEY, Id INTEGER)")
+        con.executemany("INSERT OR REPLACE INTO Lookup VALUES (?, ?)",
+                        [(self._encode(key), value)
+                         for key, value in self._memory.items()])
+        con.commit()
+        self._segments.append(path)
+        self._disk_size += len(self._memory)
+        self._memory = {}
+
+    def memory_usage(self):
+        """
+        Return an estimate of the number of bytes used by the entries that
+        are kept in memory.
+
+        Interned strings are counted only once.
+        """
+        size = sys.getsizeof(self._memory)
+        seen = set()
+        for key, value in self._memory.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+            for x in key:
+                if id(x) not in seen:
+                    seen.add(id(x))
+                    size += sys.getsizeof(x)
+        return size
+
+    def disk_usage(self):
+        """
+        Return the number of bytes used by the segments.
+        """
+        return sum([os.path.getsize(path) for path in self._segments
+                    if os.path.exists(path)])
+
+    def close(self):
+        """
+        Remove all entries, and delete the segments.
+        """
+        for con in self._connections.values():
+            con.close()
+        self._connections = {}
+        if self._path and self._pid == os.getpid():
+            shutil.rmtree(self._path, ignore_errors=True)
+        self._path = None
+        self._segments = []
+        self._disk_size = 0
+        self._memory = {}
+        self._indexes = {}
+
+
 class Table(object):
     """ Define a class that is used to store table definitions."""
     def __init__(self, name):
@@ -161,22 +445,21 @@ class Table(object):
         self._current_id = 0
         self._row_order = []
         self._add_cache = list()
-        # The defaultdict _add_lookup will store the index of rows in this
-        # table. It uses the trick described at http://ikigomu.com/?p=186
-        # to achieve an O(1) lookup. When looking up a row as in
+        # _add_lookup maps the values of the rows in this table to their
+        # row ids, as in
         #
         # x = self._add_lookup[tuple([row[x] for x in self._row_order])]
-        #
-        # the returned value is the length of the lookup table at the time
-        # the entry was created. In other words, this is the row id of that
-        # row.
-        self._add_lookup = collections.defaultdict(
-            lambda: len(self._add_lookup) + 1)
+        self._add_lookup = Lexicon()
         self._commited = {}
         self._col_names = None
         self._engine = None
         self._max_cache = 0
         self._line_counter = 0
+        # positions of the rows in the add cache that were added by
+        # get_or_insert() while the table is recording, see
+        # start_recording():
+        self._recording = False
+        self._lookup_rows = []
 
     @property
     def name(self):
@@ -192,6 +475,33 @@ class Table(object):
     def set_max_cache(self, new):
         self._max_cache = new
 
+    def set_max_lookup(self, new):
+        """
+        Set the maximum number of lookup entries that are kept in memory.
+        Additional entries are moved to disk, see :class:`Lexicon`.
+        """
+        self._add_lookup.max_size = new
+
+    def get_lookup_usage(self):
+        """
+        Return the size of the lookup of the table.
+
+        Returns
+        -------
+        tup : tuple
+            A tuple with the number of entries, the number of bytes used in
+            memory, and the number of bytes used on disk.
+        """
+        return (len(self._add_lookup),
+                self._add_lookup.memory_usage(),
+                self._add_lookup.disk_usage())
+
+    def close_lookup(self):
+        """
+        Remove all entries from the lookup of the table.
+        """
+        self._add_lookup.close()
+
     def commit(self):
         """
         Commit the table content to the data base.
@@ -204,36 +514,22 @@ class Table(object):
         """
 
         if self._add_cache:
-            df = pd.DataFrame(self._add_cache).fillna("")
-
-            try:
-                df.columns = self._get_field_order()
-            except ValueError as e:
-                raise ValueError("{}: {}".format(self.name, e))
-
-            # make sure that all strings are unicode, even under
-            # Python 2.7:
-            if sys.version_info < (3, 0):
-                for column in df.columns[df.dtypes == object]:
-                    try:
-                        df[column] = df[column].apply(utf8)
-                    except TypeError:
-                        pass
-
-            # apply unicode normalization:
-            for column in df.columns[df.dtypes == object]:
-                try:
-                    df[column] = df[column].str.normalize("NFKC")
-                except TypeError:
-                    pass
+            field_order = self._get_field_order()
+            columns = list(zip(*self._add_cache))
+            if len(columns) != len(field_order):
+                raise ValueError("{}: {} values for {} columns".format(
+                    self.name, len(columns), len(field_order)))
+
+            df = pd.DataFrame(collections.OrderedDict(
+                [(name, _prepare_column(values))
+                 for name, values in zip(field_order, columns)]))
 
             if not self.primary.unique:
                 if self._DB.db_type == SQL_SQLITE:
                     df[self.primary.alias] = range(self._line_counter, self._line_counter + len(df))
                 self._line_counter += len(df)
 
-            df.to_sql(self.name, self._DB.engine, if_exists="append",
-                      index=False)
+            self._DB.bulk_insert(df, self.name)
 
             self._add_cache = list()
 
@@ -303,11 +599,96 @@ class Table(object):
             The id of the entry, as it is stored in the SQL table.
         """
         key = tuple([values[x] for x in self._row_order])
-        if key in self._add_lookup:
-            return self._add_lookup[key]
+        row_id = self._add_lookup.get(key)
+        if row_id is not None:
+            return row_id
         else:
+            if self._recording:
+                self._lookup_rows.append(len(self._add_cache))
             return self.add(values)
 
+    def start_recording(self):
+        """
+        Keep all new rows in the add cache so that they can be retrieved
+        by take_records() instead of being committed to the data base.
+
+        Recording tables are used by the worker processes of the corpus
+        builder. The ids of the new rows are only valid within the worker
+        process.
+        """
+        self._recording = True
+        self._max_cache = 0
+        # worker processes keep their lookup entries in memory so that
+        # they do not leave segment files behind:
+        self._add_lookup.max_size = 0
+
+    def take_records(self):
+        """
+        Return the rows that were added since the last call, and remove
+        them from the add cache.
+
+        The lookup of the table is kept so that rows which are added again
+        receive the same id.
+
+        Returns
+        -------
+        tup : tuple
+            A tuple with two lists. The first list contains the new rows as
+            tuples in the order given by _get_field_order(). The second list
+            contains a boolean for each row that is True if the row was
+            added by get_or_insert(), and False if it was added by add().
+        """
+        lookup_rows = set(self._lookup_rows)
+        records = (self._add_cache,
+                   [i in lookup_rows for i in range(len(self._add_cache))])
+        self._add_cache = list()
+        self._lookup_rows = []
+        return records
+
+    def restore(self, current_id, line_counter=0):
+        """
+        Restore the state of the table from the data base, e.g. in order to
+        resume an interrupted build.
+
+        All rows that were added after the state was recorded are removed
+        from the data base table, and the lookup is filled with the
+        remaining rows.
+
+        Parameters
+        ----------
+        current_id : int
+            The last id that was assigned when the state was recorded
+        line_counter : int
+            The number of rows in the table when the state was recorded
+        """
+        generated = self.primary.name not in self._row_order
+        if generated:
+            columns = [self.primary.name] + self._row_order
+            S = "DELETE FROM {} WHERE {} > {}".format(
+                self.name, self.primary.name, current_id)
+        else:
+            columns = self._row_order
+            if self._DB.db_type == SQL_SQLITE and not self.primary.unique:
+                S = "DELETE FROM {} WHERE {} >= {}".format(
+                    self.name, self.primary.alias, line_counter)
+            else:
+                S = None
+
+        with self._DB.engine.connect() as connection:
+            if S:
+                connection.execute(S)
+            S = "SELECT {} FROM {}".format(", ".join(columns), self.name)
+            for row in connection.execute(S):
+                if generated:
+                    self._add_lookup[tuple(row[1:])] = row[0]
+                else:
+                    row = tuple(row)
+                    self._add_lookup[row] = row[
+                        self._row_order.index(self.primary.name)]
+
+        self._current_id = current_id
+        self._line_counter = line_counter
+
     def _get_field_order(self):
         if self.primary.name not in self._row_order:
             return [self.primary.name] + self._row_order
@@ -318,7 +699,20 @@ class Table(object):
         """
         Return the first row that matches the values, or None
         otherwise.
+
+        If the table is recording, only the rows in the lookup are
+        searched, and the id of the matching row is returned.
         """
+        if self._recording:
+            if set(values) == set(self._row_order):
+                return self._add_lookup.get(
+                    tuple([values[x] for x in self._row_order]))
+            if not set(values).issubset(self._row_order):
+                return None
+            return self._add_lookup.find(
+                dict([(self._row_order.index(x), values[x])
+                      for x in values]))
+
         x = self._DB.find(self.name, values, [self.primary.name])
         if x:
             return x[0]
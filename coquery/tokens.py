@@ -119,6 +119,38 @@ class QueryToken(object):
                         return True
         return False
 
+    @classmethod
+    def get_literals(cls, s):
+        """
+        Split the string at the wildcards.
+
+        Parameters
+        ----------
+        s : string
+            The string to be processed
+
+        Returns
+        -------
+        l : list
+            A list of the literal substrings that are separated by the
+            wildcards, with escape characters removed. The first element is
+            an empty string if s starts with a wildcard, and the last
+            element is an empty string if s ends with a wildcard.
+        """
+        l = [""]
+        skip_next = False
+        for x in s:
+            if skip_next:
+                l[-1] += x
+                skip_next = False
+            elif x == "\\":
+                skip_next = True
+            elif x in cls.wildcard_characters:
+                l.append("")
+            else:
+                l[-1] += x
+        return l
+
     @staticmethod
     def replace_wildcards(s):
         """
@@ -24,6 +24,10 @@ def main():
                       TestReference, TestArticle, TestBook,
                       TestInCollection]
 
+    if not args or "cache" in args:
+        from test.test_cache import provided_tests
+        test_list += provided_tests
+
     if not args or "celex" in args:
         from test.test_celex import TestCELEX
         test_list += [TestCELEX]
@@ -61,8 +65,8 @@ def main():
         test_list += test_general.provided_tests
 
     if not args or "managers" in args:
-        from test.test_managers import TestManager
-        test_list += [TestManager]
+        from test.test_managers import TestManager, TestContrastMatrix
+        test_list += [TestManager, TestContrastMatrix]
 
     if not args or "options" in args:
         from test.test_options import TestQueryStringParse
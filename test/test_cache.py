@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+This module tests the cache module.
+
+Run it like so:
+
+coquery$ python -m test.test_cache
+
+"""
+
+from __future__ import unicode_literals
+
+import unittest
+import argparse
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+from coquery import options
+from coquery.cache import CoqQueryCache, get_size, replace_file
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        options.cfg = argparse.Namespace()
+        options.cfg.use_cache = True
+        options.cfg.verbose = False
+        options.cfg.cache_path = self.path
+        self.df1 = pd.DataFrame({"a": ["x" * 100] * 100})
+        self.df2 = pd.DataFrame({"a": ["y" * 100] * 100})
+        self.df3 = pd.DataFrame({"a": ["z" * 100] * 100})
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_get_size(self):
+        df = pd.DataFrame({"a": ["x" * 1000] * 10})
+        self.assertGreater(get_size(df), 10000)
+
+    def test_replace_file(self):
+        src = os.path.join(self.path, "src")
+        dst = os.path.join(self.path, "dst")
+        for path, content in ((src, "new"), (dst, "old")):
+            with open(path, "w") as f:
+                f.write(content)
+        replace_file(src, dst)
+        self.assertFalse(os.path.exists(src))
+        with open(dst) as f:
+            self.assertEqual(f.read(), "new")
+
+    def test_add_get(self):
+        cache = CoqQueryCache(maxsize=10 ** 6)
+        cache.add("key1", self.df1)
+        pd.testing.assert_frame_equal(cache.get("key1"), self.df1)
+        self.assertRaises(KeyError, cache.get, "key2")
+        self.assertGreater(cache.size(), 0)
+
+    def test_persistence(self):
+        cache = CoqQueryCache(maxsize=10 ** 6)
+        cache.add("key1", self.df1)
+        cache.add(("key", 2), self.df2)
+        cache.save()
+
+        cache = CoqQueryCache(read_cache=True, maxsize=10 ** 6)
+        # entries are not loaded into memory before they are requested:
+        self.assertEqual(cache.memory_size(), 0)
+        pd.testing.assert_frame_equal(cache.get(("key", 2)), self.df2)
+        self.assertGreater(cache.memory_size(), 0)
+        pd.testing.assert_frame_equal(cache.get("key1"), self.df1)
+
+    def test_memory_eviction(self):
+        size = get_size(self.df1)
+        cache = CoqQueryCache(maxsize=10 ** 6, memory_size=int(size * 1.5))
+        cache.add("key1", self.df1)
+        cache.add("key2", self.df2)
+        self.assertLessEqual(cache.memory_size(), size * 1.5)
+
+        # evicted entries are still available from disk:
+        pd.testing.assert_frame_equal(cache.get("key1"), self.df1)
+        pd.testing.assert_frame_equal(cache.get("key2"), self.df2)
+
+    def test_disk_eviction(self):
+        cache = CoqQueryCache(maxsize=10 ** 6)
+        cache.add("key1", self.df1)
+        file_size = cache.size()
+
+        cache.resize(int(file_size * 2.5))
+        cache.get("key1")
+        cache.add("key2", self.df2)
+        cache.add("key3", self.df3)
+
+        # key2 is the least frequently used entry:
+        self.assertRaises(KeyError, cache.get, "key2")
+        pd.testing.assert_frame_equal(cache.get("key1"), self.df1)
+        pd.testing.assert_frame_equal(cache.get("key3"), self.df3)
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.path, cache.FOLDER_NAME))), 2)
+
+    def test_clear_restore(self):
+        cache = CoqQueryCache(maxsize=10 ** 6)
+        cache.add("key1", self.df1)
+        cache.clear()
+        self.assertTrue(cache.has_backup())
+        self.assertEqual(cache.size(), 0)
+        self.assertRaises(KeyError, cache.get, "key1")
+
+        cache.restore()
+        self.assertFalse(cache.has_backup())
+        pd.testing.assert_frame_equal(cache.get("key1"), self.df1)
+
+        cache.clear()
+        cache.add("key2", self.df2)
+        self.assertFalse(cache.has_backup())
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.path, cache.FOLDER_NAME))), 1)
+
+    def test_invalidate(self):
+        cache = CoqQueryCache(maxsize=10 ** 6)
+        cache.add(("Corpus1", "query1"), self.df1)
+        cache.add(("Corpus1", "query2"), self.df2)
+        cache.add(("Corpus2", "query1"), self.df3)
+        cache.invalidate("Corpus1")
+        self.assertRaises(KeyError, cache.get, ("Corpus1", "query1"))
+        self.assertRaises(KeyError, cache.get, ("Corpus1", "query2"))
+        pd.testing.assert_frame_equal(cache.get(("Corpus2", "query1")),
+                                      self.df3)
+
+
+provided_tests = [TestQueryCache]
+
+
+def main():
+    suite = unittest.TestSuite(
+        [unittest.TestLoader().loadTestsFromTestCase(x)
+         for x in provided_tests])
+    unittest.TextTestRunner().run(suite)
+
+
+if __name__ == '__main__':
+    main()
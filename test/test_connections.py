@@ -17,15 +17,36 @@ import sys
 import select
 import random
 import string
+import sqlite3
 
 from coquery.connections import (Connection,
                                  MySQLConnection,
-                                 SQLiteConnection)
+                                 SQLiteConnection,
+                                 SQLiteRegexp,
+                                 _register_sqlite_functions)
 from coquery.defines import SQL_MYSQL, SQL_SQLITE, DEFAULT_CONFIGURATION
 from coquery.corpus import BaseResource, CorpusClass
 from coquery.general import get_home_dir
 
 
+class MockEngine(object):
+    def __init__(self, url, **kwargs):
+        self.url = url
+        self.kwargs = kwargs
+        self.disposed = False
+
+    def dispose(self):
+        self.disposed = True
+
+
+class MockEngineConnection(Connection):
+    def url(self, database=None):
+        return "mock:///{}".format(database)
+
+    def create_engine(self, database=None):
+        return MockEngine(self.url(database), **self._pool_options)
+
+
 class TestConnection(unittest.TestCase):
     def setUp(self):
         self.name = "test_virtual"
@@ -79,6 +100,50 @@ class TestConnection(unittest.TestCase):
         con.add_resource(res2, cor2)
         self.assertEqual(con.count_resources(), 2)
 
+    def test_get_engine_reuse(self):
+        con = MockEngineConnection(self.name)
+        engine1 = con.get_engine("db1")
+        engine2 = con.get_engine("db2")
+
+        self.assertIs(con.get_engine("db1"), engine1)
+        self.assertIs(con.get_engine("db2"), engine2)
+        self.assertIsNot(engine1, engine2)
+        self.assertEqual(engine1.url, "mock:///db1")
+
+    def test_get_engine_read_only(self):
+        # connections without read-only support share the engine:
+        con = MockEngineConnection(self.name)
+        self.assertIs(con.get_engine("db1", read_only=True),
+                      con.get_engine("db1"))
+
+    def test_dispose_engines(self):
+        con = MockEngineConnection(self.name)
+        engine1 = con.get_engine("db1")
+        engine2 = con.get_engine("db2")
+
+        con.dispose_engines("db1")
+        self.assertTrue(engine1.disposed)
+        self.assertFalse(engine2.disposed)
+        self.assertIsNot(con.get_engine("db1"), engine1)
+        self.assertIs(con.get_engine("db2"), engine2)
+
+        con.dispose_engines()
+        self.assertTrue(engine2.disposed)
+        self.assertIsNot(con.get_engine("db2"), engine2)
+
+    def test_set_pool_options(self):
+        con = MockEngineConnection(self.name)
+        engine = con.get_engine("db1")
+
+        # unchanged settings keep the engine:
+        con.set_pool_options(**con.get_pool_options())
+        self.assertFalse(engine.disposed)
+        self.assertIs(con.get_engine("db1"), engine)
+
+        con.set_pool_options(pool_size=2)
+        self.assertTrue(engine.disposed)
+        self.assertEqual(con.get_engine("db1").kwargs["pool_size"], 2)
+
     def test_remove_resource(self):
         res_name = "Corpus1"
         db_name = "coq_corpus1"
@@ -272,6 +337,71 @@ class TestSQLiteConnection(unittest.TestCase):
 
         self.assertEqual(url, con.url(self.db_name))
 
+    def test_url_read_only(self):
+        con = SQLiteConnection(self.name, self.db_path)
+
+        path = os.path.join(self.db_path, "{}.db".format(self.db_name))
+        url = "sqlite+pysqlite:///file:{path}?mode=ro&uri=true".format(
+            path=path)
+
+        self.assertEqual(url, con.url(self.db_name, read_only=True))
+
+    def test_regexp_function(self):
+        db = sqlite3.connect(":memory:")
+        _register_sqlite_functions(db, None)
+        db.execute("CREATE TABLE T (Word TEXT)")
+        db.executemany("INSERT INTO T VALUES (?)",
+                       [("walk",), ("walked",), ("talk",), (None,)])
+        results = db.execute(
+            "SELECT Word FROM T WHERE Word REGEXP '^w.*' ORDER BY Word")
+        self.assertEqual([x for x, in results.fetchall()],
+                         ["walk", "walked"])
+
+        results = db.execute(
+            "SELECT Word FROM T WHERE Word REGEXP '(?i)^W.*' ORDER BY Word")
+        self.assertEqual([x for x, in results.fetchall()],
+                         ["walk", "walked"])
+
+    def test_regexp_literals(self):
+        func = SQLiteRegexp()
+        self.assertEqual(func.compile("^walk.*ed$")[1:],
+                         ("walk", "walk", False))
+        self.assertEqual(func.compile("(?i)x+ING$")[1:],
+                         ("", "ing", True))
+        self.assertEqual(func.compile("^(walk|talk)ed")[1:],
+                         ("", "ed", False))
+        self.assertEqual(func.compile("walk|talk")[1:],
+                         ("", "", False))
+        self.assertEqual(func.compile("(?m)^walk")[1:],
+                         ("", "walk", False))
+        # non-ASCII literals are unicode strings:
+        regex, prefix, literal, _ = func.compile("^caf\u00e9s?$")
+        self.assertEqual((prefix, literal), ("caf\u00e9", "caf\u00e9"))
+        self.assertIsInstance(literal, type("\u00e9"))
+        self.assertTrue(func("^caf\u00e9", "caf\u00e9s"))
+        self.assertFalse(func("^caf\u00e9", "cafe"))
+
+    def test_regexp_matches(self):
+        func = SQLiteRegexp()
+        self.assertTrue(func("^walk", "walked"))
+        self.assertFalse(func("^walk", "sidewalk"))
+        self.assertTrue(func("a.k", "talk"))
+        self.assertFalse(func("walk", None))
+        self.assertTrue(func("(?i)^WALK", "Walked"))
+        self.assertFalse(func("^WALK", "Walked"))
+        # the Kelvin sign matches 'k' if case is ignored:
+        self.assertTrue(func("(?i)walk", "wal\u212a"))
+        self.assertTrue(func("(?i)wal\u212a", "WALK"))
+        self.assertTrue(func("(?i)^stra\u00dfe", "STRA\u00dfE"))
+
+    def test_regexp_cache_size(self):
+        func = SQLiteRegexp(maxsize=2)
+        func("a", "a")
+        func("b", "b")
+        func("a", "a")
+        func("c", "c")
+        self.assertEqual(list(func._cache), ["a", "c"])
+
 
 provided_tests = (TestConnection, TestMySQLConnection, TestSQLiteConnection)
 
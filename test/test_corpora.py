@@ -4,14 +4,21 @@ from __future__ import print_function
 import unittest
 import argparse
 import os
+import sqlite3
+
+import pandas as pd
 
 from .mockmodule import MockOptions
 
 from coquery.defines import DEFAULT_CONFIGURATION
-from coquery.connections import MySQLConnection
+from coquery.connections import (MySQLConnection, SQLiteConnection,
+                                 _register_sqlite_functions)
 from coquery.corpus import SQLResource, CorpusClass
 from coquery.coquery import options
-from coquery.defines import SQL_MYSQL, CONTEXT_NONE
+from coquery.defines import (SQL_MYSQL, CONTEXT_NONE,
+                             QUERY_ITEM_WORD, QUERY_ITEM_LEMMA,
+                             QUERY_ITEM_TRANSCRIPT)
+from coquery.errors import UnsupportedQueryItemError
 from coquery.queries import TokenQuery
 from coquery.tokens import COCAToken
 import coquery.links
@@ -131,6 +138,44 @@ class ExternalCorpus(SQLResource):
     name = "ExternalCorpus"
 
 
+class MockResult(object):
+    """
+    Wrap an sqlite3 cursor so that it behaves like an SQLAlchemy result.
+    """
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def keys(self):
+        return [x[0] for x in self._cursor.description]
+
+
+class MockDBConnection(object):
+    def __init__(self):
+        self._connection = sqlite3.connect(":memory:")
+
+    def execute(self, S):
+        return MockResult(self._connection.execute(S))
+
+
+class MockEngine(sqlite3.Connection):
+    url = "sqlite:///mock_engine.db"
+
+
+class MockQueryEngine(object):
+    """
+    An engine that records the queries, and fails on each of them.
+    """
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, S):
+        self.queries.append(S)
+        raise ValueError("no database")
+
+
 class MockConnection(MySQLConnection):
     def resources(self):
         return self._resources
@@ -345,6 +390,214 @@ class TestCorpus(unittest.TestCase):
             self.resource.get_token_order([i2, i1]),
             [i1, i2])
 
+    def test_get_token_order_frequencies(self):
+        """
+        Test ordering by the frequencies from the frequency table
+        """
+        class FrequencyResource(self.resource):
+            db_name = "coq_test_frequencies"
+            frequency_word_table = "CorpusFrequencyWord"
+
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        engine.execute("CREATE TABLE CorpusFrequencyWord (Label, Frequency)")
+        engine.executemany("INSERT INTO CorpusFrequencyWord VALUES (?, ?)",
+                           [("the", 100), ("of", 50), ("sorrow", 1),
+                            ("sorry", 3)])
+
+        connection = SQLiteConnection("test", "")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg.current_connection = connection
+
+        l = [(0, (1, "the")), (1, (2, "*")), (2, (3, "[n*]")),
+             (3, (4, "of")), (4, (5, "sorr*"))]
+        order = FrequencyResource.get_token_order(l)
+        self.assertListEqual([x[1][1] for x in order],
+                             ["sorr*", "of", "the", "[n*]", "*"])
+        self.assertEqual(FrequencyResource.estimate_token_frequency("sorr*"),
+                         4)
+        self.assertEqual(FrequencyResource.estimate_token_frequency("~of"),
+                         None)
+
+        # estimates are cached until the cache is cleared:
+        engine.execute("UPDATE CorpusFrequencyWord SET Frequency = 1")
+        self.assertEqual(FrequencyResource.estimate_token_frequency("the"),
+                         100)
+        FrequencyResource.clear_token_frequency_cache(
+            FrequencyResource.db_name)
+        self.assertEqual(FrequencyResource.estimate_token_frequency("the"),
+                         1)
+
+    def test_estimate_token_frequency_no_table(self):
+        """
+        Test that corpora without frequency tables are not estimated
+        """
+        class CountResource(self.resource):
+            db_name = "coq_test_count"
+
+        engine = MockQueryEngine()
+        connection = SQLiteConnection("test", "")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg.current_connection = connection
+
+        self.assertEqual(CountResource.estimate_token_frequency("the"), None)
+        self.assertListEqual(engine.queries, [])
+
+    def test_estimate_token_frequency_mysql(self):
+        """
+        Test the escaping of SQL wildcards on MySQL, and the caching of
+        failed estimates
+        """
+        class FrequencyResource(self.resource):
+            db_name = "coq_test_mysql_frequencies"
+            frequency_word_table = "CorpusFrequencyWord"
+
+        engine = MockQueryEngine()
+        connection = MockConnection(name="test", host="127.0.0.1",
+                                    port=3306, user="coquery",
+                                    password="coquery")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg.current_connection = connection
+        FrequencyResource.clear_token_frequency_cache(
+            FrequencyResource.db_name)
+
+        self.assertEqual(FrequencyResource.estimate_token_frequency("sorr*"),
+                         None)
+        self.assertEqual(len(engine.queries), 1)
+        self.assertIn("LIKE 'sorr%%'", engine.queries[0])
+
+        # the failed estimate is not requested again:
+        self.assertEqual(FrequencyResource.estimate_token_frequency("sorr*"),
+                         None)
+        self.assertEqual(len(engine.queries), 1)
+
+    def test_get_subcorpus_values(self):
+        """
+        Test the lookup of subcorpus sizes and ranges by a grouped query
+        """
+        class SubcorpusResource(self.resource):
+            db_name = "coq_test_subcorpus"
+
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        engine.execute("CREATE TABLE Corpus (ID, WordId, FileId)")
+        engine.execute("CREATE TABLE Files (FileId, Title)")
+        engine.executemany("INSERT INTO Corpus VALUES (?, ?, ?)",
+                           [(1, 1, 1), (2, 2, 1), (3, 1, 2),
+                            (4, 3, 2), (5, 2, 2), (6, 1, 3)])
+        engine.executemany("INSERT INTO Files VALUES (?, ?)",
+                           [(1, "A"), (2, "B"), (3, "C")])
+
+        connection = SQLiteConnection("test", "")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg.current_connection = connection
+
+        corpus = CorpusClass()
+        corpus.resource = SubcorpusResource(None, None)
+        df = pd.DataFrame({"coq_source_label_1": ["B", "A", "B", "D"]},
+                          index=[10, 11, 12, 13])
+
+        sizes = corpus.get_subcorpus_values(df, ["source_label"],
+                                            corpus.SUBCORPUS_SIZE)
+        self.assertListEqual(list(sizes.index), list(df.index))
+        self.assertListEqual(list(sizes), [3, 2, 3, 0])
+        self.assertListEqual(
+            list(corpus.get_subcorpus_values(df, ["source_label"],
+                                             corpus.SUBCORPUS_MIN)),
+            [3, 1, 3, 0])
+        self.assertListEqual(
+            list(corpus.get_subcorpus_values(df, ["source_label"],
+                                             corpus.SUBCORPUS_MAX)),
+            [5, 2, 5, 0])
+
+        # only the values that occur in the data frame are looked up:
+        lookup = corpus.get_subcorpus_table(df, ["source_label"])
+        self.assertListEqual(sorted(lookup["coq_source_label_1"]),
+                             ["A", "B"])
+
+    def test_marginal_tables(self):
+        """
+        Test the lookup of subcorpus sizes from a marginal count table
+        """
+        class MarginalResource(self.resource):
+            db_name = "coq_test_marginal"
+            marginal_source_label_table = "CorpusMarginalSourceLabel"
+
+        self.assertEqual(
+            MarginalResource.get_marginal_table(["source_label"]),
+            "CorpusMarginalSourceLabel")
+        self.assertEqual(
+            MarginalResource.get_marginal_table(["source_label",
+                                                 "speaker_label"]),
+            None)
+
+        # the corpus table is not needed if the marginal table is used:
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        engine.execute("""CREATE TABLE CorpusMarginalSourceLabel
+                          (source_label, Frequency, MinId, MaxId)""")
+        engine.executemany(
+            "INSERT INTO CorpusMarginalSourceLabel VALUES (?, ?, ?, ?)",
+            [("A", 2, 1, 2), ("B", 3, 3, 5), ("C", 1, 6, 6)])
+
+        connection = SQLiteConnection("test", "")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg.current_connection = connection
+
+        corpus = CorpusClass()
+        corpus.resource = MarginalResource(None, None)
+        self.assertEqual(
+            corpus.get_corpus_size([("source_label", ["A", "C"])]), 3)
+        self.assertEqual(corpus.get_corpus_size([("source_label", ["D"])]),
+                         0)
+
+        df = pd.DataFrame({"coq_source_label_1": ["B", "A", "D"]})
+        self.assertListEqual(
+            list(corpus.get_subcorpus_values(df, ["source_label"],
+                                             corpus.SUBCORPUS_SIZE)),
+            [3, 2, 0])
+        self.assertListEqual(
+            list(corpus.get_subcorpus_values(df, ["source_label"],
+                                             corpus.SUBCORPUS_MAX)),
+            [5, 2, 0])
+
+    def test_get_statistics(self):
+        class StatisticsResource(SQLResource):
+            corpus_table = "Corpus"
+            corpus_id = "ID"
+            corpus_word = "Word"
+            corpus_source_id = "FileId"
+            source_table = "Files"
+            source_id = "FileId"
+            source_label = "Title"
+            db_name = "coq_test_statistics"
+            query_item_word = "corpus_word"
+            frequency_word_table = "CorpusFrequencyWord"
+            marginal_source_label_table = "CorpusMarginal1"
+            reverse_word_table = "CorpusReverseWord"
+            trigram_word_table = "CorpusTrigramWord"
+
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        engine.execute("CREATE TABLE Corpus (ID, Word, FileId)")
+        engine.execute("CREATE TABLE Files (FileId, Title)")
+        engine.executemany("INSERT INTO Corpus VALUES (?, ?, ?)",
+                           [(1, "a", 1), (2, "A", 1), (3, "a", 2),
+                            (4, None, 2)])
+        engine.executemany("INSERT INTO Files VALUES (?, ?)",
+                           [(1, "X"), (2, "X")])
+        options.cfg.current_connection = SQLiteConnection("test", "")
+
+        df = StatisticsResource(None, None).get_statistics(engine)
+        df = df.set_index("coquery_invisible_rc_feature")
+        self.assertListEqual(
+            df.loc[["corpus_word", "corpus_source_id", "source_label"],
+                   "coq_statistics_uniques"].tolist(),
+            [3, 2, 1])
+        self.assertListEqual(
+            df.loc[["corpus_word", "source_label"],
+                   "coq_statistics_entries"].tolist(),
+            [4, 2])
+        # the derived lookup tables are not counted:
+        self.assertListEqual(sorted(df["coq_statistics_table"].unique()),
+                             ["Corpus", "Files"])
+
     def test_is_lexical_1(self):
         self.assertTrue(self.resource.is_lexical("word_label"))
         self.assertTrue(self.resource.is_lexical("lemma_label"))
@@ -676,6 +929,152 @@ class TestCorpus(unittest.TestCase):
         self.assertDictEqual(
             d, {"word": ["COQ_WORD_1.Word LIKE '%''ll'"]})
 
+    def test_get_token_conditions_lexicon_ids(self):
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        engine.execute("""
+            CREATE TABLE Lexicon (WordId INT, Word TEXT, POS TEXT,
+                                  LemmaId INT, Transcript TEXT)""")
+        engine.executemany("INSERT INTO Lexicon VALUES (?, ?, ?, 0, '')",
+                           [(1, "able", "j"), (2, "cat", "n"),
+                            (3, "Apple", "n"), (4, "about", "i")])
+
+        connection = SQLiteConnection("test", "")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg.current_connection = connection
+        options.cfg.lexicon_id_limit = 2
+        self.resource.clear_lexicon_id_cache(self.resource.db_name)
+
+        # 'a*' matches more lexicon entries than allowed by the limit:
+        d = self.resource.get_token_conditions(0, COCAToken("a*.[n*]"))
+        self.assertDictEqual(
+            d, {"word": ["COQ_WORD_1.Word LIKE 'a%' COLLATE NOCASE",
+                         "COQ_WORD_1.WordId IN (2, 3)"]})
+
+        d = self.resource.get_token_conditions(0, COCAToken("x*"))
+        self.assertDictEqual(d, {"word": ["1 = 0"]})
+
+        # the ids are cached:
+        engine.execute("INSERT INTO Lexicon VALUES (5, 'xyz', 'n', 0, '')")
+        d = self.resource.get_token_conditions(0, COCAToken("x*"))
+        self.assertDictEqual(d, {"word": ["1 = 0"]})
+        self.resource.clear_lexicon_id_cache(self.resource.db_name)
+        d = self.resource.get_token_conditions(0, COCAToken("x*"))
+        self.assertDictEqual(d, {"word": ["COQ_WORD_1.WordId IN (5)"]})
+
+    def test_get_lexicon_ids_mysql(self):
+        """
+        Test the escaping of SQL wildcards on MySQL, and the caching of
+        failed lookups
+        """
+        engine = MockQueryEngine()
+        connection = MockConnection(name="test", host="127.0.0.1",
+                                    port=3306, user="coquery",
+                                    password="coquery")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg.current_connection = connection
+        options.cfg.lexicon_id_limit = 2
+        self.resource.clear_lexicon_id_cache(self.resource.db_name)
+        self.addCleanup(self.resource.clear_lexicon_id_cache,
+                        self.resource.db_name)
+
+        condition = "Lexicon.Word LIKE 'a%'"
+        self.assertEqual(
+            self.resource.get_lexicon_ids("word", condition), None)
+        self.assertEqual(len(engine.queries), 1)
+        self.assertIn("LIKE 'a%%'", engine.queries[0])
+
+        # the failed lookup is not requested again:
+        self.assertEqual(
+            self.resource.get_lexicon_ids("word", condition), None)
+        self.assertEqual(len(engine.queries), 1)
+
+    def test_get_pattern_prefilter(self):
+        class PatternResource(self.resource):
+            reverse_word_table = "CorpusReverseWord"
+            trigram_word_table = "CorpusTrigramWord"
+
+        alias = "COQ_WORD_1.WordId"
+        self.assertEqual(
+            PatternResource.get_pattern_prefilter(
+                QUERY_ITEM_WORD, "*ISM", alias),
+            "COQ_WORD_1.WordId IN (SELECT Id FROM CorpusReverseWord "
+            "WHERE Label LIKE 'msi%')")
+        self.assertEqual(
+            PatternResource.get_pattern_prefilter(
+                QUERY_ITEM_WORD, "*atio*", alias),
+            "COQ_WORD_1.WordId IN (SELECT Id FROM CorpusTrigramWord "
+            "WHERE Label = 'ati') AND "
+            "COQ_WORD_1.WordId IN (SELECT Id FROM CorpusTrigramWord "
+            "WHERE Label = 'tio')")
+        # quotes are escaped only once, and the trigrams are taken from
+        # the unescaped literals:
+        self.assertEqual(
+            PatternResource.get_pattern_prefilter(
+                QUERY_ITEM_WORD, COCAToken("*'ll").word_specifiers[0], alias),
+            "COQ_WORD_1.WordId IN (SELECT Id FROM CorpusReverseWord "
+            "WHERE Label LIKE 'll''%')")
+        self.assertEqual(
+            PatternResource.get_pattern_prefilter(
+                QUERY_ITEM_WORD, COCAToken("*o'c*").word_specifiers[0],
+                alias),
+            "COQ_WORD_1.WordId IN (SELECT Id FROM CorpusTrigramWord "
+            "WHERE Label = 'o''c')")
+        # the corpus doesn't provide the lookup tables:
+        self.assertEqual(
+            self.resource.get_pattern_prefilter(
+                QUERY_ITEM_WORD, "*ism", alias), None)
+        for spec in ["un*", "*at*", "ism", "*a_b"]:
+            self.assertEqual(
+                PatternResource.get_pattern_prefilter(
+                    QUERY_ITEM_WORD, spec, alias), None)
+        # there is no lookup table for lemmas:
+        self.assertEqual(
+            PatternResource.get_pattern_prefilter(
+                QUERY_ITEM_LEMMA, "*ism", alias), None)
+
+        d = PatternResource.get_token_conditions(0, COCAToken("*ism"))
+        self.assertDictEqual(
+            d, {"word": ["(COQ_WORD_1.WordId IN (SELECT Id FROM "
+                         "CorpusReverseWord WHERE Label LIKE 'msi%')) AND "
+                         "(COQ_WORD_1.Word LIKE '%ism')"]})
+
+    def test_get_token_conditions_regexp(self):
+        options.cfg.regexp = True
+        self.addCleanup(setattr, options.cfg, "regexp", False)
+        token = COCAToken("^wa")
+        d = self.resource.get_token_conditions(0, token)
+        self.assertDictEqual(
+            d, {"word": ["COQ_WORD_1.Word REGEXP '^wa'"]})
+
+        options.cfg.current_connection = SQLiteConnection("test", "")
+        d = self.resource.get_token_conditions(0, token)
+        self.assertDictEqual(
+            d, {"word": ["COQ_WORD_1.Word REGEXP '(?i)^wa' COLLATE NOCASE"]})
+
+        options.cfg.query_case_sensitive = True
+        self.addCleanup(setattr, options.cfg, "query_case_sensitive", False)
+        d = self.resource.get_token_conditions(0, token)
+        self.assertDictEqual(
+            d, {"word": ["COQ_WORD_1.Word REGEXP '^wa' COLLATE BINARY"]})
+
+    def test_is_part_of_speech_regexp(self):
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        _register_sqlite_functions(engine, None)
+        engine.execute("CREATE TABLE Lexicon (WordId INT, POS TEXT)")
+        engine.execute("INSERT INTO Lexicon VALUES (1, 'NN1')")
+
+        connection = SQLiteConnection("test", "")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg.current_connection = connection
+        options.cfg.regexp = True
+        self.addCleanup(setattr, options.cfg, "regexp", False)
+
+        resource = self.resource(None, None)
+        self.assertTrue(resource.is_part_of_speech("nn.*"))
+        options.cfg.query_case_sensitive = True
+        self.addCleanup(setattr, options.cfg, "query_case_sensitive", False)
+        self.assertFalse(resource.is_part_of_speech("nn.*"))
+
     def test_get_token_conditions_negated_1(self):
         token = COCAToken("~a*")
         d = self.resource.get_token_conditions(0, token)
@@ -1295,6 +1694,274 @@ class TestCorpus(unittest.TestCase):
         self.assertEqual(simple(context_string),
                          simple(target_string))
 
+    def test_get_context_range_string(self):
+        target_string = """
+            SELECT     COQ_WORD_1.Word AS Context,
+                       COQ_CORPUS_1.ID1 AS coquery_invisible_corpus_id,
+                       COQ_CORPUS_1.FileId1 AS coquery_invisible_origin_id,
+                       COQ_CORPUS_1.Sentence1 AS coquery_invisible_sentence_id
+            FROM (SELECT End AS End1,
+                         FileId AS FileId1,
+                         ID AS ID1,
+                         Sentence AS Sentence1,
+                         Start AS Start1,
+                         WordId AS WordId1
+                  FROM   Corpus) AS COQ_CORPUS_1
+
+            INNER JOIN Lexicon AS COQ_WORD_1
+                    ON COQ_WORD_1.WordId = WordId1
+            WHERE      (COQ_CORPUS_1.FileId1 = 1 AND
+                        (COQ_CORPUS_1.ID1 BETWEEN 95 AND 105 OR
+                         COQ_CORPUS_1.ID1 BETWEEN 200 AND 210)) OR
+                       (COQ_CORPUS_1.FileId1 = 2 AND
+                        (COQ_CORPUS_1.ID1 BETWEEN 300 AND 310))
+            LIMIT 33"""
+        context_string = self.flat_resource.get_context_range_string(
+            self.flat_resource,
+            [(1, 95, 105), (1.0, 200, 210), (2, 300, 310)])
+        self.assertEqual(simple(context_string),
+                         simple(target_string))
+
+    def test_get_context_batch(self):
+        options.cfg.verbose = False
+        connection = MockDBConnection()
+        connection.execute("""
+            CREATE TABLE Corpus (ID INT, WordId INT, FileId INT,
+                                 Start REAL, End REAL, Sentence INT)""")
+        connection.execute("""
+            CREATE TABLE Lexicon (WordId INT, Word TEXT, POS TEXT,
+                                  Lemma TEXT)""")
+        for i in range(20):
+            connection.execute(
+                "INSERT INTO Lexicon VALUES ({0}, 'w{0}', 'N', 'w')"
+                .format(i))
+            connection.execute(
+                "INSERT INTO Corpus VALUES ({}, {}, {}, 0, 0, {})"
+                .format(i, i, i // 10, i // 5 + 1))
+
+        token_ids = [1, 3, 12, 9, 5]
+        origin_ids = [0, 0, 1, 0.0, float("nan")]
+        widths = [1, 2, 1, 1, 1]
+        resource = self.flat_resource(None, CorpusClass())
+        contexts = resource.get_context_batch(
+            token_ids, origin_ids, widths,
+            connection, left=3, right=2)
+        self.assertListEqual(
+            contexts,
+            [(["", "", "w0"], ["w1"], ["w2", "w3"]),
+             (["w0", "w1", "w2"], ["w3", "w4"], ["w5", "w6"]),
+             (["", "w10", "w11"], ["w12"],
+              ["w13", "w14"]),
+             (["w6", "w7", "w8"], ["w9"], ["", ""]),
+             ([None] * 3, [None], [None] * 2)])
+
+        contexts = resource.get_context_batch(
+            token_ids[:2], origin_ids[:2],
+            widths[:2], connection, sentence_ids=[1, 1],
+            left=3, right=2, chunk_size=1)
+        self.assertListEqual(
+            contexts,
+            [(["", "", "w0"], ["w1"], ["w2", "w3"]),
+             (["w0", "w1", "w2"], ["w3", "w4"], ["", ""])])
+
+    def test_get_frequency_list_string(self):
+        S = self.flat_resource.get_frequency_list_string(["the", "don''t"])
+        target = """
+            SELECT COQ_ITEMS.coq_item AS coq_item,
+                   COUNT(*) AS coq_frequency
+            FROM (SELECT End AS End1, FileId AS FileId1, ID AS ID1,
+                         Sentence AS Sentence1, Start AS Start1,
+                         WordId AS WordId1
+                  FROM Corpus) AS COQ_CORPUS_1
+            INNER JOIN Lexicon AS COQ_WORD_1
+                    ON COQ_WORD_1.WordId = WordId1
+            INNER JOIN (SELECT 'the' AS coq_item
+                        UNION ALL SELECT 'don''t' AS coq_item) AS COQ_ITEMS
+                    ON COQ_WORD_1.Word = COQ_ITEMS.coq_item
+            GROUP BY COQ_ITEMS.coq_item"""
+        self.assertEqual(simple(S).replace("( ", "("),
+                         simple(target).replace("( ", "("))
+
+    def test_get_frequencies(self):
+        options.cfg.verbose = False
+        options.cfg.current_connection = SQLiteConnection("test", "")
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        engine.execute("""
+            CREATE TABLE Corpus (ID INT, WordId INT, FileId INT,
+                                 Start REAL, End REAL, Sentence INT)""")
+        engine.execute("""
+            CREATE TABLE Lexicon (WordId INT, Word TEXT, POS TEXT,
+                                  Lemma TEXT)""")
+        engine.executemany("INSERT INTO Lexicon VALUES (?, ?, 'N', '')",
+                           [(1, "the"), (2, "The"), (3, "dog"),
+                            (4, "don't"), (5, "dot")])
+        engine.executemany("INSERT INTO Corpus VALUES (?, ?, 0, 0, 0, 1)",
+                           enumerate([1, 3, 2, 1, 4, 5, 3, 1]))
+
+        corpus = CorpusClass()
+        corpus.resource = self.flat_resource(None, corpus)
+        corpus._frequency_cache = {}
+        # asterisks are escaped, so 'do*' is looked up as a literal string
+        # by get_frequency():
+        freqs = corpus.get_frequencies(
+            ["the", "dog ", "THE", "the", "cat", "don't", "do*"], engine)
+        self.assertDictEqual(freqs,
+                             {"the": 4, "dog ": 2, "THE": 4, "cat": 0,
+                              "don't": 1, "do*": 0})
+
+        options.cfg.query_case_sensitive = True
+        self.addCleanup(setattr, options.cfg, "query_case_sensitive", False)
+        freqs = corpus.get_frequencies(["the", "The", "THE"], engine)
+        self.assertDictEqual(freqs, {"the": 3, "The": 1, "THE": 0})
+
+    def test_quantified_query_string(self):
+        options.cfg.current_connection = SQLiteConnection("test", "")
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        engine.execute("""
+            CREATE TABLE Corpus (ID INT, WordId INT, FileId INT,
+                                 Start REAL, End REAL, Sentence INT)""")
+        engine.execute("""
+            CREATE TABLE Lexicon (WordId INT, Word TEXT, POS TEXT,
+                                  Lemma TEXT)""")
+        engine.executemany("INSERT INTO Lexicon VALUES (?, ?, 'N', '')",
+                           [(1, "the"), (2, "old"), (3, "dog"), (4, "big")])
+        engine.executemany("INSERT INTO Corpus VALUES (?, ?, 0, 0, 0, 1)",
+                           enumerate([1, 3, 1, 2, 3, 1, 4, 2, 3, 1, 2]))
+
+        query = TokenQuery("the *{0,2} dog", self.Session)
+        self.assertEqual(len(query.query_list), 3)
+
+        S = self.flat_resource.get_quantified_query_string(
+            query.query_list, ["word_label"])
+        self.assertEqual(S.count("UNION ALL"), 2)
+        # the rows for the anchor are only looked up once:
+        self.assertTrue(S.startswith("WITH COQ_ANCHOR AS"))
+        self.assertEqual(S.count("'the'"), 1)
+        df = pd.read_sql(S, engine)
+
+        frames = []
+        for query_items in query.query_list:
+            frame = pd.read_sql(
+                self.flat_resource.get_query_string(query_items,
+                                                     ["word_label"]),
+                engine)
+            frame["coquery_invisible_number_of_tokens"] = len(
+                [x for _, x in query_items if x])
+            frames.append(frame)
+        target = pd.concat(frames, ignore_index=True)
+
+        self.assertListEqual(
+            sorted(df["coquery_invisible_corpus_id"]), [0, 2, 5])
+        pd.testing.assert_frame_equal(
+            df.sort_values("coquery_invisible_corpus_id")
+              .reset_index(drop=True),
+            target.sort_values("coquery_invisible_corpus_id")
+                  .reset_index(drop=True))
+
+    def test_aggregated_query_string(self):
+        options.cfg.current_connection = SQLiteConnection("test", "")
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        engine.execute("""
+            CREATE TABLE Corpus (ID INT, WordId INT, FileId INT,
+                                 Start REAL, End REAL, Sentence INT)""")
+        engine.execute("""
+            CREATE TABLE Lexicon (WordId INT, Word TEXT, POS TEXT,
+                                  Lemma TEXT)""")
+        engine.executemany("INSERT INTO Lexicon VALUES (?, ?, 'N', '')",
+                           [(1, "the"), (2, "The"), (3, "dog")])
+        engine.executemany("INSERT INTO Corpus VALUES (?, ?, ?, 0, 0, 1)",
+                           [(0, 1, 2), (1, 3, 2), (2, 2, 1),
+                            (3, 1, 1), (4, 3, 1), (5, 1, 3)])
+
+        query_list = [[(1, "*")]]
+        S = self.flat_resource.get_aggregated_query_string(
+            query_list, ["word_label"])
+        df = (pd.read_sql(S, engine)
+                .sort_values("coq_word_label_1")
+                .reset_index(drop=True))
+        self.assertListEqual(list(df["coq_word_label_1"]),
+                             ["The", "dog", "the"])
+        self.assertListEqual(list(df["coquery_invisible_row_count"]),
+                             [1, 2, 3])
+        self.assertListEqual(list(df["coquery_invisible_corpus_id"]),
+                             [2, 1, 0])
+        self.assertListEqual(list(df["coquery_invisible_origin_id"]),
+                             [1, 1, 1])
+
+        options.cfg.current_connection = default_connection
+        S = self.flat_resource.get_aggregated_query_string(
+            query_list, ["word_label"])
+        self.assertIn("MIN(coq_word_label_1) AS coq_word_label_1", S)
+        self.assertIn("GROUP BY BINARY coq_word_label_1", S)
+
+    def test_aggregated_quantified_query_string(self):
+        options.cfg.current_connection = SQLiteConnection("test", "")
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        engine.execute("""
+            CREATE TABLE Corpus (ID INT, WordId INT, FileId INT,
+                                 Start REAL, End REAL, Sentence INT)""")
+        engine.execute("""
+            CREATE TABLE Lexicon (WordId INT, Word TEXT, POS TEXT,
+                                  Lemma TEXT)""")
+        engine.executemany("INSERT INTO Lexicon VALUES (?, ?, 'N', '')",
+                           [(1, "the"), (2, "old"), (3, "dog"), (4, "big")])
+        engine.executemany("INSERT INTO Corpus VALUES (?, ?, 0, 0, 0, 1)",
+                           enumerate([1, 3, 1, 2, 3, 1, 2, 3, 1, 3]))
+
+        query = TokenQuery("the *{0,1} dog", self.Session)
+        S = self.flat_resource.get_aggregated_query_string(
+            query.query_list, ["word_label"])
+        df = (pd.read_sql(S, engine)
+                .sort_values("coquery_invisible_corpus_id")
+                .reset_index(drop=True))
+
+        self.assertListEqual(list(df["coq_word_label_2"]), [None, "old"])
+        self.assertListEqual(list(df["coquery_invisible_row_count"]), [2, 2])
+        self.assertListEqual(
+            list(df["coquery_invisible_number_of_tokens"]), [2, 3])
+        self.assertListEqual(list(df["coquery_invisible_corpus_id"]), [0, 2])
+
+    def test_get_frequency_list_string_table(self):
+        class FrequencyResource(self.flat_resource):
+            frequency_word_table = "CorpusFrequencyWord"
+
+        S = FrequencyResource.get_frequency_list_string(["the", "a"])
+        target = """
+            SELECT COQ_ITEMS.coq_item AS coq_item,
+                   SUM(CorpusFrequencyWord.Frequency) AS coq_frequency
+            FROM CorpusFrequencyWord
+            INNER JOIN (SELECT 'the' AS coq_item
+                        UNION ALL SELECT 'a' AS coq_item) AS COQ_ITEMS
+                    ON CorpusFrequencyWord.Label = COQ_ITEMS.coq_item
+            GROUP BY COQ_ITEMS.coq_item"""
+        self.assertEqual(simple(S).replace("( ", "("),
+                         simple(target).replace("( ", "("))
+        self.assertEqual(
+            FrequencyResource.get_frequency_table(QUERY_ITEM_LEMMA), None)
+
+    def test_get_label_frequencies(self):
+        class FrequencyResource(self.flat_resource):
+            frequency_word_table = "CorpusFrequencyWord"
+
+        options.cfg.verbose = False
+        options.cfg.current_connection = SQLiteConnection("test", "")
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        engine.execute("CREATE TABLE CorpusFrequencyWord (Label, Frequency)")
+        engine.executemany("INSERT INTO CorpusFrequencyWord VALUES (?, ?)",
+                           [("the", 3), ("The", 1), ("do*", 2),
+                            ("don't", 1)])
+
+        corpus = CorpusClass()
+        corpus.resource = FrequencyResource(None, corpus)
+        corpus._frequency_cache = {}
+        freqs = corpus.get_label_frequencies(
+            ["the", "do*", "cat", "don't", "the"], engine)
+        self.assertDictEqual(freqs,
+                             {"the": 4, "do*": 2, "cat": 0, "don't": 1})
+        self.assertRaises(UnsupportedQueryItemError,
+                          corpus.get_label_frequencies,
+                          ["the"], engine, QUERY_ITEM_TRANSCRIPT)
+
 
 class TestSuperFlat(unittest.TestCase):
     """
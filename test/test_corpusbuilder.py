@@ -3,17 +3,25 @@
 from __future__ import print_function
 import unittest
 import sys
+import sqlite3
 import tempfile
+import shutil
 import os
 import argparse
 
-from coquery.defines import SQL_SQLITE
+import pandas as pd
+
+from coquery.defines import SQL_SQLITE, SQL_MYSQL
 from coquery.coquery import options
 from coquery.corpusbuilder import (
     BaseCorpusBuilder, XMLCorpusBuilder, TEICorpusBuilder)
 from coquery.tables import Table, Column, Identifier, Link
+from coquery.connections import SQLiteConnection
+from coquery.sqlwrap import SqlDB
+from coquery.tokens import COCAToken
 
 from .test_corpora import simple
+from .test_tables import MockEngine
 
 options.cfg = argparse.Namespace()
 
@@ -298,14 +306,37 @@ class TestCorpusNgram(unittest.TestCase):
         self.assertEqual(
             l, ["ID1", "FileId1", "WordId1", "WordId2", "WordId3"])
 
-    def test_get_ngram_padding_1(self):
-        s = self.builder.build_lookup_get_padding_string()
-        self.assertEqual(simple(s),
-                         simple("""
-        INSERT INTO CorpusNgram (ID1, FileId1, WordId1, WordId2, WordId3)
-        VALUES ({last_row} + 1, {FileId1}, {WordId2}, {WordId3}, {na_value}),
-               ({last_row} + 2, {FileId1}, {WordId3}, {na_value}, {na_value})
-               """))
+    def test_get_ngram_chunk(self):
+        df = pd.DataFrame({"ID": [1, 2, 3, 4, 5],
+                           "FileId": [1, 1, 1, 2, 2],
+                           "WordId": [10, 11, 12, 13, 14]})
+        chunk = self.builder.build_lookup_get_ngram_chunk(df, 4, 99)
+        self.assertListEqual(
+            chunk.columns.tolist(),
+            ["ID1", "FileId1", "WordId1", "WordId2", "WordId3"])
+        self.assertListEqual(
+            chunk.values.tolist(),
+            [[1, 1, 10, 11, 12],
+             [2, 1, 11, 12, 13],
+             [3, 1, 12, 13, 14]])
+
+        # the end of the corpus is padded with the NA value:
+        chunk = self.builder.build_lookup_get_ngram_chunk(df.iloc[3:], 6, 99)
+        self.assertListEqual(
+            chunk.values.tolist(),
+            [[4, 2, 13, 14, 99],
+             [5, 2, 14, 99, 99]])
+
+    def test_get_ngram_chunk_gap(self):
+        df = pd.DataFrame({"ID": [1, 2, 4],
+                           "FileId": [1, 1, 1],
+                           "WordId": [10, 11, 13]})
+        chunk = self.builder.build_lookup_get_ngram_chunk(df, 5, 99)
+        self.assertListEqual(
+            chunk.values.tolist(),
+            [[1, 1, 10, 11, 99],
+             [2, 1, 11, 99, 13],
+             [4, 1, 13, 99, 99]])
 
     def test_get_ngram_table(self):
         corpus_table = Table(self.builder.corpus_table)
@@ -328,34 +359,429 @@ class TestCorpusNgram(unittest.TestCase):
                          WordId3 INT(7)
                          """))
 
-    def test_get_insert_string(self):
+
+class TestFrequencyTables(unittest.TestCase):
+    def setUp(self):
         options.cfg.no_ngram = False
-        s1 = self.builder.build_lookup_get_insert_string()
-        s2 = """
-            INSERT INTO CorpusNgram (ID1, FileId1, WordId1, WordId2, WordId3)
-            SELECT ID1, FileId1, WordId1, WordId2, WordId3
-            FROM    (SELECT FileId AS FileId1, ID AS ID1, WordId AS WordId1
-                     FROM   Corpus) AS COQ_CORPUS_1
-            INNER JOIN
-                    (SELECT FileId AS FileId2, ID AS ID2, WordId AS WordId2
-                     FROM   Corpus) AS COQ_CORPUS_2 ON ID2 = ID1 + 1
-            INNER JOIN
-                    (SELECT FileId AS FileId3, ID AS ID3, WordId AS WordId3
-                     FROM   Corpus) AS COQ_CORPUS_3 ON ID3 = ID1 + 2"""
-
-        self.assertEqual(simple(s1), simple(s2))
-
-
-class TestFlatCorpusBuilder(unittest.TestCase):
-    def test_get_ngram_padding_1(self):
-        self.builder = NGramBuilderFlat()
-        s = self.builder.build_lookup_get_padding_string()
+        options.cfg.experimental = False
+
+    def test_get_insert_string_lexicon(self):
+        builder = NgramBuilder()
+        s = builder.build_frequency_get_insert_string(
+            "word_label", "CorpusFrequencyWord", SQL_MYSQL)
         self.assertEqual(simple(s),
                          simple("""
-        INSERT INTO CorpusNgram (ID1, FileId1, POS1, POS2, POS3, Word1, Word2, Word3)
-        VALUES ({last_row} + 1, {FileId1}, {POS2}, {POS3}, {na_value},{WordId2}, {WordId3}, {na_value}),
-               ({last_row} + 2, {FileId1}, {POS3}, {na_value}, {na_value}, {WordId3}, {na_value}, {na_value})
-               """))
+            INSERT INTO CorpusFrequencyWord (Label, Frequency)
+            SELECT MIN(COQ_WORD_1.Word), COUNT(*)
+            FROM (SELECT FileId AS FileId1, ID AS ID1, WordId AS WordId1
+                  FROM Corpus) AS COQ_CORPUS_1
+            INNER JOIN Lexicon AS COQ_WORD_1
+                    ON COQ_WORD_1.WordId = WordId1
+            GROUP BY BINARY COQ_WORD_1.Word""").replace("( ", "("))
+
+    def test_get_insert_string_flat(self):
+        builder = NGramBuilderFlat()
+        s = builder.build_frequency_get_insert_string(
+            "corpus_word", "CorpusFrequencyWord", SQL_SQLITE)
+        self.assertEqual(simple(s),
+                         simple("""
+            INSERT INTO CorpusFrequencyWord (Label, Frequency)
+            SELECT Word1, COUNT(*)
+            FROM (SELECT ID AS ID1, POS AS POS1, Word AS Word1
+                  FROM Corpus) AS COQ_CORPUS_1
+            GROUP BY Word1""").replace("( ", "("))
+
+
+class TestMarginalTables(unittest.TestCase):
+    def setUp(self):
+        options.cfg.no_ngram = False
+        options.cfg.experimental = False
+
+    def test_get_marginal_features(self):
+        builder = NgramBuilder()
+        self.assertListEqual(builder.get_marginal_features(),
+                             [("source_label",)])
+        self.assertListEqual(NGramBuilderFlat().get_marginal_features(), [])
+
+    def test_get_insert_string(self):
+        builder = NgramBuilder()
+        s = builder.build_marginal_get_insert_string(
+            ("source_label",), "CorpusMarginalSourceLabel", SQL_MYSQL)
+        self.assertEqual(simple(s),
+                         simple("""
+            INSERT INTO CorpusMarginalSourceLabel
+                        (source_label, Frequency, MinId, MaxId)
+            SELECT MIN(COQ_SOURCE_1.Title), COUNT(*), MIN(ID1), MAX(ID1)
+            FROM (SELECT FileId AS FileId1, ID AS ID1, WordId AS WordId1
+                  FROM Corpus) AS COQ_CORPUS_1
+            INNER JOIN Files AS COQ_SOURCE_1
+                    ON COQ_SOURCE_1.FileId = FileId1
+            GROUP BY BINARY COQ_SOURCE_1.Title""").replace("( ", "("))
+
+    def test_insert_counts(self):
+        builder = NgramBuilder()
+        s = builder.build_marginal_get_insert_string(
+            ("source_label",), "CorpusMarginalSourceLabel", SQL_SQLITE)
+
+        con = sqlite3.connect(":memory:")
+        con.execute("CREATE TABLE Corpus (ID, WordId, FileId)")
+        con.execute("CREATE TABLE Files (FileId, Title)")
+        con.execute("""CREATE TABLE CorpusMarginalSourceLabel
+                       (source_label, Frequency, MinId, MaxId)""")
+        con.executemany("INSERT INTO Corpus VALUES (?, ?, ?)",
+                        [(1, 1, 1), (2, 2, 1), (3, 1, 2), (4, 3, 2)])
+        con.executemany("INSERT INTO Files VALUES (?, ?)",
+                        [(1, "A"), (2, "B")])
+        con.execute(s)
+        self.assertListEqual(
+            con.execute("""SELECT * FROM CorpusMarginalSourceLabel
+                           ORDER BY source_label""").fetchall(),
+            [("A", 2, 1, 2), ("B", 2, 3, 4)])
+
+
+class TestParallelLoad(unittest.TestCase):
+    def setUp(self):
+        options.cfg.no_ngram = False
+        options.cfg.experimental = False
+
+    @staticmethod
+    def process(builder, file_name, words):
+        """
+        Simulate the processing of a file in a worker process.
+        """
+        builder._corpus_id = 0
+        builder._corpus_buffer = []
+        file_id = builder.table(builder.source_table).get_or_insert(
+            {builder.source_label: file_name})
+        for word in words:
+            word_id = builder.table(builder.word_table).get_or_insert(
+                {builder.word_label: word})
+            builder._corpus_id += 1
+            builder._corpus_buffer.append(
+                {builder.corpus_id: builder._corpus_id,
+                 builder.corpus_word_id: word_id,
+                 builder.corpus_source_id: file_id})
+        records = {name: table.take_records()
+                   for name, table in builder._new_tables.items()}
+        return records, builder._corpus_buffer, builder._corpus_id
+
+    def test_get_merge_order(self):
+        order = NgramBuilder().get_merge_order()
+        self.assertLess(order.index("Lexicon"), order.index("Corpus"))
+        self.assertLess(order.index("Files"), order.index("Corpus"))
+
+    def test_merge_file_records(self):
+        workers = [NgramBuilder(), NgramBuilder()]
+        for worker in workers:
+            for table in worker._new_tables.values():
+                table.start_recording()
+
+        builder = NgramBuilder()
+        builder.merge_file_records(
+            1, *self.process(workers[0], "f1", ["a", "b"]))
+        builder.merge_file_records(
+            2, *self.process(workers[1], "f2", ["b", "c", "b"]))
+        builder.merge_file_records(
+            1, *self.process(workers[0], "f3", ["c", "a"]))
+
+        self.assertListEqual(builder.table("Lexicon")._add_cache,
+                             [(1, "a"), (2, "b"), (3, "c")])
+        self.assertListEqual(builder.table("Files")._add_cache,
+                             [(1, "f1"), (2, "f2"), (3, "f3")])
+        self.assertListEqual(
+            [(x["ID"], x["WordId"], x["FileId"])
+             for x in builder._corpus_buffer],
+            [(1, 1, 1), (2, 2, 1),
+             (3, 2, 2), (4, 3, 2), (5, 2, 2),
+             (6, 3, 3), (7, 1, 3)])
+        self.assertEqual(builder._corpus_id, 7)
+
+    def test_get_load_pool(self):
+        class MockConnection(object):
+            def __init__(self, log):
+                self.log = log
+
+            def execute(self, S):
+                self.log.append(S)
+
+            def close(self):
+                self.log.append("close")
+
+        class MockPoolEngine(object):
+            def __init__(self):
+                self.log = []
+
+            def connect(self):
+                self.log.append("connect")
+                return MockConnection(self.log)
+
+            def dispose(self):
+                self.log.append("dispose")
+
+        if sys.platform == "darwin" or sys.platform.startswith("win"):
+            raise unittest.SkipTest
+
+        engine = MockPoolEngine()
+        builder = NgramBuilder()
+        builder._parallel_load = True
+        builder.arguments = argparse.Namespace(workers=2)
+        builder.DB = argparse.Namespace(db_type=SQL_SQLITE, engine=engine,
+                                        connection=MockConnection(engine.log))
+        pool = builder.get_load_pool()
+        try:
+            self.assertNotEqual(pool.apply(os.getpid), os.getpid())
+        finally:
+            pool.terminate()
+            pool.join()
+
+        # the connection is closed before the worker processes are forked,
+        # and the new connection is set up again:
+        self.assertListEqual(engine.log,
+                             ["close", "dispose", "connect",
+                              "PRAGMA journal_mode=OFF",
+                              "PRAGMA synchronous=OFF"])
+
+
+class ResumeBuilder(BaseCorpusBuilder):
+    word_table = "Lexicon"
+    word_id = "WordId"
+    word_label = "Word"
+    word_columns = [
+        Identifier(word_id, "INT"),
+        Column(word_label, "VARCHAR(32)")]
+
+    file_table = "Files"
+    file_id = "FileId"
+    file_name = "Filename"
+    file_path = "Path"
+    file_columns = [
+        Identifier(file_id, "INT"),
+        Column(file_name, "VARCHAR(32)"),
+        Column(file_path, "VARCHAR(255)")]
+
+    corpus_table = "Corpus"
+    corpus_id = "ID"
+    corpus_word_id = "WordId"
+    corpus_file_id = "FileId"
+    corpus_columns = [
+        Identifier(corpus_id, "INT"),
+        Link(corpus_word_id, word_table),
+        Link(corpus_file_id, file_table)]
+
+    auto_create = ["word", "file", "corpus"]
+
+    # the name of the file that raises an exception after its first word:
+    fail_file = None
+
+    def process_file(self, file_name):
+        with open(file_name) as input_file:
+            words = input_file.read().split()
+        for word in words:
+            word_id = self.table(self.word_table).get_or_insert(
+                {self.word_label: word})
+            self.add_token_to_corpus(
+                {self.corpus_word_id: word_id,
+                 self.corpus_file_id: self._file_id})
+            if os.path.basename(file_name) == self.fail_file:
+                raise RuntimeError("Interrupted")
+
+
+class TestResume(unittest.TestCase):
+    texts = {"a.txt": "the cat sat",
+             "b.txt": "the dog",
+             "c.txt": "a cat and a dog",
+             "d.txt": "the end"}
+
+    def setUp(self):
+        options.cfg.no_ngram = False
+        options.cfg.experimental = False
+        self.path = tempfile.mkdtemp()
+        for file_name, text in self.texts.items():
+            with open(os.path.join(self.path, file_name), "w") as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get_builder(self, engine, resume):
+        connection = SQLiteConnection("test", "")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg.current_connection = connection
+        options.cfg.explain_queries = False
+
+        builder = ResumeBuilder()
+        builder.arguments = argparse.Namespace(path=self.path, resume=resume)
+        builder.DB = SqlDB(None, None, SQL_SQLITE, None, None, "test")
+        builder.DB.connection = engine
+        return builder
+
+    @staticmethod
+    def get_content(engine):
+        return [engine.execute("SELECT * FROM {}".format(x)).fetchall()
+                for x in ["Lexicon", "Files", "Corpus"]]
+
+    def test_resume(self):
+        # build the corpus without interruption:
+        engine = sqlite3.connect(":memory:", factory=MockBuildEngine)
+        builder = self.get_builder(engine, False)
+        builder.build_create_tables()
+        builder.build_load_files()
+        builder.commit_data()
+        self.assertFalse(builder.DB.has_table(builder._checkpoint_table))
+        expected = self.get_content(engine)
+
+        # interrupt the build in the third file, after some of its rows
+        # have been committed:
+        engine = sqlite3.connect(":memory:", factory=MockBuildEngine)
+        builder = self.get_builder(engine, True)
+        builder.fail_file = "c.txt"
+        builder.build_create_tables()
+        self.assertRaises(RuntimeError, builder.build_load_files)
+        builder.commit_data()
+        self.assertEqual(len(builder.get_checkpoint()), 2)
+
+        # resume the build with a new builder:
+        builder = self.get_builder(engine, True)
+        builder._loaded_files = builder.restore_checkpoint()
+        self.assertSetEqual(
+            builder._loaded_files,
+            set([os.path.join(self.path, x) for x in ["a.txt", "b.txt"]]))
+        builder.build_load_files()
+        builder.commit_data()
+        builder.remove_checkpoint()
+        self.assertListEqual(self.get_content(engine), expected)
+        self.assertFalse(builder.DB.has_table(builder._checkpoint_table))
+
+
+class IndexBuilder(NgramBuilder):
+    word_pos = "POS"
+    word_columns = [
+        Identifier("WordId", "INT"),
+        Column("Word", "VARCHAR(10)"),
+        Column("POS", "VARCHAR(10)"),
+        Column("Notes", "VARCHAR(10)")]
+
+
+class TestIndices(unittest.TestCase):
+    def setUp(self):
+        options.cfg.no_ngram = False
+        options.cfg.experimental = False
+
+    def test_get_index_list(self):
+        builder = IndexBuilder()
+        self.assertListEqual(
+            sorted(builder.get_index_list()),
+            [("Corpus", "FileId", ["FileId"], None),
+             ("Corpus", "WordId", ["WordId"], None),
+             ("Files", "Title", ["Title"], None),
+             ("Lexicon", "Notes", ["Notes"], None),
+             ("Lexicon", "POS", ["POS"], None),
+             ("Lexicon", "Word", ["Word"], None)])
+
+    def test_get_index_list_used(self):
+        builder = IndexBuilder()
+        builder.arguments = argparse.Namespace(index_mode="used")
+        self.assertListEqual(
+            sorted(builder.get_index_list()),
+            [("Corpus", "FileId", ["FileId"], None),
+             ("Corpus", "WordId", ["WordId"], None),
+             ("Files", "Title", ["Title"], None),
+             ("Lexicon", "POS", ["POS"], None),
+             ("Lexicon", "Word", ["Word"], None),
+             ("Lexicon", "Word_POS_WordId", ["Word", "POS", "WordId"],
+              None)])
+
+    def test_get_composite_indices(self):
+        self.assertListEqual(NgramBuilder().get_composite_indices(), [])
+
+
+class MockBuildEngine(MockEngine):
+    def connect(self):
+        return self
+
+
+class TestPatternTables(unittest.TestCase):
+    def setUp(self):
+        options.cfg.no_ngram = False
+        options.cfg.experimental = False
+
+    def test_get_trigrams(self):
+        df = pd.DataFrame({"Label": ["Abcd", "ab", "bcd"],
+                           "Id": [1, 2, 3]})
+        trigrams = BaseCorpusBuilder.build_pattern_get_trigrams(
+            df, "Label", "Id")
+        self.assertListEqual(
+            trigrams.values.tolist(),
+            [["abc", 1], ["bcd", 1], ["bcd", 3]])
+
+    def test_build_pattern_tables(self):
+        class PatternBuilder(NgramBuilder):
+            _pattern_tables = True
+
+        engine = sqlite3.connect(":memory:", factory=MockBuildEngine)
+        connection = SQLiteConnection("test", "")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg.current_connection = connection
+        options.cfg.explain_queries = False
+
+        builder = PatternBuilder()
+        builder.DB = SqlDB(None, None, SQL_SQLITE, None, None, "test")
+        builder.DB.connection = engine
+        engine.execute("CREATE TABLE Lexicon (WordId INT, Word TEXT)")
+        engine.executemany("INSERT INTO Lexicon VALUES (?, ?)",
+                           [(1, "Realism"), (2, "prism"), (3, "nation"),
+                            (4, None), (5, "ratio")])
+        # read the lexicon in several chunks:
+        builder._pattern_chunk_size = 2
+        builder.build_pattern_tables()
+
+        self.assertEqual(builder.reverse_word_table, "CorpusReverseWord")
+        self.assertEqual(builder.trigram_word_table, "CorpusTrigramWord")
+        self.assertListEqual(
+            engine.execute("""SELECT Id FROM CorpusReverseWord
+                              WHERE Label LIKE 'msi%'
+                              ORDER BY Id""").fetchall(),
+            [(1,), (2,)])
+        self.assertListEqual(
+            engine.execute("""SELECT Id FROM CorpusTrigramWord
+                              WHERE Label = 'ati'
+                              ORDER BY Id""").fetchall(),
+            [(3,), (5,)])
+        self.assertEqual(
+            engine.execute("""SELECT COUNT(*)
+                              FROM CorpusReverseWord""").fetchone(),
+            (4,))
+
+        # query the lexicon through the lookup tables:
+        for name, value in [("regexp", False),
+                            ("query_case_sensitive", False),
+                            ("lexicon_id_limit", 0)]:
+            self.addCleanup(setattr, options.cfg, name,
+                            getattr(options.cfg, name, None))
+            setattr(options.cfg, name, value)
+        for spec, table, ids in [("*ISM", "CorpusReverseWord", [1, 2]),
+                                 ("*ati*", "CorpusTrigramWord", [3, 5]),
+                                 ("*xyz", "CorpusReverseWord", []),
+                                 ("*at*", None, [3, 5])]:
+            d = PatternBuilder.get_token_conditions(0, COCAToken(spec))
+            S = ("SELECT COQ_WORD_1.WordId FROM Lexicon AS COQ_WORD_1 "
+                 "WHERE {} ORDER BY COQ_WORD_1.WordId").format(
+                     " AND ".join(d["word"]))
+            if table:
+                self.assertIn(table, S)
+            else:
+                self.assertNotIn("Corpus", S)
+            self.assertListEqual([x for x, in engine.execute(S)], ids)
+
+    def test_build_pattern_tables_disabled(self):
+        engine = sqlite3.connect(":memory:", factory=MockBuildEngine)
+        builder = NgramBuilder()
+        builder.DB = SqlDB(None, None, SQL_SQLITE, None, None, "test")
+        builder.DB.connection = engine
+        builder.build_pattern_tables()
+        self.assertFalse(hasattr(builder, "reverse_word_table"))
+        self.assertListEqual(
+            engine.execute("SELECT name FROM sqlite_master").fetchall(), [])
 
 
 class TestXMLCorpusBuilder(unittest.TestCase):
@@ -496,7 +922,8 @@ class TestTEICorpusBuilder(TestXMLCorpusBuilder):
         self.assertEqual(len(builder.content), 139)
 
 
-provided_tests = [TestCorpusNgram, TestFlatCorpusBuilder,
+provided_tests = [TestCorpusNgram, TestFrequencyTables, TestMarginalTables,
+                  TestParallelLoad, TestResume, TestIndices, TestPatternTables,
                   TestXMLCorpusBuilder, TestTEICorpusBuilder]
 
 
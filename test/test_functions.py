@@ -111,6 +111,21 @@ class TestFrequencyFunctions(CoqTestCase):
         val = FunctionList([func]).lapply(df, session=None)[func.get_id()]
         self.assertListEqual(val.tolist(), [2, 1, 2, 1, 1])
 
+    def test_freq_with_row_count(self):
+        df = df0.copy()
+        df["coquery_invisible_row_count"] = [3, 1, 2, 5, 4]
+        func = Freq(columns=["coq_word_label_1", "coq_source_genre_1"])
+        val = FunctionList([func]).lapply(df, session=None)[func.get_id()]
+        self.assertListEqual(val.tolist(), [3, 3, 3, 5, 4])
+
+        func = Freq(columns=["coq_word_label_1"])
+        val = FunctionList([func]).lapply(df, session=None)[func.get_id()]
+        self.assertListEqual(val.tolist(), [6, 6, 6, 9, 9])
+
+        func = Freq(columns=[])
+        val = FunctionList([func]).lapply(df, session=None)[func.get_id()]
+        self.assertListEqual(val.tolist(), [15] * 5)
+
 
 class TestStringFunctions(CoqTestCase):
     def test_count_1(self):
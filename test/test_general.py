@@ -15,7 +15,8 @@ import tempfile
 import os
 import numpy as np
 
-from coquery.general import check_fs_case_sensitive, pretty
+from coquery.general import (check_fs_case_sensitive, pretty, merge_ranges,
+                             normalize_sql)
 
 
 class TestGeneral(unittest.TestCase):
@@ -28,6 +29,24 @@ class TestGeneral(unittest.TestCase):
         else:
             raise NotImplementedError
 
+    def test_merge_ranges(self):
+        ranges = [(10, 20), (1, 3), (15, 25), (4, 5), (30, 31)]
+        self.assertListEqual(merge_ranges(ranges),
+                             [(1, 5), (10, 25), (30, 31)])
+
+    def test_merge_ranges_empty(self):
+        self.assertListEqual(merge_ranges([]), [])
+
+    def test_normalize_sql(self):
+        S = """
+            SELECT  Word
+            FROM    Lexicon
+            WHERE   Word = 'a  b' OR Word = 'don''t  '"""
+        self.assertEqual(
+            normalize_sql(S),
+            "SELECT Word FROM Lexicon WHERE Word = 'a  b' OR Word = 'don''t  '")
+
+
 class TestPretty(unittest.TestCase):
     def assertListEqual(self, l1, l2):
         if (any([type(x) == object for x in l1]) or
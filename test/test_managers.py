@@ -5,7 +5,9 @@ import unittest
 import argparse
 import warnings
 
+import numpy as np
 import pandas as pd
+import scipy.stats
 
 from coquery.coquery import options
 from coquery.session import Session
@@ -13,7 +15,8 @@ from coquery.defines import (QUERY_MODE_TOKENS, CONTEXT_NONE,
                              DEFAULT_CONFIGURATION)
 from coquery.connections import SQLiteConnection
 from coquery.corpus import BaseResource
-from coquery.managers import Manager, Group, Summary
+from coquery.managers import (Manager, Group, Summary, ContrastMatrix,
+                              Types, FrequencyList)
 from coquery.functions import Freq, Tokens
 
 
@@ -138,10 +141,97 @@ class TestManager(unittest.TestCase):
             list(df[func.get_id()].values),
             [1] + [1] + [2] * 2 + [2] * 2 + [2] * 2 + [2] * 2)
 
+    def test_frequency_list_aggregates(self):
+        options.cfg.gui = False
+        options.cfg.limit_matches = False
+        manager = FrequencyList()
+        self.assertTrue(manager.accepts_aggregates(self.Session))
+        self.assertFalse(self.manager.accepts_aggregates(self.Session))
+
+        columns = ["coq_word_label_1", "coq_word_label_2"]
+        aggregated = (self.df.groupby(columns)
+                             .agg({"coquery_invisible_corpus_id": "min",
+                                   "coq_word_label_3": "size"})
+                             .rename(columns={"coq_word_label_3":
+                                              "coquery_invisible_row_count"})
+                             .reset_index())
+        aggregated["coquery_invisible_number_of_tokens"] = 1
+
+        df = self.df[columns + ["coquery_invisible_corpus_id",
+                                "coquery_invisible_number_of_tokens"]]
+        target = manager.process(df, session=self.Session)
+        df = manager.process(aggregated, session=self.Session)
+
+        freq = Freq(columns=columns).get_id()
+        self.assertListEqual(
+            list(df.sort_values(columns)[freq]),
+            list(target.sort_values(columns)[freq]))
+
+        options.cfg.gui = True
+        self.assertFalse(manager.accepts_aggregates(self.Session))
+
+    def test_types_aggregates(self):
+        options.cfg.gui = False
+        options.cfg.limit_matches = False
+        manager = Types()
+        self.assertTrue(manager.accepts_aggregates(self.Session))
+        manager.set_groups([Group("Test", ["coq_word_label_1"])])
+        self.assertFalse(manager.accepts_aggregates(self.Session))
+        manager.set_groups([])
+
+        columns = ["coq_word_label_1", "coq_word_label_2"]
+        aggregated = (self.df.groupby(columns)
+                             .agg({"coquery_invisible_corpus_id": "min",
+                                   "coq_word_label_3": "size"})
+                             .rename(columns={"coq_word_label_3":
+                                              "coquery_invisible_row_count"})
+                             .reset_index())
+        aggregated["coquery_invisible_number_of_tokens"] = 1
+
+        df = self.df[columns + ["coquery_invisible_corpus_id",
+                                "coquery_invisible_number_of_tokens"]]
+        target = manager.process(df, session=self.Session)
+        df = manager.process(aggregated, session=self.Session)
+        pd.testing.assert_frame_equal(
+            df[columns].sort_values(columns).reset_index(drop=True),
+            target[columns].sort_values(columns).reset_index(drop=True))
+
+
+class TestContrastMatrix(unittest.TestCase):
+    def test_get_loglikelihood_matrix(self):
+        freq = [10, 0, 25, 7, 3]
+        size = [1000, 500, 1200, 7, 80]
+        g2, p_g2 = ContrastMatrix.get_loglikelihood_matrix(freq, size,
+                                                           chunk_size=2)
+        for r in range(len(freq)):
+            for c in range(len(freq)):
+                obs = [[freq[r], freq[c]],
+                       [size[r] - freq[r], size[c] - freq[c]]]
+                try:
+                    g, p, _, _ = scipy.stats.chi2_contingency(
+                        obs, correction=False, lambda_="log-likelihood")
+                except ValueError:
+                    g, p = 0, 0
+                else:
+                    if freq[r] / size[r] < freq[c] / size[c]:
+                        g = -g
+                self.assertAlmostEqual(g2[r, c], g)
+                self.assertAlmostEqual(p_g2[r, c], p)
+
+    def test_get_loglikelihood_matrix_chunks(self):
+        freq = np.arange(1, 30)
+        size = freq * 10 + np.arange(29) ** 2
+        g2, p_g2 = ContrastMatrix.get_loglikelihood_matrix(freq, size)
+        g2_c, p_g2_c = ContrastMatrix.get_loglikelihood_matrix(freq, size, 4)
+        np.testing.assert_allclose(g2, g2_c)
+        np.testing.assert_allclose(p_g2, p_g2_c)
+        np.testing.assert_allclose(g2, -g2.T)
+
 
 def main():
     suite = unittest.TestSuite([
-        unittest.TestLoader().loadTestsFromTestCase(TestManager)])
+        unittest.TestLoader().loadTestsFromTestCase(TestManager),
+        unittest.TestLoader().loadTestsFromTestCase(TestContrastMatrix)])
     unittest.TextTestRunner().run(suite)
 
 if __name__ == '__main__':
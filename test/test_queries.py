@@ -3,11 +3,15 @@
 from __future__ import print_function
 import unittest
 import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
 
 import pandas as pd
 
 from coquery.coquery import options
-from coquery.queries import TokenQuery
+from coquery.queries import TokenQuery, QueryExecutor, fetch_chunks
 from coquery.session import Session
 from coquery.defines import QUERY_MODE_TOKENS
 
@@ -127,9 +131,109 @@ class TestQueries(unittest.TestCase):
             df.coquery_query_token_3.tolist(), ["item3"] * len(df))
 
 
+class TestFetchChunks(unittest.TestCase):
+    def setUp(self):
+        self.con = sqlite3.connect(":memory:")
+        self.con.execute("CREATE TABLE T (a INT, b TEXT)")
+        self.con.executemany("INSERT INTO T VALUES (?, ?)",
+                             [(i, "x{}".format(i)) for i in range(10)])
+
+    def tearDown(self):
+        self.con.close()
+
+    def test_fetch_chunks(self):
+        results = self.con.execute("SELECT a, b FROM T ORDER BY a")
+        chunks = list(fetch_chunks(results, ["a", "b"], 4))
+        self.assertListEqual([len(df) for df in chunks], [4, 4, 2])
+        df = pd.concat(chunks, ignore_index=True)
+        self.assertListEqual(df["a"].tolist(), list(range(10)))
+        self.assertListEqual(list(df.columns), ["a", "b"])
+
+    def test_fetch_chunks_empty(self):
+        results = self.con.execute("SELECT a, b FROM T WHERE a < 0")
+        chunks = list(fetch_chunks(results, ["a", "b"], 4))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(len(chunks[0]), 0)
+        self.assertListEqual(list(chunks[0].columns), ["a", "b"])
+
+
+class MockResult(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def keys(self):
+        return [x[0] for x in self.cursor.description]
+
+    def fetchmany(self, n):
+        return self.cursor.fetchmany(n)
+
+    def close(self):
+        self.cursor.close()
+
+
+class MockConnection(object):
+    def __init__(self, path):
+        self.con = sqlite3.connect(path)
+
+    def execution_options(self, **kwargs):
+        return self
+
+    def execute(self, S):
+        return MockResult(self.con.execute(S))
+
+    def close(self):
+        self.con.close()
+
+
+class MockEngine(object):
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        return MockConnection(self.path)
+
+
+class TestQueryExecutor(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = os.path.join(self.path, "test.db")
+        con = sqlite3.connect(self.db)
+        con.execute("CREATE TABLE T (a INT)")
+        con.executemany("INSERT INTO T VALUES (?)",
+                        [(i,) for i in range(100)])
+        con.commit()
+        con.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_submit(self):
+        executor = QueryExecutor(MockEngine(self.db), 4, chunk_size=7)
+        results = [
+            executor.submit(
+                "SELECT a FROM T WHERE a >= {} AND a < {} ORDER BY a".format(
+                    i * 10, (i + 1) * 10))
+            for i in range(10)]
+        for i, result in enumerate(results):
+            columns, chunks = result.get()
+            self.assertListEqual(list(columns), ["a"])
+            df = pd.concat(chunks)
+            self.assertListEqual(df["a"].tolist(),
+                                 list(range(i * 10, (i + 1) * 10)))
+        executor.shutdown()
+
+    def test_submit_error(self):
+        executor = QueryExecutor(MockEngine(self.db), 2)
+        result = executor.submit("SELECT b FROM T")
+        self.assertRaises(sqlite3.OperationalError, result.get)
+        executor.shutdown()
+
+
 def main():
     suite = unittest.TestSuite([
-        unittest.TestLoader().loadTestsFromTestCase(TestQueries)])
+        unittest.TestLoader().loadTestsFromTestCase(TestQueries),
+        unittest.TestLoader().loadTestsFromTestCase(TestFetchChunks),
+        unittest.TestLoader().loadTestsFromTestCase(TestQueryExecutor)])
     unittest.TextTestRunner().run(suite)
 
 if __name__ == '__main__':
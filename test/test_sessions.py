@@ -14,9 +14,9 @@ import pandas as pd
 from coquery.coquery import options
 from coquery.session import SessionInputFile, SessionCommandLine
 from coquery.defines import (QUERY_MODE_TOKENS, CONTEXT_NONE,
-                             DEFAULT_CONFIGURATION)
+                             CONTEXT_COLUMNS, DEFAULT_CONFIGURATION)
 from coquery.errors import TokenParseError
-from coquery.functions import StringExtract
+from coquery.functions import Function, StringExtract
 from coquery.functionlist import FunctionList
 from coquery.corpus import SQLResource, CorpusClass
 from coquery.managers import Manager, Summary
@@ -31,6 +31,27 @@ class TestResource(SQLResource):
     query_item_word = "word_label"
 
 
+class MockContext(Function):
+    _name = "coq_context_mock"
+
+    def get_id(self):
+        return self._name
+
+    def evaluate(self, df, **kwargs):
+        return df["coq_word_label_1"].str.upper()
+
+
+class MockContextManager(Manager):
+    def _get_main_functions(self, df, session):
+        super(MockContextManager, self)._get_main_functions(df, session)
+        return [MockContext()]
+
+
+class MockQuery(object):
+    def insert_static_data(self, df):
+        return df
+
+
 class TestSessionInputFile(unittest.TestCase):
     def setUp(self):
         options.cfg = argparse.Namespace()
@@ -258,6 +279,22 @@ class TestSessionMethods(unittest.TestCase):
             [self.session.translate_header(x) for x in df.columns],
             ["Left context(3)", "Right context(5)"])
 
+    def test_save_chunk_context(self):
+        options.cfg.context_mode = CONTEXT_COLUMNS
+        options.cfg.context_restrict = False
+        manager = MockContextManager()
+        saved = []
+        self.session.save_dataframe = lambda df, append: saved.append(df)
+
+        for chunk in (["a", "b"], ["c", "d"]):
+            df = pd.DataFrame({"coq_word_label_1": chunk})
+            manager.set_column_order(df.columns)
+            self.session.save_chunk(MockQuery(), manager, df)
+
+        self.assertListEqual(
+            [df["coq_context_mock"].tolist() for df in saved],
+            [["A", "B"], ["C", "D"]])
+
 
 def main():
     suite = unittest.TestSuite([
@@ -10,9 +10,19 @@ coquery$ python -m test.test_tables
 
 from __future__ import print_function
 
+import argparse
+import io
+import os
+import sqlite3
+import tempfile
 import unittest
 
+import pandas as pd
+
+from coquery import options
 from coquery import tables
+from coquery.connections import SQLiteConnection
+from coquery.sqlwrap import SqlDB
 from coquery.defines import SQL_MYSQL, SQL_SQLITE
 
 
@@ -24,6 +34,21 @@ def simple(s):
     return s.strip()
 
 
+class MockEngine(sqlite3.Connection):
+    """
+    An in-memory SQLite database that serves both as the engine and as the
+    connection of an SqlDB instance.
+    """
+    def connect(self):
+        return self
+
+    def raw_connection(self):
+        return self
+
+    def close(self):
+        pass
+
+
 class TestColumns(unittest.TestCase):
     def test_init(self):
         name = "Label"
@@ -137,6 +162,96 @@ class TestTables(unittest.TestCase):
         self.table.add(self.val2)
         self.table.add(self.val3)
 
+    def _get_db(self):
+        engine = sqlite3.connect(":memory:", factory=MockEngine)
+        connection = SQLiteConnection("test", "")
+        connection.get_engine = lambda *args, **kwargs: engine
+        options.cfg = argparse.Namespace()
+        options.cfg.current_connection = connection
+        options.cfg.explain_queries = False
+        db = SqlDB(None, None, SQL_SQLITE, None, None, "test")
+        db.connection = engine
+        return db
+
+    def test_bulk_insert(self):
+        db = self._get_db()
+        db.execute("CREATE TABLE Test (ID INT, Label TEXT, Value REAL)")
+        df = pd.DataFrame({"ID": [1, 2, 3],
+                           "Label": ["a", None, "c\td"],
+                           "Value": [0.5, 1.5, None]})
+        self.assertEqual(db.bulk_insert(df, "Test"), 3)
+        self.assertEqual(db.bulk_insert(df.iloc[:0], "Test"), 0)
+
+        rows = db.connection.execute(
+            "SELECT ID, Label, Value FROM Test ORDER BY ID").fetchall()
+        self.assertListEqual(rows,
+                             [(1, "a", 0.5), (2, None, 1.5),
+                              (3, "c\td", None)])
+
+    def test_load_file(self):
+        db = self._get_db()
+        db.execute("CREATE TABLE Test (ID INT, Label TEXT, Value TEXT)")
+        handle, file_name = tempfile.mkstemp()
+        self.addCleanup(os.remove, file_name)
+        with io.open(handle, "w", encoding="utf-8") as f:
+            f.write("1\tab\tc  \n"
+                    "2\td\x00e\tf\x00\r\n"
+                    "  3\tg\th\t\n"
+                    "4\t\u00e4\ti")
+
+        # read the file in several chunks:
+        lines = db.load_file(file_name, "utf-8", "Test", None,
+                             sep="\t", header=None,
+                             names=["ID", "Label", "Value"], chunksize=3)
+        self.assertEqual(lines, 4)
+        rows = db.connection.execute(
+            "SELECT ID, Label, Value FROM Test ORDER BY ID").fetchall()
+        self.assertListEqual(rows,
+                             [(1, "ab", "c"), (2, "de", "f"),
+                              (3, "g", "h"), (4, "\u00e4", "i")])
+
+    def test_create_indices(self):
+        db = self._get_db()
+        db.execute("CREATE TABLE Test (ID INT, Label TEXT, Value REAL)")
+        counts = []
+        db.create_indices(
+            [("Test", "Label", ["Label"], None),
+             ("Test", "Label_Value", ["Label", "Value"], None),
+             ("Missing", "Value", ["Value"], None)],
+            callback=counts.append)
+        self.assertListEqual(counts, [1, 2, 3])
+        indices = db.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+        self.assertListEqual(sorted(indices), [("Label",), ("Label_Value",)])
+
+    def test_commit(self):
+        db = self._get_db()
+        self.table.name = "Words"
+        db.execute("CREATE TABLE Words (ID INT, Label TEXT, Value INT, "
+                   "Category TEXT, LinkId INT)")
+        self._add_all_test_columns()
+        self.table.setDB(db)
+        self._add_default_values()
+        self.table.commit()
+
+        df = pd.read_sql("SELECT * FROM Words", db.connection)
+        self.assertListEqual(df["ID"].tolist(), [1, 2, 3])
+        self.assertListEqual(df["Label"].tolist(),
+                             ["test1", "test2", "test3"])
+        self.assertListEqual(df["LinkId"].tolist(), [100, 101, 102])
+
+    def test_prepare_column(self):
+        self.assertListEqual(tables._prepare_column((1, 2, 3)), [1, 2, 3])
+        self.assertListEqual(tables._prepare_column(("walk", "talk")),
+                             ["walk", "talk"])
+        self.assertListEqual(
+            tables._prepare_column(("walk", None, float("nan"))),
+            ["walk", "", ""])
+        # NFKC normalization of a ligature and of a full-width letter:
+        self.assertListEqual(
+            tables._prepare_column(("\ufb01ne", "\uff21", "a", 1)),
+            ["fine", "A", "a", 1])
+
     def test_get_column_order(self):
         self.table.add_column(self.identifier)
         self.table.add_column(self.col1)
@@ -309,6 +424,48 @@ class TestTables(unittest.TestCase):
         self.assertEqual(id_new3, 6)
         self.assertEqual(len(self.table._add_lookup), 6)
 
+    def test_take_records(self):
+        self._add_all_test_columns()
+        self.table.start_recording()
+        self.table.get_or_insert(self.val1)
+        self.table.add(self.val2)
+        self.table.get_or_insert(self.val1)
+
+        rows, lookup = self.table.take_records()
+        self.assertListEqual(rows, [(1, "test1", 1, "val1", 100),
+                                    (2, "test2", 2, "val2", 101)])
+        self.assertListEqual(lookup, [True, False])
+
+        # the lookup is kept after the records are taken:
+        self.assertEqual(self.table.get_or_insert(self.val1), 1)
+        self.assertEqual(self.table.get_or_insert(self.val3), 3)
+        rows, lookup = self.table.take_records()
+        self.assertListEqual(rows, [(3, "test3", 3, "val3", 102)])
+        self.assertListEqual(lookup, [True])
+
+    def test_find_recording(self):
+        self._add_all_test_columns()
+        self.table.start_recording()
+        self._add_default_values()
+        self.table.take_records()
+        self.assertEqual(self.table.find({"Label": "test2"}), 2)
+        self.assertEqual(self.table.find({"Label": "test4"}), None)
+
+        # the index is updated by later insertions:
+        self.table.get_or_insert(self.val3)
+        self.assertEqual(self.table.find({"Label": "test3"}), 3)
+
+    def test_find_recording_spilled(self):
+        self._add_all_test_columns()
+        self.table.set_max_lookup(2)
+        self._add_default_values()
+        self.table.start_recording()
+        self.assertEqual(len(self.table._add_lookup._segments), 1)
+        self.assertEqual(self.table.find(self.val2), 2)
+        self.assertEqual(self.table.find({"Label": "test3"}), 3)
+        self.assertEqual(self.table.find({"Label": "test4"}), None)
+        self.table.close_lookup()
+
     def test_suggest_data_type(self):
         raise unittest.SkipTest
 
@@ -316,7 +473,81 @@ class TestTables(unittest.TestCase):
         raise unittest.SkipTest
 
 
-provided_tests = TestColumns, TestIdentifier, TestLinks, TestTables
+class TestLexicon(unittest.TestCase):
+    def test_memory(self):
+        lexicon = tables.Lexicon()
+        lexicon[("walk", "VB")] = 1
+        lexicon[("walk", "NN")] = 2
+        self.assertEqual(len(lexicon), 2)
+        self.assertEqual(lexicon[("walk", "NN")], 2)
+        self.assertIn(("walk", "VB"), lexicon)
+        self.assertNotIn(("talk", "VB"), lexicon)
+        self.assertEqual(lexicon.get(("talk", "VB")), None)
+        self.assertRaises(KeyError, lambda: lexicon[("talk", "VB")])
+        self.assertEqual(lexicon.disk_usage(), 0)
+        self.assertGreater(lexicon.memory_usage(), 0)
+
+    def test_spill(self):
+        lexicon = tables.Lexicon(max_size=2)
+        lexicon[("walk", 1, None)] = 1
+        lexicon[("walk", 2, None)] = 2
+        lexicon[("talk", 1, 0.5)] = 3
+        path = lexicon._path
+        self.assertEqual(len(lexicon._memory), 1)
+        self.assertEqual(len(lexicon), 3)
+        self.assertGreater(lexicon.disk_usage(), 0)
+
+        self.assertEqual(lexicon[("walk", 1, None)], 1)
+        self.assertEqual(lexicon[("walk", 2, None)], 2)
+        self.assertEqual(lexicon[("talk", 1, 0.5)], 3)
+        self.assertNotIn(("talk", 2, 0.5), lexicon)
+        self.assertListEqual(sorted(lexicon.items(), key=lambda x: x[1]),
+                             [(("walk", 1, None), 1),
+                              (("walk", 2, None), 2),
+                              (("talk", 1, 0.5), 3)])
+
+        lexicon.close()
+        self.assertEqual(len(lexicon), 0)
+        self.assertFalse(os.path.exists(path))
+
+    def test_spill_normalized_keys(self):
+        lexicon = tables.Lexicon(max_size=2)
+        lexicon[("a", 1)] = 1
+        lexicon[("b", 2.0)] = 2
+        self.assertEqual(len(lexicon._memory), 0)
+        self.assertEqual(lexicon.get(("a", 1.0)), 1)
+        self.assertEqual(lexicon.get(("b", 2)), 2)
+        self.assertEqual(lexicon.get((b"a", 1)), 1)
+        self.assertEqual(lexicon.get(("a", 1.5)), None)
+        lexicon.close()
+
+    def test_find(self):
+        lexicon = tables.Lexicon(max_size=2)
+        lexicon[("walk", "VB")] = 1
+        lexicon[("walk", "NN")] = 2
+        lexicon[("talk", "VB")] = 3
+        self.assertEqual(lexicon.find({0: "talk"}), 3)
+        self.assertIn(lexicon.find({0: "walk"}), [1, 2])
+        self.assertEqual(lexicon.find({1: "NN"}), 2)
+        self.assertEqual(lexicon.find({0: "run"}), None)
+        lexicon[("run", "VB")] = 4
+        self.assertEqual(lexicon.find({0: "run"}), 4)
+        lexicon.close()
+
+    def test_table_lookup(self):
+        table = tables.Table("Lexicon")
+        table.add_column(tables.Identifier("WordId", "INT"))
+        table.add_column(tables.Column("Word", "VARCHAR(10)"))
+        table.set_max_lookup(2)
+        ids = [table.get_or_insert({"Word": x})
+               for x in ["a", "b", "c", "a", "b", "d", "c"]]
+        self.assertListEqual(ids, [1, 2, 3, 1, 2, 4, 3])
+        self.assertEqual(table.get_lookup_usage()[0], 4)
+        table.close_lookup()
+
+
+provided_tests = (TestColumns, TestIdentifier, TestLinks, TestTables,
+                  TestLexicon)
 
 
 def main():